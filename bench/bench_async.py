@@ -0,0 +1,108 @@
+"""
+End-to-end latency of concurrent client sessions through the asyncio front end
+
+usage:
+    python3 ./bench/bench_async.py
+    python3 ./bench/bench_async.py --clients 64 --zipf 1.2 --policy wound_wait
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from asyncFrontend import AsyncFrontend, RequestRejected, TransactionAborted, TransactionStalled
+from transactionManager import DEADLOCK_POLICY
+from eventLog import SilentSink
+from workload import Workload
+
+def percentile(samples: list, p: float) -> float:
+    """
+    Nearest-rank percentile of sorted samples
+    """
+    if not samples:
+        return 0.0
+    return samples[min(len(samples) - 1, max(0, int(round(p / 100 * len(samples))) - 1))]
+
+async def client(frontend: AsyncFrontend, workload: Workload, transactions: int, seed: int, latencies: dict) -> None:
+    """
+    Run transactions one after the other, timing every request and every transaction.
+    A stalled client gives up and ends its transaction, a rejected request is skipped
+    """
+    rand = random.Random(seed)
+    clock = time.perf_counter
+    for _ in range(transactions):
+        read_only = rand.random() < workload.read_only
+        start = clock()
+        session = await frontend.begin(read_only=read_only)
+        try:
+            for _ in range(workload.operations):
+                var = workload.variable(rand)
+                sent = clock()
+                try:
+                    if not read_only and rand.random() < workload.write_ratio:
+                        await session.write(var, rand.randrange(1000))
+                        latencies['write'].append(clock() - sent)
+                    else:
+                        await session.read(var)
+                        latencies['read'].append(clock() - sent)
+                except RequestRejected:
+                    latencies['rejected'].append(clock() - sent)
+            sent = clock()
+            committed = await session.end()
+            latencies['end'].append(clock() - sent)
+        except TransactionAborted:
+            committed = await session.end()
+        except TransactionStalled:
+            latencies['stalled'].append(clock() - sent)
+            committed = await session.end()
+        latencies['transaction' if committed else 'aborted'].append(clock() - start)
+
+async def run(args: argparse.Namespace) -> tuple:
+    frontend = AsyncFrontend(log=SilentSink(), num_sites=args.sites, num_variables=args.variables,
+                             deadlock_policy=DEADLOCK_POLICY[args.policy.upper()], processes=args.processes)
+    frontend.tm.commit_window = args.group_commit
+    frontend.tm.lock_timeout = args.lock_timeout
+    frontend.tm.max_queue = args.max_queue
+    workload = Workload(write_ratio=args.write_ratio, zipf=args.zipf, read_only=args.read_only,
+                        operations=args.operations, num_sites=args.sites, num_variables=args.variables)
+    latencies = {'read': [], 'write': [], 'end': [], 'stalled': [], 'rejected': [], 'transaction': [], 'aborted': []}
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(client(frontend, workload, args.transactions, args.seed + i, latencies)
+                               for i in range(args.clients)))
+    finally:
+        frontend.close()
+    return latencies, time.perf_counter() - start
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Latency of concurrent sessions through the asyncio front end')
+    parser.add_argument('--clients', type=int, default=16, help='client coroutines running at the same time')
+    parser.add_argument('--transactions', type=int, default=50, help='transactions run by every client')
+    parser.add_argument('--operations', type=int, default=4, help='reads and writes per transaction')
+    parser.add_argument('--write-ratio', type=float, default=0.5)
+    parser.add_argument('--zipf', type=float, default=0.0, help='key skew, 0 for uniform')
+    parser.add_argument('--read-only', type=float, default=0.0, help='fraction of read-only transactions')
+    parser.add_argument('--sites', type=int, default=10)
+    parser.add_argument('--variables', type=int, default=20)
+    parser.add_argument('--policy', choices=[p.name.lower() for p in DEADLOCK_POLICY], default='detection')
+    parser.add_argument('--group-commit', type=int, default=0, metavar='TICKS')
+    parser.add_argument('--lock-timeout', type=int, default=0, metavar='TICKS',
+                        help='abort a transaction whose request waited this many ticks for a lock')
+    parser.add_argument('--max-queue', type=int, default=0, metavar='REQUESTS',
+                        help='reject the requests arriving while this many are waiting')
+    parser.add_argument('--processes', action='store_true', help='run every site in its own process')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    latencies, elapsed = asyncio.run(run(args))
+    requests = sum(len(latencies[kind]) for kind in ('read', 'write', 'end'))
+    print("{} clients, {} requests in {:.3f} s, {:.0f} requests/s, {} committed, {} aborted".format(
+        args.clients, requests, elapsed, requests / elapsed, len(latencies['transaction']), len(latencies['aborted'])))
+    print("{:12} {:>8} {:>10} {:>10} {:>10} {:>10}".format("latency ms", "count", "p50", "p95", "p99", "max"))
+    for kind, samples in latencies.items():
+        samples.sort()
+        print("{:12} {:>8} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f}".format(
+            kind, len(samples), *(percentile(samples, p) * 1000 for p in (50, 95, 99, 100))))
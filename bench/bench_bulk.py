@@ -0,0 +1,63 @@
+"""
+Time to seed, export and dump a large database, and to write and read its columns as a .npz file
+
+usage:
+    python3 ./bench/bench_bulk.py
+    python3 ./bench/bench_bulk.py --variables 100000 --storage memory
+"""
+import argparse
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import columnar
+from transactionManager import TransactionManager
+from eventLog import LEVEL, TextSink
+
+def timed(results: list, name: str, function, *args):
+    """
+    Call the function, append its name and duration to the results and return its result
+    """
+    start = time.perf_counter()
+    result = function(*args)
+    results.append((name, time.perf_counter() - start))
+    return result
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Bulk load and export of the whole database')
+    parser.add_argument('--variables', type=int, default=1000000)
+    parser.add_argument('--sites', type=int, default=10)
+    parser.add_argument('--storage', choices=['memory', 'mmap'], default='mmap')
+    parser.add_argument('--processes', action='store_true', help='run every site in its own process')
+    args = parser.parse_args()
+
+    results = []
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'seed.npz')
+    try:
+        seed = {'variable': range(1, args.variables + 1), 'value': range(args.variables)}
+        timed(results, 'save seed', columnar.save, path, seed)
+        start = time.perf_counter()
+        tm = TransactionManager(args.sites, args.variables, log=TextSink(LEVEL.INFO, io.StringIO(), 1 << 20),
+                                storage=args.storage, processes=args.processes)
+        results.append(('create', time.perf_counter() - start))
+        try:
+            columns = timed(results, 'load seed', columnar.load, path)
+            timed(results, 'seed', tm.seed, columns)
+            exported = timed(results, 'export', tm.export)
+            timed(results, 'export x2..x20', tm.export, ["x" + str(i) for i in range(2, 21, 2)])
+            timed(results, 'save export', columnar.save, path, exported)
+            timed(results, 'dump (text)', tm.dump)
+        finally:
+            tm.close()
+    finally:
+        shutil.rmtree(directory)
+
+    print("{} variables, {} replicas, storage {}, NumPy {}".format(
+        args.variables, len(exported['value']), args.storage, 'available' if columnar.numpy is not None else 'missing'))
+    for name, elapsed in results:
+        print("{:16} {:>10.1f} ms".format(name, elapsed * 1000))
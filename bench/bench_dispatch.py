@@ -0,0 +1,61 @@
+"""
+Cost of decoding and dispatching commands compared with running them
+
+usage: python3 ./bench/bench_dispatch.py [num_transactions]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from iohandler import TOKEN_PATTERN, decode
+from transactionManager import TransactionManager
+
+def make_lines(num_transactions: int) -> list:
+    """
+    Transactions reading and writing disjoint variables, so nothing blocks
+    """
+    lines = []
+    for i in range(num_transactions):
+        tid = "T{}".format(i)
+        var = "x{}".format(i % 20 + 1)
+        lines.append("begin({})".format(tid))
+        lines.append("R({},{})".format(tid, var))
+        lines.append("W({},{},{})".format(tid, var, i))
+        lines.append("end({})".format(tid))
+    return lines
+
+def timed(fn) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+if __name__ == '__main__':
+    num_transactions = int(sys.argv[1]) if len(sys.argv) >= 2 else 20000
+    lines = make_lines(num_transactions)
+    tokens = [TOKEN_PATTERN.findall(line) for line in lines]
+    operations = [decode(args) for args in tokens]
+
+    tokenize_time = timed(lambda: [TOKEN_PATTERN.findall(line) for line in lines])
+    decode_time = timed(lambda: [decode(args) for args in tokens])
+
+    # Dispatch only: the same table lookup operate() does, with handlers that do nothing
+    noop = lambda op: None
+    handlers = {op.type: noop for op in operations}
+    def dispatch():
+        for op in operations:
+            handlers[op.type](op)
+    dispatch_time = timed(dispatch)
+
+    tm = TransactionManager()
+    def run():
+        for op in operations:
+            tm.operate(op)
+    operate_time = timed(run)
+
+    n = len(operations)
+    print("commands: {}".format(n))
+    for name, seconds in (('tokenize', tokenize_time), ('decode', decode_time),
+                          ('dispatch', dispatch_time), ('operate', operate_time)):
+        print("{:9} {:8.3f} us/command".format(name, seconds / n * 1e6))
+    print("dispatch share of operate: {:.1%}".format(dispatch_time / operate_time))
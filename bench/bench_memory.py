@@ -0,0 +1,61 @@
+"""
+Memory used by the variable and lock tables of every site
+
+usage: python3 ./bench/bench_memory.py [num_sites] [num_variables]
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from transactionManager import TransactionManager
+
+def resident_memory() -> int:
+    """
+    Current resident set size of this process in bytes, 0 if unknown
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return 0
+
+def measure(num_sites: int, num_variables: int) -> dict:
+    """
+    Build the sites once untraced for the time and the resident memory,
+    then once under tracemalloc for the bytes allocated
+    """
+    rss_before = resident_memory()
+    start = time.perf_counter()
+    tm = TransactionManager(num_sites, num_variables)
+    elapsed = time.perf_counter() - start
+    rss_after = resident_memory()
+    replicas = sum(len(site.variables) for site in tm.sites)
+    del tm
+
+    tracemalloc.start()
+    tm = TransactionManager(num_sites, num_variables)
+    traced, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del tm
+
+    return {
+        'sites': num_sites,
+        'variables': num_variables,
+        'replicas': replicas,
+        'init_seconds': elapsed,
+        'traced_bytes': traced,
+        'bytes_per_replica': traced / replicas if replicas else 0,
+        'rss_bytes': rss_after - rss_before,
+    }
+
+if __name__ == '__main__':
+    num_sites = int(sys.argv[1]) if len(sys.argv) >= 2 else 10
+    num_variables = int(sys.argv[2]) if len(sys.argv) >= 3 else 100000
+    result = measure(num_sites, num_variables)
+    print("sites: {sites}  variables: {variables}  replicas: {replicas}".format(**result))
+    print("init time:         {:10.3f} s".format(result['init_seconds']))
+    print("traced memory:     {:10.1f} MiB".format(result['traced_bytes'] / 2**20))
+    print("bytes per replica: {:10.1f}".format(result['bytes_per_replica']))
+    print("resident growth:   {:10.1f} MiB".format(result['rss_bytes'] / 2**20))
@@ -0,0 +1,50 @@
+"""
+Time a site takes to reload its versions from the checkpoint and the write-ahead log,
+for growing histories with and without checkpoints
+
+usage: python3 ./bench/bench_recovery.py [num_variables]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from dataManager import DataManager
+from siteLog import SiteLog
+
+def build_site(directory: str, num_variables: int, commits: int, checkpoint_interval: int) -> DataManager:
+    """
+    A site holding x1..x<num_variables> on which every commit wrote one variable
+    """
+    wal = SiteLog(directory, 1, checkpoint_interval)
+    site = DataManager(1, variables=[(i, False) for i in range(1, num_variables + 1)], wal=wal)
+    for ts in range(1, commits + 1):
+        tid = "T{}".format(ts)
+        var_id = "x{}".format(ts % num_variables + 1)
+        site.if_can_write(tid, var_id)
+        site.local_write(var_id, ts, tid)
+        site.commit(tid, ts)
+        site.collect_versions(ts)
+    return site
+
+def measure(num_variables: int, commits: int, checkpoint_interval: int) -> float:
+    directory = tempfile.mkdtemp()
+    try:
+        site = build_site(directory, num_variables, commits, checkpoint_interval)
+        start = time.perf_counter()
+        site.load()
+        elapsed = time.perf_counter() - start
+        site.wal.close()
+        return elapsed
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    num_variables = int(sys.argv[1]) if len(sys.argv) >= 2 else 1000
+    print("{:>10} {:>14} {:>18}".format("commits", "no checkpoint", "checkpoint / 4096"))
+    for commits in (10000, 50000, 200000):
+        full = measure(num_variables, commits, commits + 1)
+        tail = measure(num_variables, commits, 4096)
+        print("{:>10} {:>12.1f} ms {:>15.1f} ms".format(commits, full * 1000, tail * 1000))
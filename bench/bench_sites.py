@@ -0,0 +1,56 @@
+"""
+Throughput of the transaction manager with the sites in process and in their own processes,
+for a growing number of sites. Every site holds every even variable, so the writes and commits
+to replicated variables reach all the sites
+
+usage: python3 ./bench/bench_sites.py [--transactions N] [--sites N ...] [--durable]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from iohandler import TOKEN_PATTERN, decode
+from transactionManager import TransactionManager
+from eventLog import SilentSink
+from workload import Workload
+
+def measure(num_sites: int, transactions: int, processes: bool, durable: bool) -> float:
+    """
+    Operations per second of a write heavy closed-loop workload
+    """
+    workload = Workload(transactions=transactions, concurrency=8, write_ratio=0.8, num_sites=num_sites, seed=1)
+    data_dir = tempfile.mkdtemp() if durable else None
+    tm = TransactionManager(num_sites, workload.num_variables, log=SilentSink(), data_dir=data_dir, processes=processes)
+    try:
+        lines = workload.lines(blocked=lambda tid: tid in tm.transaction_commands,
+                               finished=lambda tid: tid not in tm.transactions)
+        count = 0
+        start = time.perf_counter()
+        for line in lines:
+            tm.operate(decode(TOKEN_PATTERN.findall(line)))
+            count += 1
+        tm.drain()
+        elapsed = time.perf_counter() - start
+    finally:
+        tm.close()
+        if data_dir is not None:
+            shutil.rmtree(data_dir)
+    return count / elapsed
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare sites in process and in their own processes')
+    parser.add_argument('--transactions', type=int, default=300)
+    parser.add_argument('--sites', type=int, nargs='+', help='numbers of sites to compare')
+    parser.add_argument('--durable', action='store_true', help='keep a write-ahead log of every site')
+    args = parser.parse_args()
+
+    print("{} CPUs".format(os.cpu_count()))
+    print("{:>6} {:>14} {:>14} {:>9}".format("sites", "in process", "processes", "speedup"))
+    for num_sites in args.sites or [2, 5, 10, 20, 40]:
+        local = measure(num_sites, args.transactions, False, args.durable)
+        parallel = measure(num_sites, args.transactions, True, args.durable)
+        print("{:>6} {:>10.0f} op/s {:>10.0f} op/s {:>8.2f}x".format(num_sites, local, parallel, parallel / local))
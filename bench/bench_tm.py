@@ -0,0 +1,182 @@
+"""
+Benchmark of the transaction manager on synthetic workloads
+
+usage:
+    python3 ./bench/bench_tm.py                          run every scenario
+    python3 ./bench/bench_tm.py --scenario skewed       run one scenario
+    python3 ./bench/bench_tm.py --transactions 5000 --zipf 1.2 --concurrency 16
+    python3 ./bench/bench_tm.py --json new.json --compare old.json
+    python3 ./bench/bench_tm.py --scenario contended --policy detection --policy wait_die --policy wound_wait
+    python3 ./bench/bench_tm.py --scenario uniform --processes
+    python3 ./bench/bench_tm.py --scenario skewed --routing first --routing least_queued
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from iohandler import TOKEN_PATTERN, decode
+from transactionManager import TransactionManager, DEADLOCK_POLICY, READ_ROUTING
+from metrics import Metrics
+from eventLog import EventSink, LEVEL
+from workload import Workload, add_arguments, from_arguments
+
+SCENARIOS = {
+    'uniform': dict(transactions=500, concurrency=4),
+    'contended': dict(transactions=500, concurrency=16, write_ratio=0.7),
+    'skewed': dict(transactions=500, concurrency=8, zipf=1.2),
+    'read_only': dict(transactions=500, concurrency=8, read_only=0.5, write_ratio=0.8),
+    'failures': dict(transactions=500, concurrency=8, fail_rate=0.01),
+    'large': dict(transactions=500, concurrency=8, num_sites=50, num_variables=10000),
+}
+
+class CountingSink(EventSink):
+    def __init__(self) -> None:
+        """
+        Count the commits and aborts without formatting anything
+        """
+        super().__init__(LEVEL.DEBUG)
+        self.counts = {'commit': 0, 'abort': 0}
+
+    def event(self, name: str, **fields) -> None:
+        if name in self.counts:
+            self.counts[name] += 1
+
+def run(workload: Workload, open_loop: bool=False, trace_memory: bool=False,
+        policy: DEADLOCK_POLICY=DEADLOCK_POLICY.DETECTION, commit_window: int=0, processes: bool=False,
+        routing: READ_ROUTING=READ_ROUTING.FIRST, lock_timeout: int=0, max_queue: int=0,
+        max_outstanding: int=0) -> dict:
+    """
+    Drive a TransactionManager with the workload. By default the transactions wait for their
+    last operation before sending the next one, open_loop replays the trace main.py would read
+    """
+    log = CountingSink()
+    metrics = Metrics()
+    tm = TransactionManager(workload.num_sites, workload.num_variables, log=log, metrics=metrics,
+                            deadlock_policy=policy, processes=processes, read_routing=routing)
+    tm.commit_window = commit_window
+    tm.lock_timeout = lock_timeout
+    tm.max_queue = max_queue
+    tm.max_transaction_commands = max_outstanding
+
+    if open_loop:
+        lines = list(workload.lines())
+    else:
+        lines = workload.lines(blocked=lambda tid: tid in tm.transaction_commands,
+                               finished=lambda tid: tid not in tm.transactions)
+
+    if trace_memory:
+        tracemalloc.start()
+    count = 0
+    elapsed = 0.0
+    clock = time.perf_counter
+    for line in lines:
+        op = decode(TOKEN_PATTERN.findall(line))
+        start = clock()
+        tm.operate(op)
+        elapsed += clock() - start
+        count += 1
+    start = clock()
+    tm.drain()
+    elapsed += clock() - start
+    peak = None
+    if trace_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    tm.close()
+
+    result = {
+        'operations': count,
+        'seconds': elapsed,
+        'ops_per_second': count / elapsed if elapsed else 0.0,
+        'queue_retry_seconds': metrics.phase_seconds['command_queue'],
+        'deadlock_detection_seconds': metrics.phase_seconds['deadlock_detection'],
+        'pending_commands': len(tm.command_queue),
+        'read_imbalance': metrics.read_imbalance(),
+        'max_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+    result.update(log.counts)
+    result['deadlock'] = metrics.deadlock_aborts
+    result['timeout'] = metrics.timeout_aborts
+    result['rejected'] = metrics.rejected_commands
+    result['metrics'] = metrics.snapshot()
+    if peak is not None:
+        result['peak_traced_bytes'] = peak
+    return result
+
+def report(name: str, result: dict, baseline: dict=None) -> None:
+    change = ""
+    if baseline and baseline.get('ops_per_second'):
+        change = " ({:+.1%})".format(result['ops_per_second'] / baseline['ops_per_second'] - 1)
+    print("{:21} {:7} ops {:8.3f} s {:10.0f} ops/s{}  retry {:6.3f} s  deadlock {:6.3f} s  "
+          "commits {:5} aborts {:5} deadlocks {:5} timeouts {:5} rejected {:5}  reads {:5.2f}x  maxrss {:7.1f} MiB".format(
+              name, result['operations'], result['seconds'], result['ops_per_second'], change,
+              result['queue_retry_seconds'], result['deadlock_detection_seconds'],
+              result['commit'], result['abort'], result['deadlock'], result.get('timeout', 0), result.get('rejected', 0),
+              result.get('read_imbalance', 0.0),
+              result['max_rss_kib'] / 1024))
+    if 'peak_traced_bytes' in result:
+        print("{:21} peak traced memory {:.1f} MiB".format('', result['peak_traced_bytes'] / 2**20))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the transaction manager')
+    parser.add_argument('--scenario', choices=list(SCENARIOS), action='append',
+                        help='predefined workload, can be repeated, all of them by default')
+    parser.add_argument('--custom', action='store_true', help='run only the workload given by the options below')
+    parser.add_argument('--open-loop', action='store_true', help="don't wait for blocked operations before sending more")
+    parser.add_argument('--trace-memory', action='store_true', help='measure the peak memory with tracemalloc (slower)')
+    parser.add_argument('--policy', choices=[p.name.lower() for p in DEADLOCK_POLICY], action='append',
+                        help='deadlock handling, can be repeated to compare them, detection by default')
+    parser.add_argument('--routing', choices=[r.name.lower() for r in READ_ROUTING], action='append',
+                        help='read routing, can be repeated to compare them, first by default')
+    parser.add_argument('--group-commit', type=int, default=0, metavar='TICKS',
+                        help='apply the commits ended within this many ticks together')
+    parser.add_argument('--lock-timeout', type=int, default=0, metavar='TICKS',
+                        help='abort a transaction whose command waited this many ticks for a lock')
+    parser.add_argument('--max-queue', type=int, default=0, metavar='COMMANDS',
+                        help='reject the reads and writes arriving while this many commands are queued')
+    parser.add_argument('--max-outstanding', type=int, default=0, metavar='COMMANDS',
+                        help='reject the reads and writes of a transaction that has this many queued commands')
+    parser.add_argument('--processes', action='store_true', help='run every site in its own process')
+    parser.add_argument('--json', help='save the results to this file')
+    parser.add_argument('--compare', help='results saved by a previous run to compare the throughput with')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    # a workload option other than --seed changed from its default asks for the custom workload,
+    # the seed is also given to the predefined ones
+    workload_parser = argparse.ArgumentParser(add_help=False)
+    add_arguments(workload_parser)
+    custom = args.custom or any(getattr(args, name) != default
+                                for name, default in vars(workload_parser.parse_args([])).items() if name != 'seed')
+    if custom:
+        workloads = {'custom': from_arguments(args)}
+    else:
+        names = args.scenario or list(SCENARIOS)
+        workloads = {name: Workload(seed=args.seed, **SCENARIOS[name]) for name in names}
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    policies = args.policy or ['detection']
+    routings = args.routing or ['first']
+    results = {}
+    for name, workload in workloads.items():
+        for policy in policies:
+            for routing in routings:
+                key = name if len(policies) == 1 else name + '/' + policy
+                key = key if len(routings) == 1 else key + '/' + routing
+                results[key] = run(workload, args.open_loop, args.trace_memory, DEADLOCK_POLICY[policy.upper()],
+                                   args.group_commit, args.processes, READ_ROUTING[routing.upper()],
+                                   args.lock_timeout, args.max_queue, args.max_outstanding)
+                report(key, results[key], baseline.get(key))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,126 @@
+"""
+Synthetic workloads in the input grammar: begin, beginRO, R, W, end, fail, recover
+
+usage: python3 ./bench/workload.py [options] > trace.txt
+"""
+import argparse
+import random
+from bisect import bisect_left
+from itertools import accumulate
+
+class Workload:
+    def __init__(self, transactions: int=1000, operations: int=4, write_ratio: float=0.5, zipf: float=0.0,
+                 read_only: float=0.0, concurrency: int=4, fail_rate: float=0.0, num_sites: int=10,
+                 num_variables: int=20, seed: int=0) -> None:
+        """[summary]
+        transactions (int): number of transactions
+        operations (int): reads and writes per transaction
+        write_ratio (float): fraction of the operations of read-write transactions that are writes
+        zipf (float): skew of the variables accessed, 0 for uniform, around 1 for a few hot keys
+        read_only (float): fraction of read-only transactions
+        concurrency (int): number of transactions running at the same time, i.e. the contention level
+        fail_rate (float): probability that a site fails after each operation, a failed site recovers later
+        num_sites (int), num_variables (int): size of the database
+        seed (int): the same parameters and seed give the same trace
+        """
+        self.transactions = transactions
+        self.operations = operations
+        self.write_ratio = write_ratio
+        self.zipf = zipf
+        self.read_only = read_only
+        self.concurrency = max(1, concurrency)
+        self.fail_rate = fail_rate
+        self.num_sites = num_sites
+        self.num_variables = num_variables
+        self.seed = seed
+
+        # cumulative weights of x1..xn, x1 is the hottest
+        self.weights = list(accumulate(1.0 / (k ** zipf) for k in range(1, num_variables + 1)))
+
+    def variable(self, rand: random.Random) -> str:
+        i = bisect_left(self.weights, rand.random() * self.weights[-1])
+        return "x{}".format(min(i, self.num_variables - 1) + 1)
+
+    def lines(self, blocked=None, finished=None):
+        """[summary]
+        Generate the trace one line at a time.
+        Without callbacks the trace is open loop: transactions keep sending operations
+        even if an earlier one is still waiting. With them, each transaction behaves like
+        a client waiting for its last operation before sending the next one
+
+        Args:
+            blocked (function): blocked(transaction_id) is True while its last operation waits
+            finished (function): finished(transaction_id) is True once it was aborted by the system
+        """
+        rand = random.Random(self.seed)
+        started = 0
+        active = []         # [transaction_id, read_only, operations left]
+        down = []           # failed sites, recovered in failure order
+        while started < self.transactions or active:
+            while started < self.transactions and len(active) < self.concurrency:
+                started += 1
+                tid = "T{}".format(started)
+                read_only = rand.random() < self.read_only
+                active.append([tid, read_only, self.operations])
+                yield "{}({})".format("beginRO" if read_only else "begin", tid)
+
+            if finished is not None:
+                active = [txn for txn in active if not finished(txn[0])]
+                if not active:
+                    continue
+            ready = active
+            if blocked is not None:
+                ready = [txn for txn in active if not blocked(txn[0])]
+                if not ready:
+                    if down:
+                        # the waiting transactions may need a failed site back
+                        yield "recover({})".format(down.pop(0))
+                        continue
+                    # nothing can make progress, the client of the oldest one gives up
+                    ready = active[:1]
+                    ready[0][2] = 0
+
+            txn = ready[rand.randrange(len(ready))]
+            tid, read_only, left = txn
+            if left == 0:
+                active.remove(txn)
+                yield "end({})".format(tid)
+            else:
+                txn[2] -= 1
+                var = self.variable(rand)
+                if not read_only and rand.random() < self.write_ratio:
+                    yield "W({},{},{})".format(tid, var, rand.randrange(1000))
+                else:
+                    yield "R({},{})".format(tid, var)
+
+            if self.fail_rate and rand.random() < self.fail_rate:
+                if down and (len(down) == self.num_sites or rand.random() < 0.5):
+                    yield "recover({})".format(down.pop(0))
+                else:
+                    site = rand.choice([i for i in range(1, self.num_sites + 1) if i not in down])
+                    down.append(site)
+                    yield "fail({})".format(site)
+        for site in down:
+            yield "recover({})".format(site)
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--transactions', type=int, default=1000)
+    parser.add_argument('--operations', type=int, default=4, help='reads and writes per transaction')
+    parser.add_argument('--write-ratio', type=float, default=0.5)
+    parser.add_argument('--zipf', type=float, default=0.0, help='key skew, 0 for uniform')
+    parser.add_argument('--read-only', type=float, default=0.0, help='fraction of read-only transactions')
+    parser.add_argument('--concurrency', type=int, default=4, help='transactions running at the same time')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='probability of a site failure per operation')
+    parser.add_argument('--sites', type=int, default=10)
+    parser.add_argument('--variables', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+
+def from_arguments(args: argparse.Namespace) -> Workload:
+    return Workload(args.transactions, args.operations, args.write_ratio, args.zipf, args.read_only,
+                    args.concurrency, args.fail_rate, args.sites, args.variables, args.seed)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic trace')
+    add_arguments(parser)
+    for line in from_arguments(parser.parse_args()).lines():
+        print(line)
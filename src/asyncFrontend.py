@@ -0,0 +1,253 @@
+import asyncio
+from eventLog import LEVEL, EventSink, TextSink
+from iohandler import Operation, COMMAND_TYPE
+from transactionManager import TransactionManager
+
+class TransactionAborted(Exception):
+    def __init__(self, transaction_id: str, reason: str='aborted') -> None:
+        """
+        The transaction of a session was aborted while it waited, or before its request
+        """
+        super().__init__("transaction {} {}".format(transaction_id, reason))
+        self.transaction_id = transaction_id
+        self.reason = reason
+
+class TransactionStalled(Exception):
+    def __init__(self, transaction_id: str) -> None:
+        """
+        Every open session was waiting and none of their requests could run, the oldest one gives up.
+        Its transaction is still running, the session can end it
+        """
+        super().__init__("transaction {} stalled, every session is waiting".format(transaction_id))
+        self.transaction_id = transaction_id
+
+class RequestRejected(Exception):
+    def __init__(self, transaction_id: str, reason: str) -> None:
+        """
+        The transaction manager didn't queue the request, see TransactionManager.max_queue.
+        The transaction goes on, the session may send the request again later
+        """
+        super().__init__("request of transaction {} rejected, {}".format(transaction_id, reason))
+        self.transaction_id = transaction_id
+        self.reason = reason
+
+# events aborting a transaction -> reason given to its session
+ABORT_REASONS = {'deadlock': 'aborted by the deadlock detection', 'die': 'died waiting for an older transaction',
+                 'wound': 'wounded by an older transaction', 'timeout': 'waited too long for a lock'}
+
+class SessionSink(EventSink):
+    def __init__(self, log: EventSink) -> None:
+        """[summary]
+        Event log of a TransactionManager driven by an AsyncFrontend. The reads, writes, commits and aborts
+        complete the requests the sessions are waiting for, then every event goes on to the log given
+
+        log (EventSink): where the events are written, at its own level
+        waiting (dict): (transaction_id, (COMMAND_TYPE, asyncio.Future)) the request each session is waiting for
+        aborted (dict): (transaction_id, reason) the transactions aborted by the transaction manager
+                        whose sessions didn't end yet
+        """
+        super().__init__(LEVEL.DEBUG)   # the reads and writes are only reported at LEVEL.DEBUG
+        self.log = log
+        self.waiting = {}
+        self.aborted = {}
+
+    def event(self, name: str, **fields) -> None:
+        transaction_id = fields.get('transaction')
+        if transaction_id is not None:
+            self.__complete(name, transaction_id, fields)
+        self.log.tick = self.tick
+        self.log.event(name, **fields)
+
+    def __complete(self, name: str, transaction_id: str, fields: dict) -> None:
+        if name in ABORT_REASONS:
+            self.aborted[transaction_id] = ABORT_REASONS[name]
+            return
+        request = self.waiting.get(transaction_id)
+        if request is None:
+            if name == 'abort':
+                self.aborted.setdefault(transaction_id, 'aborted')
+            return
+        type, future = request
+        if name == 'read' or name == 'read_ro':
+            if type == COMMAND_TYPE.READ: self.__resolve(transaction_id, future, fields['value'])
+        elif name == 'write':
+            if type == COMMAND_TYPE.WRITE: self.__resolve(transaction_id, future, None)
+        elif name == 'reject':
+            del self.waiting[transaction_id]
+            if not future.done():
+                future.set_exception(RequestRejected(transaction_id, fields['reason']))
+        elif name == 'commit':
+            self.__resolve(transaction_id, future, True)
+        elif name == 'abort':
+            if type == COMMAND_TYPE.END:
+                self.__resolve(transaction_id, future, False)
+            else:
+                reason = self.aborted.setdefault(transaction_id, 'aborted')
+                del self.waiting[transaction_id]
+                if not future.done():
+                    future.set_exception(TransactionAborted(transaction_id, reason))
+
+    def __resolve(self, transaction_id: str, future: asyncio.Future, result) -> None:
+        del self.waiting[transaction_id]
+        if not future.done():
+            future.set_result(result)
+
+    def flush(self) -> None:
+        self.log.flush()
+
+class Session:
+    def __init__(self, frontend, transaction_id: str, read_only: bool) -> None:
+        """[summary]
+        A transaction opened by AsyncFrontend.begin, it sends one request at a time
+
+        transaction_id (str): id of the transaction in the transaction manager
+        read_only (bool): reads a snapshot taken when it began
+        """
+        self.frontend = frontend
+        self.transaction_id = transaction_id
+        self.read_only = read_only
+
+    async def read(self, variable_id: str) -> int:
+        """
+        The value of the variable, once its lock is granted
+        """
+        return await self.frontend.request(self, Operation(COMMAND_TYPE.READ, self.transaction_id, variable_id))
+
+    async def write(self, variable_id: str, value: int) -> None:
+        """
+        Write the variable on every working replica, once their locks are granted
+        """
+        if self.read_only:
+            raise ValueError("read-only transaction {} can't write".format(self.transaction_id))
+        await self.frontend.request(self, Operation(COMMAND_TYPE.WRITE, self.transaction_id, variable_id, value=value))
+
+    async def end(self) -> bool:
+        """[summary]
+        End the transaction
+
+        Returns:
+            bool: True if it committed, False if it was aborted, e.g. because a site it accessed failed
+        """
+        return await self.frontend.request(self, Operation(COMMAND_TYPE.END, self.transaction_id))
+
+class AsyncFrontend:
+    def __init__(self, log: EventSink=None, **kwargs) -> None:
+        """[summary]
+        asyncio front end of a TransactionManager: client coroutines open sessions and await their requests.
+        A request blocked on a lock suspends the coroutine that sent it until the transaction manager runs it,
+        the other coroutines go on sending theirs. The request itself waits in the command queue of the
+        transaction manager and is retried after each request. Everything runs in the thread of the event loop
+
+        log (EventSink): where the events are written, defaults to the standard output at LEVEL.INFO
+        kwargs: arguments of the TransactionManager, cancel_queued_reads is on by default:
+                a session's read would otherwise leave requests queued on the replicas it didn't read from,
+                whose locks block the writers of the other sessions
+        tm (TransactionManager): runs the requests
+        next_id (int): number of the next transaction id given by begin()
+        sessions (set): transaction ids of the sessions that didn't end
+        """
+        self.sink = SessionSink(log if log is not None else TextSink(LEVEL.INFO))
+        kwargs.setdefault('cancel_queued_reads', True)
+        self.tm = TransactionManager(log=self.sink, **kwargs)
+        self.next_id = 1
+        self.sessions = set()
+        self.__flush_scheduled = False
+
+    async def begin(self, read_only: bool=False, transaction_id: str=None) -> Session:
+        """[summary]
+        Begin a transaction
+
+        Args:
+            read_only (bool): begin a read-only transaction
+            transaction_id (str): id of the transaction, a new one by default
+
+        Returns:
+            Session: the transaction
+        """
+        await asyncio.sleep(0)      # let the other sessions send their requests
+        if transaction_id is None:
+            while "T{}".format(self.next_id) in self.tm.transactions:
+                self.next_id += 1
+            transaction_id = "T{}".format(self.next_id)
+            self.next_id += 1
+        elif transaction_id in self.tm.transactions:
+            raise ValueError("transaction {} is running".format(transaction_id))
+        self.sink.aborted.pop(transaction_id, None)
+        self.sessions.add(transaction_id)
+        self.operate(Operation(COMMAND_TYPE.BEGINRO if read_only else COMMAND_TYPE.BEGIN, transaction_id))
+        return Session(self, transaction_id, read_only)
+
+    async def request(self, session: Session, op: Operation):
+        """
+        Send a request of a session and wait for its result. A request can be cancelled while it waits,
+        it stays queued in the transaction manager until the session ends
+        """
+        await asyncio.sleep(0)
+        transaction_id = session.transaction_id
+        if transaction_id in self.sink.waiting:
+            raise RuntimeError("transaction {} is already waiting for a request".format(transaction_id))
+        if transaction_id in self.sink.aborted:
+            # the transaction manager already dropped it, ending the session forgets it
+            if op.type == COMMAND_TYPE.END:
+                del self.sink.aborted[transaction_id]
+                self.__close_session(transaction_id)
+                return False
+            raise TransactionAborted(transaction_id, self.sink.aborted[transaction_id])
+        if op.type != COMMAND_TYPE.END and not self.tm.directory.sites_of(op.variable_id):
+            raise ValueError("unknown variable {}".format(op.variable_id))
+
+        future = asyncio.get_running_loop().create_future()
+        self.sink.waiting[transaction_id] = (op.type, future)
+        self.operate(op)
+        try:
+            result = await future
+        except asyncio.CancelledError:
+            # e.g. asyncio.wait_for gave up, the session can end its transaction, which drops the request
+            if self.sink.waiting.get(transaction_id, (None, None))[1] is future:
+                del self.sink.waiting[transaction_id]
+            raise
+        if op.type == COMMAND_TYPE.END:
+            self.__close_session(transaction_id)
+        return result
+
+    def __close_session(self, transaction_id: str) -> None:
+        self.sessions.discard(transaction_id)
+        self.__check_stall()
+
+    def __check_stall(self) -> None:
+        """
+        If every open session waits for a request and no commit is pending, only the deadlocks left by the last
+        request can unblock them. Once they are resolved, the request of the oldest transaction fails with
+        TransactionStalled, only a session giving up releases locks
+        """
+        waiting = self.sink.waiting
+        if not waiting or len(waiting) < len(self.sessions) or self.tm.pending_commits:
+            return
+        self.tm.settle()
+        if not waiting or len(waiting) < len(self.sessions):
+            return
+        transaction_id = min(waiting, key=lambda tid: self.tm.transactions[tid].timestamp)
+        _, future = waiting.pop(transaction_id)
+        if not future.done():
+            future.set_exception(TransactionStalled(transaction_id))
+
+    def operate(self, op: Operation) -> None:
+        """
+        Run an operation on the transaction manager, e.g. a site failure or a dump.
+        The commits it leaves pending are applied once the sessions ready to run have sent their requests
+        """
+        self.tm.operate(op)
+        if self.tm.pending_commits and not self.__flush_scheduled:
+            self.__flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self.__flush)
+        self.__check_stall()
+
+    def __flush(self) -> None:
+        self.__flush_scheduled = False
+        self.tm.drain()
+        self.__check_stall()
+
+    def close(self) -> None:
+        self.tm.drain()
+        self.tm.close()
+        self.sink.flush()
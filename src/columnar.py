@@ -0,0 +1,117 @@
+import ast
+import sys
+import zipfile
+from array import array
+
+try:
+    import numpy
+except ImportError:     # NumPy is optional, the columns are plain int64 arrays without it
+    numpy = None
+
+NPY_MAGIC = b'\x93NUMPY'
+# dtype of a .npy file, without its byte order -> array typecode
+NPY_TYPECODES = {'i1': 'b', 'u1': 'B', 'i2': 'h', 'u2': 'H', 'i4': 'i', 'u4': 'I', 'i8': 'q', 'u8': 'Q'}
+BYTE_ORDERS = {'<': 'little', '>': 'big'}      # '=' and '|' are native
+
+def int64(column) -> array:
+    """[summary]
+    A column as an array of int64. Arrays of int64, NumPy arrays of int64 and other buffers of int64,
+    strided or not, are copied as bytes, any other sequence of integers one item at a time
+
+    Args:
+        column: array, NumPy array, list, range...
+
+    Returns:
+        array: the column, the same object if it already is an array of int64
+    """
+    if isinstance(column, array) and column.typecode == 'q':
+        return column
+    try:
+        view = memoryview(column)
+    except TypeError:
+        return array('q', column)
+    if view.ndim != 1:
+        raise ValueError("a column has one dimension, not {}".format(view.ndim))
+    if view.itemsize == 8 and view.format.lstrip('@=') in ('q', 'l'):
+        result = array('q')
+        result.frombytes(view.cast('B') if view.c_contiguous else view.tobytes())
+        return result
+    return array('q', view.tolist())
+
+def take(column: array, indexes: array) -> array:
+    """
+    column[i] for every i of indexes, in one vectorized step when NumPy is available
+    """
+    if numpy is not None:
+        return array('q', numpy.frombuffer(column, numpy.int64)[numpy.frombuffer(indexes, numpy.int64)].tobytes())
+    return array('q', map(column.tolist().__getitem__, indexes))
+
+def to_numpy(columns: dict) -> dict:
+    """
+    NumPy arrays sharing the memory of the columns, requires NumPy
+    """
+    if numpy is None:
+        raise ImportError("NumPy is not installed")
+    return {name: numpy.frombuffer(column, numpy.int64) for name, column in columns.items()}
+
+def npy_header(count: int) -> bytes:
+    """
+    Header of a .npy file (format 1.0) holding count int64 in little endian
+    """
+    header = "{{'descr': '<i8', 'fortran_order': False, 'shape': ({},), }}".format(count)
+    # the data starts on a multiple of 64 bytes, the header is padded with spaces and ends with a newline
+    header += ' ' * (-(len(NPY_MAGIC) + 4 + len(header) + 1) % 64) + '\n'
+    return NPY_MAGIC + b'\x01\x00' + len(header).to_bytes(2, 'little') + header.encode('latin1')
+
+def save(path: str, columns: dict) -> None:
+    """[summary]
+    Write columns of int64 to a .npz file, one <name>.npy member per column, as numpy.savez does.
+    numpy.load(path) reads it back, NumPy isn't needed to write it
+
+    Args:
+        path (str): the file
+        columns (dict): (name, column), see int64 for the columns accepted
+    """
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for name, column in columns.items():
+            column = int64(column)
+            if sys.byteorder != 'little':
+                column = array('q', column)
+                column.byteswap()
+            with archive.open(name + '.npy', 'w', force_zip64=True) as f:
+                f.write(npy_header(len(column)))
+                f.write(column)
+
+def load(path: str) -> dict:
+    """[summary]
+    Read the columns of a .npz file written by save or numpy.savez, e.g. numpy.savez(path, variable=..., value=...).
+    Every member must be a one dimensional array of integers
+
+    Args:
+        path (str): the file
+
+    Returns:
+        dict: (name, array of int64) of every column
+    """
+    columns = {}
+    with zipfile.ZipFile(path) as archive:
+        for member in archive.namelist():
+            data = archive.read(member)
+            if data[:6] != NPY_MAGIC:
+                raise ValueError("{} in {} isn't a .npy array".format(member, path))
+            if data[6] == 1:
+                size, start = int.from_bytes(data[8:10], 'little'), 10
+            else:
+                size, start = int.from_bytes(data[8:12], 'little'), 12
+            header = ast.literal_eval(data[start:start + size].decode('latin1'))
+            descr, shape = header['descr'], header['shape']
+            typecode = NPY_TYPECODES.get(descr[1:])
+            if typecode is None or len(shape) != 1:
+                raise ValueError("{} in {} isn't a one dimensional array of integers".format(member, path))
+            column = array(typecode)
+            column.frombytes(memoryview(data)[start + size:])
+            if BYTE_ORDERS.get(descr[0], sys.byteorder) != sys.byteorder:
+                column.byteswap()
+            name = member[:-4] if member.endswith('.npy') else member
+            columns[name] = column if typecode == 'q' else array('q', column)
+    return columns
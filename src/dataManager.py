@@ -1,5 +1,13 @@
-from collections import defaultdict, OrderedDict, deque
+import sys
+from array import array
+from bisect import bisect_left
+from collections import defaultdict, deque
 from enum import Enum
+from itertools import compress
+from columnar import int64, take
+from versionStore import VersionStore
+from mappedStore import MappedTable, MappedVersionStore
+from eventLog import LEVEL, EventSink, TextSink
 
 # Lock status for a variable
 class LOCK(Enum):
@@ -7,6 +15,23 @@ class LOCK(Enum):
     READ = 'READ'
     WRITE = 'WRITE'
 
+# Lock on a whole site. A transaction locking variables of the site holds an intention lock on it,
+# IS while it only reads them, IX once it writes one; S and X cover every variable of the site
+class SITE_LOCK(Enum):
+    IS = 'IS'
+    IX = 'IX'
+    S = 'S'
+    X = 'X'
+
+# site lock -> the site locks other transactions may hold at the same time
+SITE_LOCK_COMPATIBLE = {
+    SITE_LOCK.IS: (SITE_LOCK.IS, SITE_LOCK.IX, SITE_LOCK.S),
+    SITE_LOCK.IX: (SITE_LOCK.IS, SITE_LOCK.IX),
+    SITE_LOCK.S: (SITE_LOCK.IS, SITE_LOCK.S),
+    SITE_LOCK.X: (),
+}
+SITE_KEY = '*'  # variable id of the site lock in the lock events
+
 # Data manager's status
 class DM_STATUS(Enum):
     WORKING = 'WORKING'
@@ -18,30 +43,58 @@ class VAR_STATUS(Enum):
     UNAVAILABLE = 'UNAVAILABLE'
     RECOVERING = 'RECOVERING'
 
+# Status byte of a variable in a MappedTable
+STATUS_CODE = {VAR_STATUS.READY: 0, VAR_STATUS.UNAVAILABLE: 1, VAR_STATUS.RECOVERING: 2}
+CODE_STATUS = {code: status for status, code in STATUS_CODE.items()}
+# replicated flag -> status byte of a recovering replica
+RECOVER_STATUS = bytes([STATUS_CODE[VAR_STATUS.READY], STATUS_CODE[VAR_STATUS.RECOVERING]]) + bytes(254)
+
+def default_placement(variable_index: int, num_sites: int) -> list:
+    """[summary]
+    Replica placement: odd variables are stored on one site, even variables on every site
+
+    Args:
+        variable_index (int): i of the variable xi
+        num_sites (int): number of sites
+
+    Returns:
+        list: ids of the sites holding the variable
+    """
+    if variable_index % 2 == 0:
+        return list(range(1, num_sites + 1))
+    return [variable_index % num_sites + 1]
+
 class Variable:
-    def __init__(self, id: str, val: int, lock: LOCK, even: bool) -> None:
+    # No per-instance __dict__, there's one Variable per replica on every site
+    __slots__ = ('id', 'value', 'commited_val', 'even', 'current_val', 'status', 'order',
+                 'lock', 'lock_by_trans_id', 'read_lock_list', 'lock_waiting_queue')
+
+    def __init__(self, id: str, val: int, lock: LOCK, even: bool, order: int=0) -> None:
         """
         id (str): variable id
         val (int): value
         lock (LOCK): lock type 
-        even (bool): even variables
-        commited_val(dict): key is timestamp, value is the value commited at that time
+        even (bool): replicated on several sites (even variables in the default placement)
+        commited_val(VersionStore): the values commited and the time they were commited at
         current_val(int): local modification that haven't been submitted
+        order(int): position of the variable in the variable table of its site
 
-        lock_waiting_queue:each item is a tuple of (lock_type, transaction_id)
+        read_lock_list: transactions holding a read lock, an empty tuple until the first one is added
+        lock_waiting_queue:each item is a tuple of (lock_type, transaction_id), an empty tuple while nothing waits
         """
         self.id = id
         self.value = val
-        self.commited_val = OrderedDict({0:val})
+        self.commited_val = VersionStore(val)
         self.even = even
         self.current_val = val
         self.status = VAR_STATUS.READY
+        self.order = order
 
-        # lock 
+        # lock, the containers are only created when needed
         self.lock = lock
         self.lock_by_trans_id = None
-        self.read_lock_list = set()
-        self.lock_waiting_queue = deque()  
+        self.read_lock_list = ()
+        self.lock_waiting_queue = ()
 
     def promote_lock(self, tid: str) -> bool:
         """[summary]
@@ -53,15 +106,25 @@ class Variable:
             bool:  successful or not
         """
         if tid == self.lock_by_trans_id and len(self.read_lock_list) == 1:
-            self.read_lock_list = set()
+            self.read_lock_list = ()
             self.lock = LOCK.WRITE
         
-    def has_write_waiting(self) -> bool:
+    def has_write_waiting(self, tid: str=None) -> bool:
+        """
+        tid (str): only look ahead of the read request queued by this transaction, if it has one
+        """
         for l in self.lock_waiting_queue:
             if l[0] == LOCK.WRITE:
                 return True
+            if l[1] == tid and l[0] == LOCK.READ:
+                return False
         return False
     
+    def add_reader(self, tid: str) -> None:
+        if not self.read_lock_list:
+            self.read_lock_list = set()
+        self.read_lock_list.add(tid)
+
     def need_wait_to_write(self, tid: str) -> bool:
         """
         tid (str)：transaction_id
@@ -70,33 +133,61 @@ class Variable:
             return True
         return False
 
-    def release_lock(self, tid: str) -> None:
+    def release_lock(self, tid: str) -> bool:
         """
         tid: transaction ID
+
+        Returns:
+            bool: True if a lock held by the transaction was released
         """
         if self.lock == LOCK.NONE:
-            return
+            return False
 
         if self.lock == LOCK.WRITE and tid == self.lock_by_trans_id:
             self.lock = LOCK.NONE
             self.lock_by_trans_id = None  
+            return True
         elif self.lock == LOCK.READ and tid in self.read_lock_list:
             self.read_lock_list.remove(tid)
             if len(self.read_lock_list) <1:
+                self.read_lock_list = ()
                 self.lock = LOCK.NONE
                 self.lock_by_trans_id = None  
+            return True
+        return False
 
-    def add_lock_waiting_queue(self, lock : LOCK, trans_id: str) -> None:
-        for type, tid in list(self.lock_waiting_queue):
+    def add_lock_waiting_queue(self, lock : LOCK, trans_id: str) -> bool:
+        """
+        Returns:
+            bool: True if the request was appended, False if it was already queued
+        """
+        for type, tid in self.lock_waiting_queue:
             # Avoid duplicates
             if type == lock and tid == trans_id:
-                return
+                return False
+        if not self.lock_waiting_queue:
+            self.lock_waiting_queue = deque()
         self.lock_waiting_queue.append((lock, trans_id))
+        return True
+
+    def update_lock_waiting_queue(self, register_reader: bool=False) -> bool:
+        """
+        Hand the lock over to the waiting requests that can be granted now
+
+        Args:
+            register_reader (bool): a read lock handed over to the first request is added to read_lock_list,
+                                    so releasing it works. Otherwise only lock_by_trans_id names its owner
 
-    def update_lock_waiting_queue(self) -> None:
+        Returns:
+            bool: True if any waiting request was granted
+        """
+        granted = False
         if self.lock_waiting_queue:
             if self.lock == LOCK.NONE:
                 self.lock, self.lock_by_trans_id = self.lock_waiting_queue.popleft()
+                if register_reader and self.lock == LOCK.READ:
+                    self.add_reader(self.lock_by_trans_id)
+                granted = True
                 #print("update: {}, {}".format(self.lock, self.lock_by_trans_id))
             elif self.lock == LOCK.READ:
                 for lck in list(self.lock_waiting_queue):
@@ -104,41 +195,479 @@ class Variable:
                     if lock_type == LOCK.WRITE and len(self.read_lock_list) == 1 and trans_id in self.read_lock_list:
                         self.promote_lock(trans_id)
                         self.lock_waiting_queue.remove(lck)
+                        granted = True
                         break
                     if not self.need_wait_to_write(trans_id):
-                        self.read_lock_list.add(trans_id)
+                        self.add_reader(trans_id)
                         self.lock_waiting_queue.remove(lck)
+                        granted = True
+            if not self.lock_waiting_queue:
+                self.lock_waiting_queue = ()
+        return granted
     
+    def waits_for_edges(self) -> set:
+        """
+        Edges of the waits-for graph caused by this variable, each edge is a tuple of (waiting_tid, tid)
+        A waiting transaction waits for the conflicting lock holders
+        and for the conflicting requests ahead of it in the lock waiting queue
+        """
+        edges = set()
+        if not self.lock_waiting_queue or self.lock == LOCK.NONE:
+            return edges
+
+        for lock_type, tid in self.lock_waiting_queue:
+            if self.lock == LOCK.READ:
+                if lock_type == LOCK.READ or (len(self.read_lock_list) == 1 and tid in self.read_lock_list):
+                    continue
+                for holder in self.read_lock_list:
+                    if holder != tid:
+                        edges.add((tid, holder))
+            elif self.lock_by_trans_id != tid:
+                edges.add((tid, self.lock_by_trans_id))
+
+        # T' is ahead of T on the wait queue for x and T' seeks a conflicting lock on x.
+        ahead, ahead_writes = set(), set()
+        for lock_type, tid in self.lock_waiting_queue:
+            for other in (ahead if lock_type == LOCK.WRITE else ahead_writes):
+                if other != tid:
+                    edges.add((tid, other))
+            ahead.add(tid)
+            if lock_type == LOCK.WRITE:
+                ahead_writes.add(tid)
+        return edges
+
+    def blockers(self, tid: str) -> set:
+        """
+        Transactions the waiting requests of tid wait for, the edges of waits_for_edges leaving tid
+        found in one pass over the lock waiting queue
+        """
+        blockers = set()
+        if not self.lock_waiting_queue or self.lock == LOCK.NONE:
+            return blockers
+
+        ahead, ahead_writes = set(), set()
+        for lock_type, waiter in self.lock_waiting_queue:
+            if waiter == tid:
+                blockers |= ahead if lock_type == LOCK.WRITE else ahead_writes
+                if self.lock == LOCK.WRITE:
+                    blockers.add(self.lock_by_trans_id)
+                elif lock_type == LOCK.WRITE and not (len(self.read_lock_list) == 1 and tid in self.read_lock_list):
+                    blockers.update(self.read_lock_list)
+            ahead.add(waiter)
+            if lock_type == LOCK.WRITE:
+                ahead_writes.add(waiter)
+        blockers.discard(tid)
+        return blockers
+
     def remain_lock(self, tid: str):
         for _, l in self.lock_waiting_queue:
             if l == tid:
                 return True
         return False
 
+class VariableTable:
+    def __init__(self, variables, path: str=None) -> None:
+        """[summary]
+        Variable table of a site whose committed versions and statuses live in a MappedTable.
+        A Variable is only created when the variable is used, and dropped once it holds no lock,
+        no waiting request and no old version, so the heap only holds the variables in use
+
+        variables (iterable): (variable index, replicated) of the variables stored on the site, by increasing index
+        path (str): file of the MappedTable, None for an anonymous mapping
+        indexes (array): index of the variable of every record
+        replicated (bytearray): 1 for the records of replicated variables
+        hot (dict): (variable_id, Variable) the variables in use
+        """
+        self.indexes = array('q')
+        self.replicated = bytearray()
+        for i, replicated in variables:
+            self.indexes.append(i)
+            self.replicated.append(1 if replicated else 0)
+        self.table = MappedTable(array('q', (i * 10 for i in self.indexes)), path)
+        self.hot = {}
+
+    def slot(self, variable_id: str) -> int:
+        """
+        Record of the variable, -1 if it isn't stored on this site
+        """
+        if not variable_id.startswith('x') or not variable_id[1:].isdigit():
+            return -1
+        index = int(variable_id[1:])
+        if variable_id[1:] != str(index):
+            return -1
+        slot = bisect_left(self.indexes, index)
+        if slot < len(self.indexes) and self.indexes[slot] == index:
+            return slot
+        return -1
+
+    def __len__(self) -> int:
+        return len(self.indexes)
+
+    def __contains__(self, variable_id: str) -> bool:
+        return variable_id in self.hot or self.slot(variable_id) >= 0
+
+    def __iter__(self):
+        return ("x" + str(i) for i in self.indexes)
+
+    def __getitem__(self, variable_id: str) -> Variable:
+        var = self.hot.get(variable_id)
+        if var is not None:
+            return var
+        slot = self.slot(variable_id)
+        if slot < 0:
+            raise KeyError(variable_id)
+        variable_id = sys.intern(variable_id)
+        var = Variable(variable_id, self.indexes[slot] * 10, LOCK.NONE, even=bool(self.replicated[slot]), order=slot)
+        var.commited_val = MappedVersionStore(self.table, slot)
+        var.current_val = self.table.written(slot)
+        var.status = CODE_STATUS[self.table.status[slot]]
+        self.hot[variable_id] = var
+        return var
+
+    def get(self, variable_id: str, default=None):
+        try:
+            return self[variable_id]
+        except KeyError:
+            return default
+
+    def values(self):
+        """
+        Every variable, creating the ones not in use
+        """
+        return (self[variable_id] for variable_id in self)
+
+    def versions(self, variable_id: str):
+        """
+        The committed versions of a variable without creating it, None if it isn't stored on this site
+        """
+        var = self.hot.get(variable_id)
+        if var is not None:
+            return var.commited_val
+        slot = self.slot(variable_id)
+        return MappedVersionStore(self.table, slot) if slot >= 0 else None
+
+    def release(self, var: Variable) -> None:
+        """
+        Drop a variable that is no longer in use, its committed versions and status stay in the MappedTable
+        """
+        if (var.lock == LOCK.NONE and not var.read_lock_list and not var.lock_waiting_queue
+                and var.commited_val.history is None and self.hot.get(var.id) is var):
+            self.table.set_written(var.order, var.current_val)
+            del self.hot[var.id]
+
 class DataManager:
-    def __init__(self, id: int) -> None:
+    def __init__(self, id: int, lock_events: set=None, variables: list=None, directory=None, log: EventSink=None,
+                 metrics=None, wal=None, mapped: bool=False, table_path: str=None,
+                 cancel_queued_reads: bool=False) -> None:
         """[summary]
+        cancel_queued_reads (bool): a read served drops the request the transaction queued for it, and a read lock
+                                    granted from the lock waiting queue is released by the commit or the abort of its
+                                    transaction like any other. Off, both are kept after the transaction ends
+                                    and the output of the command files stays the same
+        log (EventSink): where the events are reported, defaults to the standard output
+        metrics (Metrics): collects the length of the lock waiting queues, None to disable
+        wal (SiteLog): where the committed versions are made durable, None to keep them in memory only.
+                       The site starts from it and reloads it when it recovers
+        mapped (bool): keep the committed versions and statuses in a MappedTable, see VariableTable
+        table_path (str): file of the MappedTable, None for an anonymous mapping
+        variables (list): (variable index, replicated) of the variables stored on this site,
+                          defaults to x1..x20 placed on 10 sites by default_placement
+        directory (ReplicaDirectory): notified when the site or one of its replicas changes status
         variables (dict): 
         visiting_variables (dict) (transaction_id, set(Variable)) :
+        transaction_footprint (dict) (transaction_id, dict(variable_id, Variable)): variables on which the transaction
+                           holds a lock, waits for a lock or has a pending write
+        versioned (dict) (variable_id, Variable): variables with versions committed since the last garbage collection
+        retained (dict) (variable_id, Variable): variables whose old versions were still visible at the last garbage collection
+        lock_events (set): (site_id, variable_id) of the locks whose state changed,
+                           shared with the transaction manager to wake up blocked commands.
+                           (site_id, SITE_KEY) reports a change of the site lock
+        site_holders (dict): (transaction_id, SITE_LOCK.S or SITE_LOCK.X) the transactions locking the whole site.
+                             Their reads and writes of the site take no lock on the variables
+        site_written (dict): (transaction_id, set of variable ids) the variables written under an exclusive site lock,
+                             installed by the commit like the ones written under a write lock
+        intentions (dict): (transaction_id, SITE_LOCK.IS or SITE_LOCK.IX) the intention locks: a transaction holds IX
+                           from its first write request on the site, IS from its first read, until it ends
+        intention_counts (dict): (SITE_LOCK.IS or SITE_LOCK.IX, number of transactions holding it)
+        site_waiting (dict): (transaction_id, SITE_LOCK.S or SITE_LOCK.X) the requests of site locks not granted yet
+        site_blocked (dict): (transaction_id, (SITE_LOCK.IS or SITE_LOCK.IX, set of variable ids)) the reads and writes
+                             refused because another transaction locks the site
+        pending_wakeups (dict) (variable_id, Variable): variables whose lock waiting queue may not be empty.
+                             Every commit and abort updates their queues, not only the ones of its transaction,
+                             as when they visited all the variables of the site
         """
 
         self.id = id
         self.variables = defaultdict(Variable)
         self.visiting_variables = defaultdict(set)
+        self.transaction_footprint = defaultdict(dict)
         self.on_flag = True
+        self.lock_events = lock_events if lock_events is not None else set()
+        self.site_holders = {}
+        self.site_waiting = {}
+        self.site_blocked = {}
+        self.site_written = {}
+        self.intentions = {}
+        self.intention_counts = {SITE_LOCK.IS: 0, SITE_LOCK.IX: 0}
+        self.pending_wakeups = {}
+        self.versioned = {}
+        self.retained = {}
+        self.directory = directory
+        self.log = log if log is not None else TextSink(LEVEL.INFO)
+        self.metrics = metrics
+        self.wal = wal
+        self.mapped = mapped
+        self.cancel_queued_reads = cancel_queued_reads
+        self.recovering = 0     # replicas in VAR_STATUS.RECOVERING, only counted when mapped
+        if directory is not None:
+            directory.add_site(id)
 
         # Initialize variable table
-        for i in range(1, 21):
-            variable_id = "x" + str(i)
-            if i % 2 == 0:
-                self.variables[variable_id] = Variable(variable_id, i * 10, LOCK.NONE, even=True)
-            elif i % 10 + 1 == id:
-                self.variables[variable_id] = Variable(variable_id, i * 10, LOCK.NONE, even=False)
+        if variables is None:
+            variables = []
+            for i in range(1, 21):
+                holders = default_placement(i, 10)
+                if id in holders:
+                    variables.append((i, len(holders) > 1))
+        if mapped:
+            self.variables = VariableTable(variables, table_path)
+        else:
+            for i, replicated in variables:
+                self.add_variable(i, replicated)
+        if wal is not None:
+            self.load()
+
+    def add_variable(self, index: int, replicated: bool) -> None:
+        """
+        Add the variable x<index> to the variable table with its initial value index * 10
+        """
+        variable_id = sys.intern("x" + str(index))   # one id string shared by all the replicas
+        self.variables[variable_id] = Variable(variable_id, index * 10, LOCK.NONE, even=replicated, order=len(self.variables))
+
+    def __touch(self, transaction_id: str, var: Variable, intention: SITE_LOCK=SITE_LOCK.IS) -> None:
+        """
+        Add a variable to the footprint of a transaction, so commit and abort only visit what it touched,
+        and give the transaction the intention lock of its request
+        """
+        self.transaction_footprint[transaction_id][var.id] = var
+        self.__intend(transaction_id, intention)
+        if self.site_waiting:
+            # the transaction may have taken an intention lock
+            self.lock_events.add((self.id, SITE_KEY))
+
+    def __intend(self, transaction_id: str, intention: SITE_LOCK) -> None:
+        """
+        The transaction holds an intention lock on the site, IX covers IS
+        """
+        held = self.intentions.get(transaction_id)
+        if held == intention or held == SITE_LOCK.IX:
+            return
+        if held is not None:
+            self.intention_counts[held] -= 1
+        self.intentions[transaction_id] = intention
+        self.intention_counts[intention] += 1
+
+    def __forget(self, transaction_id: str) -> None:
+        """
+        A transaction has no variable of the site left: drop its footprint, intention lock and site writes
+        """
+        self.transaction_footprint.pop(transaction_id, None)
+        self.site_written.pop(transaction_id, None)
+        held = self.intentions.pop(transaction_id, None)
+        if held is not None:
+            self.intention_counts[held] -= 1
+
+    def __set_status(self, var: Variable, status: VAR_STATUS) -> None:
+        var.status = status
+        if status == VAR_STATUS.READY:
+            # a range read may have waited for the replica
+            self.lock_events.add((self.id, SITE_KEY))
+        if self.mapped:
+            statuses = self.variables.table.status
+            if statuses[var.order] == STATUS_CODE[VAR_STATUS.RECOVERING] and status != VAR_STATUS.RECOVERING:
+                self.recovering -= 1
+                if self.recovering == 0 and self.directory is not None:
+                    self.directory.set_site_recovering(self.id, False)
+            statuses[var.order] = STATUS_CODE[status]
+        elif self.directory is not None:
+            self.directory.set_replica_status(self.id, var.id, status)
+
+    def __release(self, var: Variable) -> None:
+        """
+        A transaction is done with a variable, a mapped table may drop it from the heap
+        """
+        if self.mapped:
+            self.variables.release(var)
+
+    def __in_use(self, var_id: str) -> Variable:
+        """
+        The variable if it may hold locks, without creating it in a mapped table
+        """
+        if self.mapped:
+            return self.variables.hot.get(var_id)
+        return self.variables.get(var_id)
+
+    def replica_ready(self, var_id: str) -> bool:
+        """
+        The replica of a variable on this site can be read
+        """
+        if self.mapped:
+            slot = self.variables.slot(var_id)
+            return slot >= 0 and self.variables.table.status[slot] == STATUS_CODE[VAR_STATUS.READY]
+        return var_id in self.variables and self.variables[var_id].status == VAR_STATUS.READY
+
+    def __lock_changed(self, var: Variable) -> None:
+        """
+        Record that the lock state of a variable changed on this site
+        """
+        self.lock_events.add((self.id, var.id))
+        if self.site_waiting:
+            # the intention locks of the transaction may have changed
+            self.lock_events.add((self.id, SITE_KEY))
+
+    def __queued(self, var: Variable) -> None:
+        """
+        A new request was appended to the lock waiting queue of a variable
+        """
+        self.pending_wakeups[var.id] = var
+        self.lock_events.add((self.id, var.id))
+        if self.site_waiting:
+            self.lock_events.add((self.id, SITE_KEY))
+        if self.metrics is not None:
+            self.metrics.record_queue_length(len(var.lock_waiting_queue))
+
+    def __intend_again(self, transaction_id: str) -> None:
+        """
+        A commit stopped at the remaining locks of the transaction, it keeps the intention lock of the locks left
+        """
+        held = self.intentions.pop(transaction_id, None)
+        if held is not None:
+            self.intention_counts[held] -= 1
+        intention = self.__intention(transaction_id)
+        if intention is not None:
+            self.__intend(transaction_id, intention)
+
+    def __intention(self, transaction_id: str) -> SITE_LOCK:
+        """
+        The intention lock the locks of a transaction on the site give, None if it touched none of its variables.
+        Only used when a commit stops at remaining locks, intentions is kept up to date otherwise
+        """
+        footprint = self.transaction_footprint.get(transaction_id)
+        if not footprint:
+            return None
+        for var in footprint.values():
+            var : Variable
+            if var.lock == LOCK.WRITE and var.lock_by_trans_id == transaction_id:
+                return SITE_LOCK.IX
+            if var.lock_waiting_queue and (LOCK.WRITE, transaction_id) in var.lock_waiting_queue:
+                return SITE_LOCK.IX
+        return SITE_LOCK.IS
+
+    def __site_conflicts(self, transaction_id: str, lock: SITE_LOCK) -> set:
+        """
+        The other transactions whose locks on the site conflict with the transaction taking the site lock.
+        The intention locks only conflict with S and X, and are only looked at if one of them is held
+        """
+        compatible = SITE_LOCK_COMPATIBLE[lock]
+        conflicts = {tid for tid, held in self.site_holders.items() if tid != transaction_id and held not in compatible}
+        if any(count and intention not in compatible for intention, count in self.intention_counts.items()):
+            conflicts.update(tid for tid, held in self.intentions.items()
+                             if tid != transaction_id and held not in compatible)
+        return conflicts
+
+    def __site_locked(self, transaction_id: str, variable_id: str, lock: SITE_LOCK) -> bool:
+        """
+        Whether another transaction locks the site against a read (IS) or a write (IX) of the variable.
+        A refused request is woken up when the site lock is released
+        """
+        if not self.__site_conflicts(transaction_id, lock):
+            return False
+        held, variable_ids = self.site_blocked.get(transaction_id, (lock, set()))
+        variable_ids.add(variable_id)
+        self.site_blocked[transaction_id] = (SITE_LOCK.IX if SITE_LOCK.IX in (held, lock) else lock, variable_ids)
+        self.lock_events.add((self.id, SITE_KEY))
+        return True
+
+    def lock_site(self, transaction_id: str, lock: SITE_LOCK) -> bool:
+        """[summary]
+        Lock the whole site in shared (S) or exclusive (X) mode, a refused request waits in site_waiting
+        and is granted when the conflicting transactions end
+
+        Returns:
+            bool: True if the transaction holds the lock
+        """
+        held = self.site_holders.get(transaction_id)
+        if held == lock or held == SITE_LOCK.X:
+            return True
+        if self.__site_conflicts(transaction_id, lock):
+            if self.site_waiting.get(transaction_id) != lock:
+                self.site_waiting[transaction_id] = lock
+                self.lock_events.add((self.id, SITE_KEY))
+            return False
+        self.site_holders[transaction_id] = lock
+        self.site_waiting.pop(transaction_id, None)
+        self.lock_events.add((self.id, SITE_KEY))
+        return True
+
+    def __release_site(self, transaction_id: str) -> None:
+        """
+        A transaction ended: release its site lock, forget its requests, and wake up the requests it blocked
+        """
+        released = self.site_holders.pop(transaction_id, None) is not None
+        if released and self.site_blocked:
+            for _, variable_ids in self.site_blocked.values():
+                self.lock_events.update((self.id, variable_id) for variable_id in variable_ids)
+            self.site_blocked.clear()
+        else:
+            released = self.site_blocked.pop(transaction_id, None) is not None or released
+        released = self.site_waiting.pop(transaction_id, None) is not None or released
+        if released or self.site_waiting:
+            # the intention locks of the transaction are gone too
+            self.lock_events.add((self.id, SITE_KEY))
+
+    def read_range(self, transaction_id: str, variable_ids: list) -> tuple:
+        """[summary]
+        Read several variables of the site under one shared lock (S) on the site, instead of a lock per variable
+
+        Args:
+            variable_ids (list): ids of variables stored on the site whose replicas are ready
+
+        Returns:
+            bool: True if the site lock was granted
+            list: the last committed value of every variable, None if the lock wasn't granted
+        """
+        if not self.lock_site(transaction_id, SITE_LOCK.S):
+            return False, None
+        if self.mapped:
+            versions = self.variables.versions
+            return True, [versions(variable_id).latest() for variable_id in variable_ids]
+        return True, [self.variables[variable_id].commited_val.latest() for variable_id in variable_ids]
+
+    def write_many(self, transaction_id: str, writes: list) -> bool:
+        """[summary]
+        Write several variables of the site under one exclusive lock (X) on the site.
+        No other transaction holds a lock on the site then, the variables aren't locked one by one:
+        the writes are kept like local_write and installed by the commit
+
+        Args:
+            writes (list): (variable_id, value) of variables stored on the site
+
+        Returns:
+            bool: True if every variable was written
+        """
+        if not self.lock_site(transaction_id, SITE_LOCK.X):
+            return False
+        written = self.site_written.setdefault(transaction_id, set())
+        for variable_id, val in writes:
+            written.add(variable_id)
+            self.local_write(variable_id, val, transaction_id)
+        return True
   
     def add_lock(self, variable_id: str, lock: LOCK) -> bool:
         if variable_id in self.variables:
             if self.variables[variable_id].lock == LOCK.NONE:
                 self.variables[variable_id].lock = lock
+                self.__lock_changed(self.variables[variable_id])
                 return True
             elif self.variables[variable_id].lock == LOCK.READ and lock == LOCK.READ:
                 return True
@@ -151,6 +680,7 @@ class DataManager:
     def release_lock(self, variable_id: str) -> bool:
         if variable_id in self.variables:
             self.variables[variable_id].lock = LOCK.NONE
+            self.__lock_changed(self.variables[variable_id])
             return True
         return False
 
@@ -167,29 +697,74 @@ class DataManager:
         """
         if var_id not in self.variables:
             return True
+        if self.site_holders:
+            if self.site_holders.get(trans_id) == SITE_LOCK.X:
+                # the exclusive site lock of the transaction covers the variable
+                self.site_written.setdefault(trans_id, set()).add(var_id)
+                return True
+            if self.__site_locked(trans_id, var_id, SITE_LOCK.IX):
+                return False
         var : Variable = self.variables[var_id]
+        self.__touch(trans_id, var, SITE_LOCK.IX)
         if var.lock == LOCK.NONE:
             var.lock = LOCK.WRITE
             var.lock_by_trans_id = trans_id
+            self.__lock_changed(var)
             return True
         elif var.lock == LOCK.READ:
             if var.need_wait_to_write(trans_id):
-                var.add_lock_waiting_queue(LOCK.WRITE, trans_id)
+                if var.add_lock_waiting_queue(LOCK.WRITE, trans_id):
+                    self.__queued(var)
                 return False
             var.promote_lock(trans_id)
+            self.__lock_changed(var)
             return True
         else:
             if var.lock_by_trans_id == trans_id:
                 return True 
-            var.add_lock_waiting_queue(LOCK.WRITE, trans_id)
+            if var.add_lock_waiting_queue(LOCK.WRITE, trans_id):
+                self.__queued(var)
             return False
         return False
 
+    def writable_by(self, var_id: str):
+        """[summary]
+        Who if_can_write would grant the write lock of a variable to
+
+        Returns:
+            str: None for any transaction, otherwise the only transaction that can write it, '' for none.
+                 For SITE_KEY, who the site locks let write a variable of the site
+        """
+        if var_id == SITE_KEY:
+            holders = set(self.site_holders)
+            if not holders:
+                return None
+            return holders.pop() if len(holders) == 1 else ''
+        var : Variable = self.__in_use(var_id)
+        if var is None or var.lock == LOCK.NONE:
+            return None
+        elif var.lock == LOCK.READ:
+            if len(var.read_lock_list) == 1 and not var.has_write_waiting():
+                return next(iter(var.read_lock_list))
+            return ''
+        return var.lock_by_trans_id or ''
+
+    def can_write(self, trans_id: str, var_id: str) -> bool:
+        """
+        What if_can_write would return, without taking the lock or queueing the request
+        """
+        writer = self.writable_by(SITE_KEY)
+        if writer is not None and writer != trans_id:
+            return False
+        writer = self.writable_by(var_id)
+        return writer is None or writer == trans_id
+
     def local_write(self, variable_id: str, val: int, transaction_id: str) -> bool:
         if variable_id in self.variables:
             self.variables[variable_id].current_val = val
             v : Variable = self.variables[variable_id]
             self.visiting_variables[transaction_id].add(v) 
+            self.__touch(transaction_id, v)
             return True
         return False
     
@@ -205,47 +780,195 @@ class DataManager:
             int: the value of the variable
         """
         if variable_id in self.variables:
+            if self.site_holders:
+                if self.site_holders.get(tid) is not None:
+                    # the site lock of the transaction covers the variable
+                    var : Variable = self.variables[variable_id]
+                    if var.status != VAR_STATUS.READY:
+                        return False, None
+                    return True, var.commited_val.latest()
+                if self.__site_locked(tid, variable_id, SITE_LOCK.IS):
+                    return False, None
             var : Variable = self.variables[variable_id]
             self.visiting_variables[tid].add(var)
+            self.__touch(tid, var)
             if var.status != VAR_STATUS.READY:
                 return False, None
             if var.lock == LOCK.NONE:
                 var.lock = LOCK.READ
                 var.lock_by_trans_id = tid
-                var.read_lock_list.add(tid)
-                return True, var.commited_val[next(reversed(var.commited_val))]
+                var.add_reader(tid)
+                self.__lock_changed(var)
+                self.__served(var, tid)
+                return True, var.commited_val.latest()
             elif var.lock == LOCK.READ:
                 if tid in var.read_lock_list:
-                    return True, var.commited_val[next(reversed(var.commited_val))]
-                if var.has_write_waiting():
-                    var.add_lock_waiting_queue(LOCK.READ, tid)
+                    self.__served(var, tid)
+                    return True, var.commited_val.latest()
+                # with cancel_queued_reads a queued read only waits for the writes ahead of it, as its waits-for edges say
+                if var.has_write_waiting(tid if self.cancel_queued_reads else None):
+                    if var.add_lock_waiting_queue(LOCK.READ, tid):
+                        self.__queued(var)
                     return False, None
                 else:
-                    var.read_lock_list.add(tid)
-                    return True, var.commited_val[next(reversed(var.commited_val))]
+                    var.add_reader(tid)
+                    self.__lock_changed(var)
+                    self.__served(var, tid)
+                    return True, var.commited_val.latest()
             elif var.lock_by_trans_id == tid:
-                return True, var.commited_val[next(reversed(var.commited_val))]
-            var.add_lock_waiting_queue(LOCK.READ, tid)
+                self.__served(var, tid)
+                return True, var.commited_val.latest()
+            if var.add_lock_waiting_queue(LOCK.READ, tid):
+                self.__queued(var)
         return False, None
 
-    def commit(self, transaction_id: str, ts: int) -> None:
+    def cancel_read(self, variable_id: str, tid: str) -> None:
+        """
+        Drop the queued read lock request of a transaction, another replica served its read
+        """
+        var : Variable = self.__in_use(variable_id)
+        if var is not None and self.__served(var, tid):
+            var.update_lock_waiting_queue(self.cancel_queued_reads)
+
+    def __served(self, var: Variable, tid: str) -> bool:
+        """[summary]
+        A read of the transaction was served, with cancel_queued_reads the request it queued before is dropped
+
+        Returns:
+            bool: True if a request was dropped
+        """
+        if not self.cancel_queued_reads or not var.lock_waiting_queue or (LOCK.READ, tid) not in var.lock_waiting_queue:
+            return False
+        var.lock_waiting_queue.remove((LOCK.READ, tid))
+        if not var.lock_waiting_queue:
+            var.lock_waiting_queue = ()
+        self.__lock_changed(var)
+        return True
+
+    def __footprint(self, transaction_id: str) -> list:
+        """
+        Variables touched by a transaction, in the order of the variable table
+        """
+        footprint = self.transaction_footprint.get(transaction_id)
+        if not footprint:
+            return []
+        return sorted(footprint.values(), key=lambda var: var.order)
+
+    def commit(self, transaction_id: str, ts: int, writes: dict=None) -> None:
+        """
+        writes (dict): (variable_id, value) written again by the transaction since it locked the variable,
+                       installed before the variable is committed
+        """
         error = False
-        for var in self.variables.values():
+        footprint = self.transaction_footprint.get(transaction_id)
+        site_written = self.site_written.get(transaction_id, ())
+        visited = self.__footprint(transaction_id)
+        stop = None
+        for var in visited:
             var : Variable
-            if var.lock == LOCK.WRITE and var.lock_by_trans_id == transaction_id:
-                var.commited_val[ts] = var.current_val
-                var.status = VAR_STATUS.READY
-            var.release_lock(transaction_id)
+            del footprint[var.id]
+            changed = False
+            if var.lock == LOCK.WRITE and var.lock_by_trans_id == transaction_id or var.id in site_written:
+                if writes: var.current_val = writes.get(var.id, var.current_val)
+                var.commited_val.append(ts, var.current_val)
+                self.versioned[var.id] = var
+                if self.wal is not None: self.wal.append(ts, var.id, var.current_val)
+                if var.status != VAR_STATUS.READY:
+                    self.__set_status(var, VAR_STATUS.READY)
+                changed = True
+            if var.release_lock(transaction_id):
+                changed = True
             if var.remain_lock(transaction_id):
                 error = True
+                if changed: self.__lock_changed(var)
+                # The variables left are visited again when the transaction ends next time
+                footprint[var.id] = var
+                stop = var.order
                 break
-            var.update_lock_waiting_queue()
+            if var.update_lock_waiting_queue(self.cancel_queued_reads) or changed:
+                self.__lock_changed(var)
+            self.__release(var)
+        if self.pending_wakeups:
+            self.__wake_pending(visited, stop)
+
+        if not footprint:
+            self.__forget(transaction_id)
+        else:
+            self.__intend_again(transaction_id)
+        if self.site_holders or self.site_waiting or self.site_blocked:
+            self.__release_site(transaction_id)
+        if self.wal is not None and self.wal.flush():
+            self.checkpoint()
 
         if error: 
-            print("COMMIT ERROR: transaction {} has remaining locks".format(transaction_id))
+            self.log.event('commit_error', transaction=transaction_id)
             return False
         return True
 
+    def commit_group(self, group: list) -> None:
+        """[summary]
+        Commit several transactions in one pass, with the same result as committing them one after the other.
+        The new versions of a variable are appended together and its lock waiting queue is updated once,
+        unless a later transaction of the group touches it
+
+        Args:
+            group (list): (transaction_id, commit time, values written again as in commit()) in commit order
+        """
+        versions = {}   # variable_id -> (timestamps, values)
+        waiting = {}    # variable_id -> Variable whose lock waiting queue still has to be updated
+        for transaction_id, ts, writes in group:
+            error = False
+            footprint = self.transaction_footprint.get(transaction_id)
+            site_written = self.site_written.get(transaction_id, ())
+            visited = self.__footprint(transaction_id)
+            stop = None
+            for var in visited:
+                var : Variable
+                if waiting.pop(var.id, None) is not None and var.update_lock_waiting_queue(self.cancel_queued_reads):
+                    self.__lock_changed(var)
+                del footprint[var.id]
+                changed = False
+                if var.lock == LOCK.WRITE and var.lock_by_trans_id == transaction_id or var.id in site_written:
+                    if writes: var.current_val = writes.get(var.id, var.current_val)
+                    timestamps, values = versions.setdefault(var.id, ([], []))
+                    timestamps.append(ts)
+                    values.append(var.current_val)
+                    if self.wal is not None: self.wal.append(ts, var.id, var.current_val)
+                    if var.status != VAR_STATUS.READY:
+                        self.__set_status(var, VAR_STATUS.READY)
+                    changed = True
+                if var.release_lock(transaction_id):
+                    changed = True
+                if changed: self.__lock_changed(var)
+                if var.remain_lock(transaction_id):
+                    error = True
+                    footprint[var.id] = var
+                    stop = var.order
+                    break
+                waiting[var.id] = var
+            if self.pending_wakeups:
+                self.__wake_pending(visited, stop, waiting)
+
+            if not footprint:
+                self.__forget(transaction_id)
+            else:
+                self.__intend_again(transaction_id)
+            if self.site_holders or self.site_waiting or self.site_blocked:
+                self.__release_site(transaction_id)
+            if error:
+                self.log.event('commit_error', transaction=transaction_id)
+
+        for var_id, (timestamps, values) in versions.items():
+            var : Variable = self.variables[var_id]
+            var.commited_val.extend(timestamps, values)
+            self.versioned[var_id] = var
+        for var in waiting.values():
+            if var.update_lock_waiting_queue(self.cancel_queued_reads):
+                self.__lock_changed(var)
+            self.__release(var)
+        if self.wal is not None and self.wal.flush():
+            self.checkpoint()
+
     def abort(self, transaction_id: str)-> None:
         """[summary]
         delete all the waiting locks from this transaction in the lock waiting queue and release the lock
@@ -253,39 +976,230 @@ class DataManager:
         Args:
             transaction_id (str): 
         """
-        for var in self.variables.values():
+        visited = self.__footprint(transaction_id)
+        for var in visited:
             var : Variable
-            var.release_lock(transaction_id)
-            for l in list(var.lock_waiting_queue):
-                if l[1] == transaction_id:
-                    var.lock_waiting_queue.remove(l)
-            var.update_lock_waiting_queue()
+            changed = var.release_lock(transaction_id)
+            if var.remain_lock(transaction_id):
+                var.lock_waiting_queue = deque(l for l in var.lock_waiting_queue if l[1] != transaction_id) or ()
+                changed = True
+            if var.update_lock_waiting_queue(self.cancel_queued_reads) or changed:
+                self.__lock_changed(var)
+            self.__release(var)
+        if self.pending_wakeups:
+            self.__wake_pending(visited)
+        self.__forget(transaction_id)
+        if self.site_holders or self.site_waiting or self.site_blocked:
+            self.__release_site(transaction_id)
         return True
 
-    def fail(self) -> None:
-        for variable in self.variables.values():
+    def __wake_pending(self, visited: list, stop: int=None, waiting: dict=None) -> None:
+        """[summary]
+        Update the lock waiting queues of the variables a commit or an abort didn't visit.
+        A queue can be left with requests its lock allows, e.g. by a commit stopped at the remaining locks
+        of its transaction, or by a read granted while its request was queued; they are granted at the next
+        commit or abort of any transaction on the site
+
+        Args:
+            visited (list): variables of the transaction, whose queues were updated with its locks
+            stop (int): order of the variable a commit stopped at, the variables after it aren't updated
+            waiting (dict): variables whose update commit_group put off, updated first
+        """
+        visited = {var.id for var in visited}
+        for var in list(self.pending_wakeups.values()):
+            var : Variable
+            if var.id not in visited and (stop is None or var.order < stop):
+                if waiting is not None and waiting.pop(var.id, None) is not None \
+                        and var.update_lock_waiting_queue(self.cancel_queued_reads):
+                    self.__lock_changed(var)
+                if var.update_lock_waiting_queue(self.cancel_queued_reads):
+                    self.__lock_changed(var)
+            if not var.lock_waiting_queue:
+                del self.pending_wakeups[var.id]
+                self.__release(var)
+
+    def waits_for_edges(self, var_id: str) -> set:
+        """
+        Edges of the waits-for graph caused by a variable on this site, or by the site lock for SITE_KEY,
+        empty if the site is down
+        """
+        if var_id == SITE_KEY:
+            return {(tid, holder) for tid in set(self.site_waiting) | set(self.site_blocked)
+                    for holder in self.__site_blockers(tid)} if self.on_flag else set()
+        var = self.__in_use(var_id) if self.on_flag else None
+        return var.waits_for_edges() if var is not None else set()
+
+    def queue_length(self, var_id: str) -> int:
+        """
+        Number of requests in the lock waiting queue of a variable, or waiting for the site lock for SITE_KEY
+        """
+        if var_id == SITE_KEY:
+            return len(self.site_waiting) + len(self.site_blocked)
+        var = self.__in_use(var_id)
+        return len(var.lock_waiting_queue) if var is not None else 0
+
+    def blockers(self, var_id: str, tid: str) -> set:
+        """
+        Transactions a waiting request of tid for a variable on this site waits for, for the site lock with SITE_KEY,
+        empty if the site is down
+        """
+        if not self.on_flag:
+            return set()
+        if var_id == SITE_KEY:
+            return self.__site_blockers(tid)
+        var = self.__in_use(var_id)
+        blockers = var.blockers(tid) if var is not None else set()
+        if tid in self.site_blocked:
+            blockers |= self.__site_blockers(tid)
+        return blockers
+
+    def __site_blockers(self, tid: str) -> set:
+        """
+        Transactions the requests of tid refused by the site lock wait for
+        """
+        blockers = set()
+        if tid in self.site_waiting:
+            blockers |= self.__site_conflicts(tid, self.site_waiting[tid])
+        if tid in self.site_blocked:
+            blockers |= self.__site_conflicts(tid, self.site_blocked[tid][0])
+        return blockers
+
+    def fail(self) -> list:
+        """[summary]
+        Lose the locks and the pending writes
+
+        Returns:
+            list: the transactions that accessed the site
+        """
+        in_use = self.variables.hot.values() if self.mapped else self.variables.values()
+        for variable in list(in_use):
             variable : Variable
             variable.lock = LOCK.NONE
             variable.status = VAR_STATUS.UNAVAILABLE
-            variable.lock_waiting_queue = deque()
-            variable.read_lock_list = set()
+            variable.lock_waiting_queue = ()
+            variable.read_lock_list = ()
+            self.__lock_changed(variable)
+            self.__release(variable)
+        if self.mapped:
+            self.variables.table.fill_status(STATUS_CODE[VAR_STATUS.UNAVAILABLE])
+            self.recovering = 0
+            if self.directory is not None:
+                self.directory.set_site_recovering(self.id, False)
+        # All the locks and pending writes are lost
+        self.transaction_footprint = defaultdict(dict)
+        self.site_written = {}
+        self.intentions = {}
+        self.intention_counts = {SITE_LOCK.IS: 0, SITE_LOCK.IX: 0}
+        self.pending_wakeups = {}
+        accessed = list(self.visiting_variables)
+        accessed.extend(tid for tid in self.site_holders if tid not in self.visiting_variables)
+        for _, variable_ids in self.site_blocked.values():
+            self.lock_events.update((self.id, variable_id) for variable_id in variable_ids)
+        if self.site_holders or self.site_waiting or self.site_blocked:
+            self.lock_events.add((self.id, SITE_KEY))
+        self.site_holders, self.site_waiting, self.site_blocked = {}, {}, {}
         self.on_flag = False
+        if self.directory is not None:
+            self.directory.set_site_status(self.id, DM_STATUS.DOWN)
+        return accessed
 
     def recover(self) -> bool:
         if self.on_flag:
-            print("Can't recover. The site is already working")
+            self.log.event('recover_error', site=self.id)
             return False
         else:
             self.on_flag = True
-            for variable in self.variables.values():
-                variable : Variable
-                if variable.even:
-                    variable.status = VAR_STATUS.RECOVERING
-                else:
-                    variable.status = VAR_STATUS.READY
+            if self.wal is not None:
+                self.load()
+            if self.mapped:
+                self.__recover_table()
+                for variable in self.variables.hot.values():
+                    variable : Variable
+                    variable.status = VAR_STATUS.RECOVERING if variable.even else VAR_STATUS.READY
+                    self.__lock_changed(variable)
+            else:
+                for variable in self.variables.values():
+                    variable : Variable
+                    if variable.even:
+                        self.__set_status(variable, VAR_STATUS.RECOVERING)
+                    else:
+                        self.__set_status(variable, VAR_STATUS.READY)
+                    self.__lock_changed(variable)
+            if self.directory is not None:
+                self.directory.set_site_status(self.id, DM_STATUS.WORKING)
+            self.lock_events.add((self.id, SITE_KEY))
             return True
         return False
 
+    def __recover_table(self) -> None:
+        """
+        Set the status of every record of the mapped table, the replicated variables wait for a write
+        """
+        table = self.variables.table
+        replicated = self.variables.replicated
+        table.status[:] = replicated.translate(RECOVER_STATUS)
+        self.recovering = replicated.count(1)
+        if self.recovering and self.directory is not None:
+            self.directory.set_site_recovering(self.id, True)
+
+    def checkpoint(self) -> None:
+        """
+        Save the versions kept in memory and empty the write-ahead log.
+        A mapped table is its own checkpoint, it's only written out
+        """
+        if self.mapped:
+            self.variables.table.flush()
+            self.wal.checkpoint(None)
+            return
+        self.wal.checkpoint((var.id, var.commited_val.items()) for var in self.variables.values())
+
+    def load(self) -> None:
+        """[summary]
+        Rebuild the committed versions from the checkpoint and the write-ahead log,
+        as after a crash that lost the memory of the site.
+        A mapped table already holds them, the records it misses are replayed
+        """
+        if self.mapped:
+            for var_id, timestamps, values in self.wal.read_checkpoint():
+                self.__replay(var_id, timestamps[-1], values[-1])
+            for ts, var_id, val in self.wal.read_log():
+                self.__replay(var_id, ts, val)
+            return
+        for var in self.variables.values():
+            var : Variable
+            var.commited_val = VersionStore(var.value)
+        for var_id, timestamps, values in self.wal.read_checkpoint():
+            var : Variable = self.variables.get(var_id)
+            if var is not None:
+                var.commited_val = VersionStore(values[0], timestamps[0])
+                var.commited_val.extend(timestamps[1:], values[1:])
+        for ts, var_id, val in self.wal.read_log():
+            var : Variable = self.variables.get(var_id)
+            # records already in the checkpoint when the log wasn't emptied yet
+            if var is not None and ts >= var.commited_val.latest_timestamp():
+                var.commited_val.append(ts, val)
+        self.versioned = {}
+        self.retained = {var.id: var for var in self.variables.values() if len(var.commited_val) > 1}
+
+    def __replay(self, var_id: str, ts: int, val: int) -> None:
+        store = self.variables.versions(var_id)
+        if store is not None and ts > store.latest_timestamp():
+            store.append(ts, val)
+
+    def last_commit_time(self) -> int:
+        """
+        Time of the last version committed on this site
+        """
+        if self.mapped:
+            return self.variables.table.last_timestamp()
+        return max((var.commited_val.latest_timestamp() for var in self.variables.values()), default=0)
+
+    def close(self) -> None:
+        if self.wal is not None:
+            self.wal.close()
+        if self.mapped:
+            self.variables.table.close()
+
     def snapshot(self, timestamp: int, var_id: str):
         """[summary]
         Read function for read-only transactions 
@@ -298,24 +1212,141 @@ class DataManager:
             bool: successful or not
             int or None: int for the value, None if fail
         """
+        if self.mapped:
+            versions = self.variables.versions(var_id)
+            return (True, versions.at(timestamp)) if versions is not None else (False, None)
         if var_id in self.variables:
             current_variable : Variable = self.variables[var_id]
-            value = 0
-            for ts, v in current_variable.commited_val.items():
-                if ts <= timestamp:
-                    value = v
-                else:
-                    break
-            return True, value
+            return True, current_variable.commited_val.at(timestamp)
         return False, None
 
-    def dump(self) -> None:
+    def collect_versions(self, watermark: int, advanced: bool=True) -> tuple:
         """[summary]
-        print the info
+        Prune the versions that no snapshot at or after the watermark can see
+
+        Args:
+            watermark (int): start time of the oldest active read-only transaction
+            advanced (bool): the watermark moved since the last collection, 
+                             otherwise only the variables with new versions are checked
+
+        Returns:
+            int: number of versions reclaimed
+            int: estimated number of bytes reclaimed
         """
-        # Generating outputs
-        return_str = "Site {:2} - ".format(self.id)
-        for var in self.variables.values():
+        candidates = self.versioned
+        self.versioned = {}
+        if advanced:
+            self.retained.update(candidates)
+            candidates, self.retained = self.retained, {}
+
+        versions = reclaimed = 0
+        for var in candidates.values():
             var : Variable
-            return_str += " {:2}: {:<5}".format(var.id, var.commited_val[next(reversed(var.commited_val))])
-        print(return_str[:-1])  
\ No newline at end of file
+            count, size = var.commited_val.prune(watermark)
+            versions += count
+            reclaimed += size
+            if len(var.commited_val) > 1:
+                self.retained[var.id] = var
+            else:
+                self.__release(var)
+        return versions, reclaimed
+
+    def seed(self, values: array, given: bytearray=None) -> None:
+        """[summary]
+        Replace the initial value of the variables, before any transaction ran.
+        A mapped table is written in one step when every variable is set
+
+        Args:
+            values (array): values[i] is the initial value of x<i>, for every variable index
+            given (bytearray): given[i] is 1 for the variables to set, None to set all of them
+        """
+        if self.mapped:
+            table = self.variables.table
+            indexes = self.variables.indexes
+            if given is None:
+                seeded = take(values, indexes)
+                table.words[1::3] = seeded
+                table.words[2::3] = seeded
+            else:
+                for slot in compress(range(len(indexes)), map(given.__getitem__, indexes)):
+                    table.set(slot, 0, values[indexes[slot]])
+                    table.set_written(slot, values[indexes[slot]])
+            for var in self.variables.hot.values():
+                var.current_val = table.written(var.order)
+        else:
+            for var in self.variables.values():
+                var : Variable
+                index = int(var.id[1:])
+                if given is None or given[index]:
+                    var.value = var.current_val = values[index]
+                    var.commited_val = VersionStore(var.value)
+        if self.wal is not None:
+            self.checkpoint()
+
+    def export(self, variable_ids: list=None, history: bool=False) -> tuple:
+        """[summary]
+        The committed versions of the variables as columns, in the order of the variable table.
+        The last versions of a mapped table are copied without visiting the variables
+
+        Args:
+            variable_ids (list): the variables to export, None for all of them
+            history (bool): every version kept, otherwise only the last committed one
+
+        Returns:
+            array: index of the variable of every row
+            array: commit time of the version
+            array: value of the version
+        """
+        indexes, timestamps, values = array('q'), array('q'), array('q')
+        if self.mapped:
+            table = self.variables.table
+            if variable_ids is None:
+                slots = range(len(self.variables))
+            else:
+                slots = sorted({slot for slot in map(self.variables.slot, variable_ids) if slot >= 0})
+            stores = {}     # slot -> versions kept on the heap
+            if history:
+                stores = {var.order: var.commited_val.history for var in self.variables.hot.values()
+                          if var.commited_val.history is not None}
+            if variable_ids is None and not stores:
+                return array('q', self.variables.indexes), int64(table.words[0::3]), int64(table.words[1::3])
+            for slot in slots:
+                store = stores.get(slot)
+                if store is None:
+                    indexes.append(self.variables.indexes[slot])
+                    timestamps.append(table.timestamp(slot))
+                    values.append(table.value(slot))
+                else:
+                    indexes.extend([self.variables.indexes[slot]] * len(store))
+                    timestamps.extend(store.timestamps)
+                    values.extend(store.values)
+            return indexes, timestamps, values
+
+        if variable_ids is None:
+            variables = self.variables.values()
+        else:
+            variables = sorted({self.variables[var_id] for var_id in variable_ids if var_id in self.variables},
+                               key=lambda var: var.order)
+        for var in variables:
+            var : Variable
+            store = var.commited_val
+            if history:
+                indexes.extend([int(var.id[1:])] * len(store))
+                timestamps.extend(store.timestamps)
+                values.extend(store.values)
+            else:
+                indexes.append(int(var.id[1:]))
+                timestamps.append(store.latest_timestamp())
+                values.append(store.latest())
+        return indexes, timestamps, values
+
+    def dump(self) -> None:
+        """[summary]
+        report the latest committed value of every variable
+        """
+        if self.log.enabled(LEVEL.INFO):
+            if self.mapped:
+                values = list(zip(self.variables, self.variables.table.words[1::3].tolist()))
+            else:
+                values = [(var.id, var.commited_val.latest()) for var in self.variables.values()]
+            self.log.event('dump', site=self.id, values=values)
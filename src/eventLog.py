@@ -0,0 +1,124 @@
+import json
+import sys
+from enum import IntEnum
+from itertools import chain
+
+# Log levels, an event is written when its level is at least the level of the sink
+class LEVEL(IntEnum):
+    DEBUG = 10
+    INFO = 20
+    WARNING = 30
+    ERROR = 40
+    OFF = 100
+
+def format_dump(fields: dict) -> str:
+    # one format for the whole line, not one per variable
+    values = fields['values']
+    line = "Site {:2} - ".format(fields['site']) + (" %-2s: %-5s" * len(values)) % tuple(chain.from_iterable(values))
+    return line[:-1]
+
+# event name -> (level, text format or function of the fields)
+EVENTS = {
+    'begin': (LEVEL.DEBUG, "Begin   --- Transaction: {transaction} begins"),
+    'begin_ro': (LEVEL.DEBUG, "BeginRO --- Read-Only Transaction: {transaction} begins"),
+    'read': (LEVEL.DEBUG, "Read    --- Transaction: {transaction}, read from site {site} -- {variable}: {value}"),
+    'read_ro': (LEVEL.DEBUG, "Read    --- Read-only transaction: {transaction},  read from site {site} -- {variable}: {value}"),
+    'write': (LEVEL.DEBUG, "Write   --- Transaction: {transaction}, writes {variable}: {value} in sites: {sites}"),
+    'commit': (LEVEL.DEBUG, "Commited transaction: {transaction}"),
+    'abort': (LEVEL.DEBUG, "Aborted transaction :{transaction}"),
+    'site_fail': (LEVEL.DEBUG, "Site: {site} failed"),
+    'site_recover': (LEVEL.DEBUG, "Successfully recovered site {site}."),
+    'invalid_end': (LEVEL.DEBUG, "Error: Invalid transaction_id: {transaction} to end"),
+    'invalid_fail': (LEVEL.DEBUG, "Error: Invalid site id: {site} to fail"),
+    'invalid_recover': (LEVEL.DEBUG, "Error: Invalid site id: {site} to recover"),
+    'deadlock': (LEVEL.INFO, "Deadlock! Transaction {transaction} aborted"),
+    'die': (LEVEL.INFO, "Wait-die! Transaction {transaction} aborted, it waits for the older {holder}"),
+    'wound': (LEVEL.INFO, "Wound-wait! Transaction {transaction} aborted by the older {requester}"),
+    'timeout': (LEVEL.INFO, "Timeout! Transaction {transaction} aborted, its {command}({variable}) waited {ticks} ticks"),
+    'reject': (LEVEL.INFO, "Rejected --- Transaction: {transaction}, {command}({variable}) not queued, {reason}"),
+    'dump_begin': (LEVEL.INFO, "\nDUMP\n"),
+    'dump': (LEVEL.INFO, format_dump),
+    'recover_error': (LEVEL.WARNING, "Can't recover. The site is already working"),
+    'commit_error': (LEVEL.ERROR, "COMMIT ERROR: transaction {transaction} has remaining locks"),
+}
+
+class EventSink:
+    def __init__(self, level: LEVEL=LEVEL.INFO) -> None:
+        """[summary]
+        Where the transaction manager and the data managers report what happens.
+        Callers on hot paths check `sink.level <= LEVEL.X` before building the event,
+        so a disabled level costs one comparison
+
+        level (LEVEL): the lowest level written
+        tick (int): current time of the transaction manager, set by it
+        """
+        self.level = level
+        self.tick = 0
+
+    def enabled(self, level: LEVEL) -> bool:
+        return self.level <= level
+
+    def event(self, name: str, **fields) -> None:
+        """
+        Report an event of the EVENTS table, the message is only formatted if its level is enabled
+        """
+        level, fmt = EVENTS[name]
+        if self.level <= level:
+            self.write(level, name, fmt, fields)
+
+    def write(self, level: LEVEL, name: str, fmt, fields: dict) -> None:
+        pass
+
+    def flush(self) -> None:
+        pass
+
+class SilentSink(EventSink):
+    def __init__(self) -> None:
+        """
+        Discard every event
+        """
+        super().__init__(LEVEL.OFF)
+
+    def event(self, name: str, **fields) -> None:
+        pass
+
+class TextSink(EventSink):
+    def __init__(self, level: LEVEL=LEVEL.INFO, stream=None, buffer_size: int=0) -> None:
+        """[summary]
+        Human readable messages, one per line
+
+        stream (file): defaults to the standard output
+        buffer_size (int): number of lines kept before they are written out together, 0 writes every line
+        """
+        super().__init__(level)
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self.buffer = []
+
+    def write(self, level: LEVEL, name: str, fmt, fields: dict) -> None:
+        line = fmt(fields) if callable(fmt) else fmt.format(**fields)
+        self.buffer.append(line)
+        if len(self.buffer) > self.buffer_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.buffer:
+            return
+        stream = self.stream if self.stream is not None else sys.stdout
+        self.buffer.append('')
+        stream.write('\n'.join(self.buffer))
+        self.buffer = []
+
+class JsonlSink(TextSink):
+    def __init__(self, level: LEVEL=LEVEL.INFO, stream=None, buffer_size: int=1024) -> None:
+        """[summary]
+        One JSON object per line with the tick, the level, the event name and its fields
+        """
+        super().__init__(level, stream, buffer_size)
+
+    def write(self, level: LEVEL, name: str, fmt, fields: dict) -> None:
+        record = {'tick': self.tick, 'level': level.name, 'event': name}
+        record.update(fields)
+        self.buffer.append(json.dumps(record, separators=(',', ':')))
+        if len(self.buffer) > self.buffer_size:
+            self.flush()
@@ -1,27 +1,130 @@
 import re
+import sys
 from collections import deque
+from enum import Enum
+from typing import NamedTuple
+
+# A token is a command name, a transaction id, a variable id, a site id or a value
+TOKEN_PATTERN = re.compile(r"[\w]+")
+
+# Command types
+class COMMAND_TYPE(Enum):
+    BEGIN = 'begin'
+    BEGINRO = 'beginRO'
+    READ = 'R'
+    WRITE = 'W'
+    READRANGE = 'RR'    # RR(T1, x1, x20) reads x1..x20
+    WRITEMANY = 'MW'    # MW(T1, x1, 10, x3, 30) writes several variables
+    END = 'end'
+    FAIL = 'fail'
+    RECOVER = 'recover'
+    DUMP = 'dump'
+
+COMMAND_NAMES = {type.value: type for type in COMMAND_TYPE}
+
+class Operation(NamedTuple):
+    """
+    A decoded input line, the fields the command doesn't take are None
+    site_id is the site number as written in the input, starting from 1
+    last_variable_id is the end of the range of a range read, whose first variable is variable_id
+    writes are the (variable_id, value) of a multi-write, variable_id is its first variable
+    """
+    type: COMMAND_TYPE
+    transaction_id: str = None
+    variable_id: str = None
+    site_id: int = None
+    value: int = None
+    last_variable_id: str = None
+    writes: tuple = None
+
+def decode(args: list):
+    """[summary]
+    Turn the tokens of a line into an Operation
+
+    Args:
+        args (list): tokens, e.g. ['W', 'T1', 'x2', '10']
+
+    Returns:
+        Operation: None for an empty line or an invalid command
+    """
+    if not args:
+        return None
+    type = COMMAND_NAMES.get(args[0])
+    try:
+        if type == COMMAND_TYPE.READ:
+            return Operation(type, sys.intern(args[1]), sys.intern(args[2]))
+        elif type == COMMAND_TYPE.WRITE:
+            return Operation(type, sys.intern(args[1]), sys.intern(args[2]), value=int(args[3]))
+        elif type == COMMAND_TYPE.READRANGE:
+            return Operation(type, sys.intern(args[1]), sys.intern(args[2]), last_variable_id=sys.intern(args[3]))
+        elif type == COMMAND_TYPE.WRITEMANY:
+            if len(args) < 4 or len(args) % 2:
+                return None
+            writes = tuple((sys.intern(args[i]), int(args[i + 1])) for i in range(2, len(args), 2))
+            return Operation(type, sys.intern(args[1]), writes[0][0], writes=writes)
+        elif type in (COMMAND_TYPE.BEGIN, COMMAND_TYPE.BEGINRO, COMMAND_TYPE.END):
+            return Operation(type, sys.intern(args[1]))
+        elif type in (COMMAND_TYPE.FAIL, COMMAND_TYPE.RECOVER):
+            return Operation(type, site_id=int(args[1]))
+        elif type == COMMAND_TYPE.DUMP:
+            return Operation(type)
+    except (IndexError, ValueError):
+        pass
+    return None
 
 class Parser:
     def __init__(self, file_name=None) -> None:
+        """
+        file_name (str): the command file, '-' or None to read the standard input
+        """
         self.FINISH_FLAG = False
         self.file_name = file_name
         self.opertaions = deque()
     
     def parse_file(self) -> None:
+        """
+        Load and decode the whole file, the operations are then taken by get_operation()
+        """
+        for args in self.stream():
+            self.opertaions.append(args)
+
+    def stream(self):
+        """[summary]
+        Read and decode the file lazily, one line at a time, so a trace of any length
+        is replayed in constant memory. The file is opened right away
+
+        Returns:
+            generator: the Operation of each valid line, empty lines and invalid commands are skipped
+        """
+        if self.file_name is None or self.file_name == '-':
+            return self.__tokenize(sys.stdin, close=False)
+        try:
+            f = open(self.file_name, 'r')
+        except IOError:
+            print("FATAL ERROR: Invalid input file {}".format(self.file_name))
+            return iter(())
+        return self.__tokenize(f, close=True)
+
+    def __tokenize(self, f, close: bool):
         try:
-            with open(self.file_name, 'r') as f:
-                lines = f.readlines()
-                for line in lines:
-                    args = self.__parse_line(line)
-                    self.opertaions.append(args)
+            for line in f:
+                operation = decode(self.__parse_line(line))
+                if operation is not None:
+                    yield operation
         except IOError:
             print("FATAL ERROR: Invalid input file {}".format(self.file_name))
+        finally:
+            if close:
+                f.close()
+            self.FINISH_FLAG = True
 
     def __parse_line(self, line:str):
-        line = line.split('//')[0].strip()
-        return re.findall(r"[\w]+", line)
+        end = line.find('//')
+        if end < 0:
+            end = len(line)
+        return TOKEN_PATTERN.findall(line, 0, end)
 
     def get_operation(self):
         if len(self.opertaions) > 0:
             return self.opertaions.popleft()
-        return None
\ No newline at end of file
+        return None
@@ -1,21 +1,97 @@
 import sys
+import argparse
 from transactionManager import *
 from iohandler import Parser
+from eventLog import SilentSink, JsonlSink
+import columnar
+
+LOG_LEVELS = {'debug': LEVEL.DEBUG, 'info': LEVEL.INFO, 'warning': LEVEL.WARNING, 'error': LEVEL.ERROR}
+
+def make_log(mode: str, level: LEVEL, stream, buffer_size: int) -> EventSink:
+    if mode == 'silent':
+        return SilentSink()
+    if mode == 'jsonl':
+        return JsonlSink(level, stream, buffer_size)
+    return TextSink(level, stream, buffer_size)
+
+def add_manager_arguments(arg_parser: argparse.ArgumentParser) -> None:
+    """
+    Options of the TransactionManager, shared with replay.py
+    """
+    arg_parser.add_argument('--deadlock', choices=[p.name.lower() for p in DEADLOCK_POLICY], default='detection',
+                            help='detect the deadlocks, or prevent them with wait-die or wound-wait')
+    arg_parser.add_argument('--routing', choices=[r.name.lower() for r in READ_ROUTING], default='first',
+                            help='which replica a read tries first')
+    arg_parser.add_argument('--group-commit', type=int, default=0, metavar='TICKS',
+                            help='apply the commits ended within this many ticks together')
+    arg_parser.add_argument('--read-cache', action='store_true',
+                            help='answer the reads of what a transaction wrote or already read without the sites')
+    arg_parser.add_argument('--lock-timeout', type=int, default=0, metavar='TICKS',
+                            help='abort a transaction whose command waited this many ticks for a lock')
+    arg_parser.add_argument('--max-queue', type=int, default=0, metavar='COMMANDS',
+                            help='reject the reads and writes arriving while this many commands are queued')
+    arg_parser.add_argument('--max-outstanding', type=int, default=0, metavar='COMMANDS',
+                            help='reject the reads and writes of a transaction that has this many queued commands')
+    arg_parser.add_argument('--storage', choices=['memory', 'mmap'], default='memory',
+                            help='keep the committed versions on the heap or in memory-mapped tables')
+
+def manager_from_arguments(args: argparse.Namespace, log: EventSink, metrics: Metrics=None, data_dir: str=None,
+                           processes: bool=False) -> TransactionManager:
+    """
+    A TransactionManager set up from the options of add_manager_arguments
+    """
+    tm = TransactionManager(log=log, metrics=metrics, deadlock_policy=DEADLOCK_POLICY[args.deadlock.upper()],
+                            data_dir=data_dir, storage=args.storage, processes=processes,
+                            read_routing=READ_ROUTING[args.routing.upper()])
+    tm.commit_window = args.group_commit
+    tm.read_cache = args.read_cache
+    tm.lock_timeout = args.lock_timeout
+    tm.max_queue = args.max_queue
+    tm.max_transaction_commands = args.max_outstanding
+    return tm
 
 if __name__ == '__main__':
-    if len(sys.argv) >= 2:
-        filename = sys.argv[1]
+    arg_parser = argparse.ArgumentParser(description='Replicated concurrency control and recovery')
+    arg_parser.add_argument('file', nargs='?', help="command file, '-' to read the standard input")
+    arg_parser.add_argument('--log', choices=['text', 'jsonl', 'silent'], default='text', help='event log format')
+    arg_parser.add_argument('--level', choices=list(LOG_LEVELS), default='debug', help='lowest level logged')
+    arg_parser.add_argument('--log-file', help='write the events to this file instead of the standard output')
+    arg_parser.add_argument('--buffer', type=int, default=1024, help='number of events buffered before writing')
+    add_manager_arguments(arg_parser)
+    arg_parser.add_argument('--data-dir', help='keep a write-ahead log and checkpoints of every site in this directory')
+    arg_parser.add_argument('--processes', action='store_true', help='run every site in its own process')
+    arg_parser.add_argument('--metrics', action='store_true', help='print timers and lock contention metrics at the end')
+    arg_parser.add_argument('--seed', metavar='FILE',
+                            help="initial values from a .npz file with 'variable' and 'value' columns, optionally 'site'")
+    arg_parser.add_argument('--export', metavar='FILE', help='write the committed versions to a .npz file at the end')
+    arg_parser.add_argument('--history', action='store_true', help='export every version kept, not only the last one')
+    args = arg_parser.parse_args()
+
+    if args.file is not None:
+        filename = args.file        # '-' to read the commands from the standard input
         parser = Parser(filename)
-        tm = TransactionManager()
-        tm.debug = True             # set to true if you'd like to see more debug logs
-        parser.parse_file()
+        stream = open(args.log_file, 'w') if args.log_file else None
+        log = make_log(args.log, LOG_LEVELS[args.level], stream, args.buffer)
+        tm = manager_from_arguments(args, log, Metrics() if args.metrics else None, args.data_dir, args.processes)
+        if args.seed:
+            tm.seed(columnar.load(args.seed))
+        operations = parser.stream()
+        banner = args.log == 'text'
         
-        print("\n----- RUNNING TRANSACTION MANAGER -----\n")
-        cmd = parser.get_operation()
-        while cmd is not None:
-            tm.operate(cmd)
-            cmd = parser.get_operation()
-        print("\n-------------- FINISHED ---------------\n")
+        if banner: print("\n----- RUNNING TRANSACTION MANAGER -----\n")
+        try:
+            for cmd in operations:
+                tm.operate(cmd)
+            tm.drain()
+            if args.export:
+                columnar.save(args.export, tm.export(history=args.history))
+        finally:
+            tm.close()
+            log.flush()
+            if stream is not None:
+                stream.close()
+        if banner: print("\n-------------- FINISHED ---------------\n")
+        if tm.metrics is not None:
+            print(tm.metrics.report(), file=sys.stderr)
     else:
         print('ERROR: PLEASE INPUT THE COMMAND FILE!')
-
@@ -0,0 +1,139 @@
+import mmap
+import os
+from array import array
+from versionStore import VersionStore
+
+MAGIC = b'RCCRTBL1'
+HEADER_SIZE = 16        # magic, number of records
+RECORD_WORDS = 3        # int64 timestamp and value of the last committed version, value being written
+
+class MappedTable:
+    def __init__(self, values: list, path: str=None) -> None:
+        """[summary]
+        Fixed-width records of the variables of a site in a memory-mapped file: the header, then for every
+        variable the commit time and the value of its last committed version and the last value written to it
+        (three int64), then one status byte per variable. Reads and writes go through memoryviews of the mapping,
+        nothing is copied to the heap. An existing file with the same number of records is reopened as it is
+
+        values (array): initial value of every record, used when the file is created
+        path (str): the file, None for an anonymous mapping that only lives as long as the process
+        words (memoryview): int64 words of the records, the record i is words[3i:3i + 3]
+        status (memoryview): status byte of every record
+        """
+        count = len(values)
+        self.count = count
+        self.path = path
+        size = HEADER_SIZE + count * RECORD_WORDS * 8 + count
+        fresh = True
+        if path is None:
+            self.map = mmap.mmap(-1, size)
+        else:
+            fresh = not (os.path.exists(path) and os.path.getsize(path) == size)
+            with open(path, 'w+b' if fresh else 'r+b') as f:
+                if fresh:
+                    f.truncate(size)
+                self.map = mmap.mmap(f.fileno(), size)
+            fresh = fresh or self.map[:8] != MAGIC or int.from_bytes(self.map[8:16], 'little') != count
+        body = HEADER_SIZE + count * RECORD_WORDS * 8
+        self.words = memoryview(self.map)[HEADER_SIZE:body].cast('q')
+        self.status = memoryview(self.map)[body:]
+        if fresh:
+            records = array('q', bytes(RECORD_WORDS * 8 * count))
+            records[1::3] = values
+            records[2::3] = values
+            self.words[:] = records
+            self.map[:HEADER_SIZE] = MAGIC + count.to_bytes(8, 'little')
+        self.fill_status(0)
+
+    def timestamp(self, slot: int) -> int:
+        return self.words[3 * slot]
+
+    def value(self, slot: int) -> int:
+        return self.words[3 * slot + 1]
+
+    def set(self, slot: int, timestamp: int, val: int) -> None:
+        self.words[3 * slot] = timestamp
+        self.words[3 * slot + 1] = val
+
+    def written(self, slot: int) -> int:
+        """
+        The last value written to the variable, committed or not
+        """
+        return self.words[3 * slot + 2]
+
+    def set_written(self, slot: int, val: int) -> None:
+        self.words[3 * slot + 2] = val
+
+    def fill_status(self, code: int) -> None:
+        self.status[:] = bytes([code]) * self.count
+
+    def last_timestamp(self) -> int:
+        return max(self.words[0::3], default=0)
+
+    def flush(self) -> None:
+        """
+        Write the dirty pages of the mapping to the file
+        """
+        if self.path is not None:
+            self.map.flush()
+
+    def close(self) -> None:
+        self.flush()
+        self.words.release()
+        self.status.release()
+        self.map.close()
+
+class MappedVersionStore:
+    __slots__ = ('table', 'slot', 'history')
+
+    def __init__(self, table: MappedTable, slot: int) -> None:
+        """[summary]
+        The VersionStore of a variable whose last version is a record of a MappedTable.
+        The older versions that snapshots may still read are kept on the heap, in history,
+        until the garbage collection leaves only the last one
+
+        history (VersionStore): every version while there is more than one, None otherwise
+        """
+        self.table = table
+        self.slot = slot
+        self.history = None
+
+    def __len__(self) -> int:
+        return len(self.history) if self.history is not None else 1
+
+    def latest(self) -> int:
+        return self.table.value(self.slot)
+
+    def latest_timestamp(self) -> int:
+        return self.table.timestamp(self.slot)
+
+    def at(self, timestamp: int, default: int=0) -> int:
+        if self.history is not None:
+            return self.history.at(timestamp, default)
+        if timestamp < self.table.timestamp(self.slot):
+            return default
+        return self.table.value(self.slot)
+
+    def append(self, timestamp: int, val: int) -> None:
+        if self.history is None and timestamp != self.table.timestamp(self.slot):
+            self.history = VersionStore(self.table.value(self.slot), self.table.timestamp(self.slot))
+        if self.history is not None:
+            self.history.append(timestamp, val)
+        self.table.set(self.slot, timestamp, val)
+
+    def extend(self, timestamps: list, values: list) -> None:
+        for timestamp, val in zip(timestamps, values):
+            self.append(timestamp, val)
+
+    def items(self):
+        if self.history is not None:
+            return self.history.items()
+        return iter(((self.table.timestamp(self.slot), self.table.value(self.slot)),))
+
+    def prune(self, watermark: int) -> tuple:
+        if self.history is None:
+            return 0, 0
+        pruned = self.history.prune(watermark)
+        if len(self.history) == 1:
+            self.history = None
+        return pruned
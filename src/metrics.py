@@ -0,0 +1,132 @@
+import time
+from collections import Counter, defaultdict
+
+class Metrics:
+    def __init__(self, clock=time.perf_counter) -> None:
+        """[summary]
+        Timers and lock contention counters of a TransactionManager and its DataManagers.
+        Nothing is collected unless one is given to them, see TransactionManager.enable_metrics
+
+        clock (function): returns the current time in seconds
+        phase_seconds (defaultdict(float)): phase -> cumulative time spent in it, phases can be nested
+        phase_calls (defaultdict(int)): phase -> number of times it ran
+        queue_lengths (Counter): length -> number of lock requests that made a lock waiting queue that long
+        wait_ticks (Counter): ticks -> number of blocked commands that waited that long before running
+        blocked (Counter): variable_id -> number of commands blocked on it
+        blocked_ticks (Counter): variable_id -> ticks spent waiting on it by the commands that ran
+        deadlock_aborts (int): transactions aborted to break or to prevent a deadlock
+        timeout_aborts (int): transactions aborted because a command waited longer than the lock timeout
+        failure_aborts (int): transactions aborted at their end because a site they accessed failed
+        rejected_commands (int): reads and writes rejected because the command queue was full
+        reads_by_site (Counter): site_id -> number of reads served by the site, snapshots included
+        cached_reads (int): reads answered by the transaction, from what it wrote or already read
+        buffered_writes (int): writes kept by the transaction until it commits, it already held the locks
+        """
+        self.clock = clock
+        self.phase_seconds = defaultdict(float)
+        self.phase_calls = defaultdict(int)
+        self.queue_lengths = Counter()
+        self.wait_ticks = Counter()
+        self.blocked = Counter()
+        self.blocked_ticks = Counter()
+        self.deadlock_aborts = 0
+        self.timeout_aborts = 0
+        self.failure_aborts = 0
+        self.rejected_commands = 0
+        self.reads_by_site = Counter()
+        self.cached_reads = 0
+        self.buffered_writes = 0
+
+    def timed(self, phase: str, func):
+        """
+        Wrap a function to add the time spent in it to a phase
+        """
+        clock = self.clock
+        seconds, calls = self.phase_seconds, self.phase_calls
+        def wrapper(*args, **kwargs):
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                seconds[phase] += clock() - start
+                calls[phase] += 1
+        return wrapper
+
+    def record_queue_length(self, length: int) -> None:
+        self.queue_lengths[length] += 1
+
+    def record_block(self, variable_id: str) -> None:
+        self.blocked[variable_id] += 1
+
+    def record_wait(self, variable_id: str, ticks: int) -> None:
+        self.wait_ticks[ticks] += 1
+        self.blocked_ticks[variable_id] += ticks
+
+    def record_read(self, site_id: int) -> None:
+        self.reads_by_site[site_id] += 1
+
+    def read_imbalance(self) -> float:
+        """
+        Reads served by the busiest site over the mean per site, 1.0 when they are evenly spread
+        """
+        reads = sum(self.reads_by_site.values())
+        if not reads:
+            return 0.0
+        return max(self.reads_by_site.values()) * len(self.reads_by_site) / reads
+
+    def top_contended(self, n: int=10) -> list:
+        """[summary]
+        Variables on which the most commands were blocked
+
+        Returns:
+            list: (variable_id, blocked commands, ticks waited) of the n most contended variables
+        """
+        return [(var_id, count, self.blocked_ticks[var_id]) for var_id, count in self.blocked.most_common(n)]
+
+    def snapshot(self, top: int=10) -> dict:
+        """
+        Everything collected so far as plain data, e.g. to be saved as JSON
+        """
+        waits = sum(self.wait_ticks.values())
+        return {
+            'phases': {phase: {'seconds': self.phase_seconds[phase], 'calls': self.phase_calls[phase]}
+                       for phase in self.phase_seconds},
+            'queue_lengths': dict(sorted(self.queue_lengths.items())),
+            'wait_ticks': dict(sorted(self.wait_ticks.items())),
+            'waits': waits,
+            'mean_wait_ticks': sum(t * c for t, c in self.wait_ticks.items()) / waits if waits else 0.0,
+            'max_wait_ticks': max(self.wait_ticks, default=0),
+            'deadlock_aborts': self.deadlock_aborts,
+            'timeout_aborts': self.timeout_aborts,
+            'failure_aborts': self.failure_aborts,
+            'rejected_commands': self.rejected_commands,
+            'reads_by_site': dict(sorted(self.reads_by_site.items())),
+            'read_imbalance': self.read_imbalance(),
+            'cached_reads': self.cached_reads,
+            'buffered_writes': self.buffered_writes,
+            'top_contended': self.top_contended(top),
+        }
+
+    def report(self, top: int=10) -> str:
+        """
+        Human readable summary of the snapshot
+        """
+        data = self.snapshot(top)
+        lines = ["----------------- METRICS -----------------", "Phase                    calls     seconds"]
+        for phase, timer in sorted(data['phases'].items(), key=lambda item: -item[1]['seconds']):
+            lines.append("{:20} {:>9} {:11.6f}".format(phase, timer['calls'], timer['seconds']))
+        lines.append("Lock waiting queue length: " +
+                     (", ".join("{}: {}".format(length, count) for length, count in data['queue_lengths'].items()) or "-"))
+        lines.append("Lock waits: {} commands, mean {:.2f} ticks, max {} ticks".format(
+            data['waits'], data['mean_wait_ticks'], data['max_wait_ticks']))
+        lines.append("Aborts: {} deadlock, {} lock timeout, {} site failure".format(
+            data['deadlock_aborts'], data['timeout_aborts'], data['failure_aborts']))
+        lines.append("Rejected commands: {}".format(data['rejected_commands']))
+        lines.append("Reads by site: " +
+                     (", ".join("{}: {}".format(site_id, count) for site_id, count in data['reads_by_site'].items()) or "-") +
+                     " (busiest {:.2f}x the mean)".format(data['read_imbalance']))
+        lines.append("Answered by the transaction: {} reads, {} writes".format(data['cached_reads'], data['buffered_writes']))
+        lines.append("Most contended variables:")
+        for var_id, count, ticks in data['top_contended']:
+            lines.append("  {:6} blocked {:6} times, waited {:8} ticks".format(var_id, count, ticks))
+        return "\n".join(lines)
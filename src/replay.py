@@ -0,0 +1,187 @@
+"""
+Replay many command files, each with its own TransactionManager, on a pool of processes,
+and compare their outputs with the expected ones
+
+usage:
+    python3 ./src/replay.py test/
+    python3 ./src/replay.py test/ --save expected/
+    python3 ./src/replay.py test/ --expected expected/ --jobs 8 --json replay.json
+    python3 ./src/replay.py test/ --expected expected/ --group-commit 2 --dumps
+    python3 ./src/replay.py test/ --expected expected/ --processes
+"""
+import argparse
+import contextlib
+import difflib
+import io
+import json
+import os
+import sys
+import time
+import traceback
+from main import LOG_LEVELS, make_log, add_manager_arguments, manager_from_arguments
+from iohandler import Parser
+from siteProcess import CONTEXT
+
+def trace_files(paths: list) -> list:
+    """
+    The command files given, a directory gives its *.txt files by name
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith('.txt')))
+        else:
+            files.append(path)
+    return files
+
+def output_name(path: str) -> str:
+    """
+    Name of the expected output of a command file, test1.txt -> test1.out
+    """
+    return os.path.splitext(os.path.basename(path))[0] + '.out'
+
+def replay(task: tuple) -> dict:
+    """[summary]
+    Run a command file as main.py does and capture what it prints
+
+    Args:
+        task (tuple): (path of the command file, options of add_manager_arguments with the log level, buffer
+                      and processes)
+
+    Returns:
+        dict: the trace, its output, the number of operations, the seconds and CPU seconds spent,
+              and the traceback if it failed
+    """
+    path, args = task
+    output = io.StringIO()
+    operations = 0
+    error = None
+    start, cpu_start = time.perf_counter(), time.process_time()
+    with contextlib.redirect_stdout(output):
+        print("\n----- RUNNING TRANSACTION MANAGER -----\n")
+        log = make_log('text', LOG_LEVELS[args.level], None, args.buffer)
+        tm = manager_from_arguments(args, log, processes=args.processes)
+        try:
+            for op in Parser(path).stream():
+                tm.operate(op)
+                operations += 1
+            tm.drain()
+        except Exception:
+            error = traceback.format_exc()
+        finally:
+            tm.close()
+            log.flush()
+        if error is None:
+            print("\n-------------- FINISHED ---------------\n")
+    return {'trace': path, 'output': output.getvalue(), 'operations': operations,
+            'seconds': time.perf_counter() - start, 'cpu_seconds': time.process_time() - cpu_start, 'error': error}
+
+def replay_all(tasks: list, jobs: int):
+    """[summary]
+    Replay the tasks on jobs processes, in this process with one job.
+    The largest files are sent first so a long trace doesn't start last
+
+    Returns:
+        generator: the result of replay() of every task, in the order they finish
+    """
+    if jobs <= 1 or len(tasks) <= 1:
+        yield from map(replay, tasks)
+        return
+    tasks = sorted(tasks, key=lambda task: -os.path.getsize(task[0]))
+    with CONTEXT.Pool(min(jobs, len(tasks))) as pool:
+        yield from pool.imap_unordered(replay, tasks)
+
+def dump_lines(output: str) -> list:
+    """
+    The lines of the dumps in an output, what the sites hold whenever the commands ask for it
+    """
+    return [line for line in output.splitlines() if line == 'DUMP' or line.startswith('Site ')]
+
+def compare(result: dict, expected_dir: str, diff_lines: int, dumps: bool=False) -> None:
+    """
+    Set the status of a result: 'error', 'missing' without an expected output, 'same' or 'different'.
+    With dumps only the dumps are compared, e.g. with --group-commit the commits are reported later.
+    A different output keeps the first diff_lines lines of its diff
+    """
+    if result['error'] is not None:
+        result['status'] = 'error'
+        return
+    if expected_dir is None:
+        result['status'] = 'done'
+        return
+    try:
+        with open(os.path.join(expected_dir, output_name(result['trace']))) as f:
+            expected = f.read()
+    except FileNotFoundError:
+        result['status'] = 'missing'
+        return
+    expected, output = (dump_lines(expected), dump_lines(result['output'])) if dumps else \
+                       (expected.splitlines(), result['output'].splitlines())
+    if expected == output:
+        result['status'] = 'same'
+        return
+    result['status'] = 'different'
+    diff = difflib.unified_diff(expected, output, 'expected', 'output', lineterm='')
+    result['diff'] = [line for _, line in zip(range(diff_lines), diff)]
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Replay command files in parallel, one TransactionManager each')
+    arg_parser.add_argument('paths', nargs='+', help='command files, or directories of *.txt command files')
+    arg_parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help='processes replaying the files')
+    arg_parser.add_argument('--expected', metavar='DIR', help='compare the outputs with DIR/<name>.out')
+    arg_parser.add_argument('--save', metavar='DIR', help='write the outputs to DIR/<name>.out')
+    arg_parser.add_argument('--dumps', action='store_true', help='only compare the dumps with the expected outputs')
+    arg_parser.add_argument('--processes', action='store_true',
+                            help='run the sites of every file in their own processes, the files one after the other')
+    arg_parser.add_argument('--diff-lines', type=int, default=20, help='lines of diff shown for a different output')
+    arg_parser.add_argument('--json', help='save the report to this file')
+    arg_parser.add_argument('--level', choices=list(LOG_LEVELS), default='debug', help='lowest level logged')
+    arg_parser.add_argument('--buffer', type=int, default=1024, help='number of events buffered before writing')
+    add_manager_arguments(arg_parser)
+    args = arg_parser.parse_args()
+
+    traces = trace_files(args.paths)
+    if not traces:
+        print('ERROR: NO COMMAND FILE FOUND!')
+        sys.exit(2)
+    for path in traces:
+        if not os.path.isfile(path):
+            print("ERROR: INVALID COMMAND FILE {}".format(path))
+            sys.exit(2)
+    if args.processes:
+        args.jobs = 1   # the workers of a pool can't start the processes of the sites
+    if args.save:
+        os.makedirs(args.save, exist_ok=True)
+
+    tasks = [(path, args) for path in traces]
+    results = {}
+    start = time.perf_counter()
+    for result in replay_all(tasks, args.jobs):
+        compare(result, args.expected, args.diff_lines, args.dumps)
+        if args.save and result['error'] is None:
+            with open(os.path.join(args.save, output_name(result['trace'])), 'w') as f:
+                f.write(result['output'])
+        results[result['trace']] = result
+    elapsed = time.perf_counter() - start
+
+    statuses = dict.fromkeys(('same', 'different', 'missing', 'error', 'done'), 0)
+    for path in traces:
+        result = results[path]
+        statuses[result['status']] += 1
+        print("{:40} {:8} ops {:9.3f} s  {}".format(path, result['operations'], result['seconds'], result['status']))
+        for line in result.get('diff', ()):
+            print("    " + line)
+        if result['error'] is not None:
+            print("    " + result['error'].rstrip().replace("\n", "\n    "))
+    # the CPU time of the replays is what running them one after the other would take
+    replayed = sum(result['cpu_seconds'] for result in results.values())
+    print("{} files, {} replayed in {:.3f} s on {} processes ({:.3f} s of CPU, {:.1f}x)".format(
+        len(traces), ", ".join("{} {}".format(count, status) for status, count in statuses.items() if count),
+        elapsed, min(args.jobs, len(traces)), replayed, replayed / elapsed if elapsed else 0.0))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'seconds': elapsed, 'cpu_seconds': replayed, 'jobs': args.jobs, 'statuses': statuses,
+                       'traces': [{key: value for key, value in results[path].items() if key != 'output'}
+                                  for path in traces]}, f, indent=2)
+    sys.exit(1 if statuses['different'] or statuses['error'] else 0)
@@ -0,0 +1,84 @@
+from dataManager import *
+
+class ReplicaDirectory:
+    def __init__(self) -> None:
+        """[summary]
+        Central directory of the replicas, used to route reads and writes without probing every site
+
+        holders (dict): (variable_id, list(DataManager)), the sites holding each variable in site order
+        site_status (dict): (site_id, DM_STATUS)
+        down_sites (set): ids of the sites that are down
+        not_ready (dict): (variable_id, set(site_id)), replicas on working sites whose status is not VAR_STATUS.READY
+        recovering_sites (set): ids of the sites that keep the status of their replicas themselves (mapped tables)
+                                and still have replicas that are not ready, they are asked for every read
+        resolve (function): resolve(variable_id) returns the sites of a variable that wasn't added, None to disable
+        """
+        self.holders = {}
+        self.site_status = {}
+        self.down_sites = set()
+        self.not_ready = {}
+        self.recovering_sites = set()
+        self.resolve = None
+
+    def add_site(self, site_id: int) -> None:
+        self.site_status[site_id] = DM_STATUS.WORKING
+
+    def add_variable(self, variable_id: str, sites: list) -> None:
+        """
+        sites (list): the DataManagers holding the variable, may be shared between variables
+        """
+        self.holders[variable_id] = sites
+
+    def sites_of(self, variable_id: str) -> list:
+        """
+        All the sites holding the variable, working or not
+        """
+        sites = self.holders.get(variable_id)
+        if sites is None:
+            return self.resolve(variable_id) if self.resolve is not None else ()
+        return sites
+
+    def set_site_status(self, site_id: int, status: DM_STATUS) -> None:
+        self.site_status[site_id] = status
+        if status == DM_STATUS.WORKING:
+            self.down_sites.discard(site_id)
+        else:
+            self.down_sites.add(site_id)
+
+    def set_site_recovering(self, site_id: int, recovering: bool) -> None:
+        if recovering:
+            self.recovering_sites.add(site_id)
+        else:
+            self.recovering_sites.discard(site_id)
+
+    def set_replica_status(self, site_id: int, variable_id: str, status: VAR_STATUS) -> None:
+        if status == VAR_STATUS.READY:
+            sites = self.not_ready.get(variable_id)
+            if sites is not None:
+                sites.discard(site_id)
+                if not sites:
+                    del self.not_ready[variable_id]
+        else:
+            self.not_ready.setdefault(variable_id, set()).add(site_id)
+
+    def live_replicas(self, variable_id: str):
+        """
+        The working sites holding the variable, in site order
+        """
+        sites = self.sites_of(variable_id)
+        if not self.down_sites:
+            return iter(sites)
+        return (site for site in sites if site.id not in self.down_sites)
+
+    def readable_replicas(self, variable_id: str):
+        """
+        The working sites whose replica of the variable is ready to be read, in site order
+        """
+        sites = self.live_replicas(variable_id)
+        if self.recovering_sites:
+            recovering = self.recovering_sites
+            sites = (site for site in sites if site.id not in recovering or site.replica_ready(variable_id))
+        not_ready = self.not_ready.get(variable_id)
+        if not not_ready:
+            return sites
+        return (site for site in sites if site.id not in not_ready)
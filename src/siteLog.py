@@ -0,0 +1,109 @@
+import os
+
+CHECKPOINT_INTERVAL = 4096     # log records written before the log is compacted into a checkpoint
+WRITE_BUFFER = 1 << 16          # bytes buffered by the log file
+
+class SiteLog:
+    def __init__(self, directory: str, site_id: int, checkpoint_interval: int=CHECKPOINT_INTERVAL, sync: bool=False) -> None:
+        """[summary]
+        Write-ahead log of the versions committed on a site, with a checkpoint of the versions kept in memory.
+        site<id>.wal has one "timestamp variable_id value" line per version committed since the checkpoint,
+        site<id>.ckpt has one "variable_id timestamp value timestamp value ..." line per variable.
+        Recovering reads the checkpoint and the log written since, never the whole history
+
+        directory (str): where the files are kept, created if needed
+        checkpoint_interval (int): records appended to the log before the site asks for a checkpoint
+        sync (bool): fsync the log after every commit, otherwise the records are only handed to the OS
+        records (int): number of records in the log since the last checkpoint
+        buffer (list): lines of the commit being written
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.log_path = os.path.join(directory, "site{}.wal".format(site_id))
+        self.checkpoint_path = os.path.join(directory, "site{}.ckpt".format(site_id))
+        self.checkpoint_interval = checkpoint_interval
+        self.sync = sync
+        self.records = 0
+        self.buffer = []
+        if os.path.exists(self.log_path):
+            with open(self.log_path, 'rb') as f:
+                self.records = sum(1 for _ in f)
+        self.file = open(self.log_path, 'a', buffering=WRITE_BUFFER)
+
+    def append(self, timestamp: int, variable_id: str, val: int) -> None:
+        self.buffer.append("{} {} {}\n".format(timestamp, variable_id, val))
+
+    def flush(self) -> bool:
+        """[summary]
+        Write the records of the commit to the log in one sequential write
+
+        Returns:
+            bool: True if the log is long enough to be compacted by a checkpoint
+        """
+        if self.buffer:
+            self.file.write("".join(self.buffer))
+            self.records += len(self.buffer)
+            self.buffer = []
+            self.file.flush()
+            if self.sync:
+                os.fsync(self.file.fileno())
+        return self.records >= self.checkpoint_interval
+
+    def checkpoint(self, versions) -> None:
+        """[summary]
+        Replace the checkpoint and empty the log. The new checkpoint is written aside and renamed,
+        a crash leaves either the old checkpoint and its log or the new one
+
+        Args:
+            versions (iterable): (variable_id, [(timestamp, value)]) of every variable,
+                                 None if the caller already saved them, e.g. in a MappedTable
+        """
+        self.flush()
+        if versions is None:
+            if os.path.exists(self.checkpoint_path):
+                os.remove(self.checkpoint_path)
+            self.__truncate()
+            return
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, 'w', buffering=WRITE_BUFFER) as f:
+            for variable_id, items in versions:
+                f.write(variable_id + "".join(" {} {}".format(ts, val) for ts, val in items) + "\n")
+            f.flush()
+            if self.sync:
+                os.fsync(f.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+        self.__truncate()
+
+    def __truncate(self) -> None:
+        self.file.close()
+        self.file = open(self.log_path, 'w', buffering=WRITE_BUFFER)
+        self.records = 0
+
+    def read_checkpoint(self):
+        """
+        Generate (variable_id, timestamps, values) of every variable in the checkpoint
+        """
+        if not os.path.exists(self.checkpoint_path):
+            return
+        with open(self.checkpoint_path, buffering=WRITE_BUFFER) as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 3 or len(fields) % 2 == 0:
+                    continue
+                yield fields[0], [int(ts) for ts in fields[1::2]], [int(val) for val in fields[2::2]]
+
+    def read_log(self):
+        """
+        Generate (timestamp, variable_id, value) of the records written since the checkpoint.
+        A torn last record is skipped
+        """
+        self.flush()
+        with open(self.log_path, buffering=WRITE_BUFFER) as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) != 3 or not line.endswith("\n"):
+                    continue
+                yield int(fields[0]), fields[1], int(fields[2])
+
+    def close(self) -> None:
+        self.flush()
+        self.file.close()
@@ -0,0 +1,316 @@
+import multiprocessing
+from collections import deque
+from dataManager import DataManager, SITE_KEY
+from eventLog import LEVEL, EventSink
+from siteLog import SiteLog
+
+# fresh worker processes, nothing of the parent's state (buffered output, open files) is copied into them
+CONTEXT = multiprocessing.get_context('forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+PIPELINE_DEPTH = 128    # requests sent to the sites before their replies are read, keeps the pipes from filling up
+# requests through which a transaction may lock or write a variable -> position of its id in the arguments
+VISITS = {'read': 1, 'if_can_write': 0, 'local_write': 2, 'try_write': 0, 'read_range': 0, 'write_many': 0}
+
+class EffectSink(EventSink):
+    def __init__(self, effects: list) -> None:
+        """
+        Event log of a DataManager in a site process, the events are sent back to be written by the parent
+        """
+        super().__init__(LEVEL.DEBUG)
+        self.effects = effects
+
+    def write(self, level: LEVEL, name: str, fmt, fields: dict) -> None:
+        self.effects.append(('event', name, fields))
+
+class EffectDirectory:
+    def __init__(self, effects: list) -> None:
+        """
+        ReplicaDirectory of a DataManager in a site process, the status changes are sent back to the parent's directory
+        """
+        self.effects = effects
+
+    def add_site(self, site_id: int) -> None:
+        pass
+
+    def set_site_status(self, *args) -> None:
+        self.effects.append(('set_site_status', args))
+
+    def set_replica_status(self, *args) -> None:
+        self.effects.append(('set_replica_status', args))
+
+    def set_site_recovering(self, *args) -> None:
+        self.effects.append(('set_site_recovering', args))
+
+class EffectMetrics:
+    def __init__(self, effects: list) -> None:
+        """
+        Metrics of a DataManager in a site process, the samples are sent back to the parent's Metrics
+        """
+        self.effects = effects
+
+    def record_queue_length(self, length: int) -> None:
+        self.effects.append(('queue_length', length))
+
+class SiteServer:
+    def __init__(self, site: DataManager, effects: list) -> None:
+        """[summary]
+        Runs the requests of a SiteProcess on its DataManager.
+        The methods of the DataManager are called by name, the ones below are only used by the site processes
+        """
+        self.site = site
+        self.effects = effects
+
+    def try_write(self, transaction_id: str, variable_id: str, val: int) -> tuple:
+        """
+        if_can_write, then local_write if the lock is granted, in one request
+        """
+        if not self.site.if_can_write(transaction_id, variable_id):
+            return False, False
+        return True, self.site.local_write(variable_id, val, transaction_id)
+
+    def commit_group(self, group: list) -> list:
+        """
+        DataManager.commit_group, returns the transactions of the group that still hold locks on the site
+        """
+        self.site.commit_group(group)
+        return [transaction_id for transaction_id, _, _ in group if transaction_id in self.site.transaction_footprint]
+
+    def record_metrics(self, on: bool) -> None:
+        self.site.metrics = EffectMetrics(self.effects) if on else None
+
+def serve(conn, id: int, indexes, replicated, data_dir: str, mapped: bool, table_path: str, track_edges: bool,
+          track_queues: bool, cancel_queued_reads: bool) -> None:
+    """
+    Main loop of a site process: run the requests until None is received.
+    Every reply carries the result, the side effects, and the state the parent mirrors:
+    who can write the variables whose lock changed and, with track_edges and track_queues,
+    their waits-for edges and the length of their lock waiting queues
+    """
+    effects = []
+    lock_events = set()
+    wal = SiteLog(data_dir, id) if data_dir is not None else None
+    site = DataManager(id, lock_events, zip(indexes, map(bool, replicated)), EffectDirectory(effects),
+                       EffectSink(effects), wal=wal, mapped=mapped, table_path=table_path,
+                       cancel_queued_reads=cancel_queued_reads)
+    server = SiteServer(site, effects)
+    request = ('last_commit_time', ())     # the first reply tells the parent the site is ready
+    while request is not None:
+        method, args = request
+        try:
+            handler = getattr(server, method, None) or getattr(site, method)
+            reply = (True, handler(*args))
+        except Exception as e:
+            reply = (False, e)
+        writers = {var_id: site.writable_by(var_id) for _, var_id in lock_events}
+        edges = {var_id: site.waits_for_edges(var_id) for _, var_id in lock_events} if track_edges else None
+        queues = {var_id: site.queue_length(var_id) for _, var_id in lock_events} if track_queues else None
+        conn.send(reply + (effects, lock_events, writers, edges, queues, site.on_flag, bool(site.versioned),
+                           bool(site.retained), bool(site.pending_wakeups)))
+        effects.clear()
+        lock_events.clear()
+        request = conn.recv()
+    conn.close()
+
+class SiteProcess:
+    def __init__(self, id: int, lock_events: set, indexes, replicated, directory=None, log: EventSink=None,
+                 data_dir: str=None, mapped: bool=False, table_path: str=None, track_edges: bool=False,
+                 track_queues: bool=False, cancel_queued_reads: bool=False) -> None:
+        """[summary]
+        A DataManager running in its own process, with the interface the TransactionManager uses.
+        The calls are sent through a pipe; what the site reports to its lock events, directory, log and metrics
+        comes back with the reply and is applied here in the order it happened.
+        send() and receive() let the caller reach several sites before waiting for any of them
+
+        indexes (array): indexes of the variables stored on the site, by increasing index
+        replicated (bytearray): 1 for the replicated variables
+        data_dir (str): directory of the write-ahead log of the site, None to keep the data in memory
+        track_edges (bool): the site sends the waits-for edges of its changed locks with its replies,
+                            so the deadlock detection reads them without asking
+        track_queues (bool): the site sends the length of the lock waiting queues of its changed locks with its replies,
+                             so the read routing reads them without asking
+        cancel_queued_reads (bool): see DataManager
+        writers (dict): (variable_id, DataManager.writable_by) as of the last change of the lock,
+                        every change of a lock is reported so can_write is answered here
+        edges (dict): (variable_id, set of waits-for edges) as of the last change of the lock, with track_edges
+        queues (dict): (variable_id, length of the lock waiting queue) as of the last change of the lock, with track_queues
+        on_flag (bool): the site is working, as of the last reply
+        visitors (set): transactions that sent requests to the site since they last committed or aborted on it,
+                        a commit or an abort has nothing to do on the other sites.
+                        A commit that left locks on the site keeps the transaction in it
+        sent (deque): (method, arguments) of the requests whose reply wasn't received yet, oldest first
+        versioned (bool): the site has versions committed since the last garbage collection, as of the last reply
+        retained (bool): the site kept old versions at the last garbage collection, as of the last reply
+        pending_wakeups (bool): the site has lock waiting queues that any commit or abort updates, as of the last reply
+        """
+        self.id = id
+        self.lock_events = lock_events
+        self.directory = directory
+        self.log = log
+        self.mapped = mapped
+        self.wal = None
+        self.on_flag = True
+        self.versioned = False
+        self.retained = False
+        self.pending_wakeups = False
+        self.writers = {}
+        self.edges = {}
+        self.queues = {}
+        self.track_queues = track_queues
+        self.visitors = set()
+        self.sent = deque([('last_commit_time', ())])
+        self.__metrics = None
+        if directory is not None:
+            directory.add_site(id)
+        self.conn, child = CONTEXT.Pipe()
+        self.process = CONTEXT.Process(target=serve, args=(child, id, indexes, replicated, data_dir, mapped, table_path,
+                                                                 track_edges, track_queues, cancel_queued_reads),
+                                       name="site{}".format(id), daemon=True)
+        self.process.start()
+        child.close()
+        self.receive()
+
+    @property
+    def metrics(self):
+        return self.__metrics
+
+    @metrics.setter
+    def metrics(self, metrics) -> None:
+        self.__metrics = metrics
+        self.call('record_metrics', metrics is not None)
+
+    def send(self, method: str, *args) -> None:
+        position = VISITS.get(method)
+        if position is not None:
+            self.visitors.add(args[position])
+        self.sent.append((method, args))
+        self.conn.send((method, args))
+
+    def receive(self):
+        """
+        Wait for the reply of the oldest request sent, apply its side effects and return its result
+        """
+        method, args = self.sent.popleft()
+        (ok, result, effects, lock_events, writers, edges, queues,
+         self.on_flag, self.versioned, self.retained, self.pending_wakeups) = self.conn.recv()
+        self.lock_events |= lock_events
+        self.writers.update(writers)
+        if edges:
+            self.edges.update(edges)
+        if queues:
+            self.queues.update(queues)
+        for effect in effects:
+            kind = effect[0]
+            if kind == 'event':
+                self.log.event(effect[1], **effect[2])
+            elif kind == 'queue_length':
+                if self.__metrics is not None:
+                    self.__metrics.record_queue_length(effect[1])
+            elif self.directory is not None:
+                getattr(self.directory, kind)(*effect[1])
+        if not ok:
+            raise result
+        if method == 'abort' or method == 'commit' and result:
+            self.visitors.discard(args[0])
+        elif method == 'commit_group':
+            self.visitors.difference_update(transaction_id for transaction_id, _, _ in args[0]
+                                            if transaction_id not in result)
+        return result
+
+    def call(self, method: str, *args):
+        self.send(method, *args)
+        return self.receive()
+
+    def read(self, variable_id: str, tid: str):
+        return self.call('read', variable_id, tid)
+
+    def snapshot(self, timestamp: int, var_id: str):
+        return self.call('snapshot', timestamp, var_id)
+
+    def cancel_read(self, variable_id: str, tid: str) -> None:
+        return self.call('cancel_read', variable_id, tid)
+
+    def if_can_write(self, trans_id: str, var_id: str) -> bool:
+        return self.call('if_can_write', trans_id, var_id)
+
+    def can_write(self, trans_id: str, var_id: str) -> bool:
+        """
+        DataManager.can_write from the last reported state of the lock and of the site lock,
+        a variable never reported was never locked
+        """
+        writer = self.writers.get(SITE_KEY)
+        if writer is not None and writer != trans_id:
+            return False
+        writer = self.writers.get(var_id)
+        return writer is None or writer == trans_id
+
+    def local_write(self, variable_id: str, val: int, transaction_id: str) -> bool:
+        return self.call('local_write', variable_id, val, transaction_id)
+
+    def try_write(self, transaction_id: str, variable_id: str, val: int) -> tuple:
+        return self.call('try_write', transaction_id, variable_id, val)
+
+    def read_range(self, transaction_id: str, variable_ids: list) -> tuple:
+        return self.call('read_range', transaction_id, variable_ids)
+
+    def write_many(self, transaction_id: str, writes: list) -> bool:
+        return self.call('write_many', transaction_id, writes)
+
+    def commit(self, transaction_id: str, ts: int, writes: dict=None) -> None:
+        return self.call('commit', transaction_id, ts, writes)
+
+    def commit_group(self, group: list) -> list:
+        return self.call('commit_group', group)
+
+    def abort(self, transaction_id: str) -> bool:
+        return self.call('abort', transaction_id)
+
+    def waits_for_edges(self, var_id: str) -> set:
+        edges = self.edges.get(var_id)
+        if edges is None:
+            return self.call('waits_for_edges', var_id)
+        return edges
+
+    def queue_length(self, var_id: str) -> int:
+        if not self.track_queues:
+            return self.call('queue_length', var_id)
+        return self.queues.get(var_id, 0)
+
+    def blockers(self, var_id: str, tid: str) -> set:
+        return self.call('blockers', var_id, tid)
+
+    def replica_ready(self, var_id: str) -> bool:
+        return self.call('replica_ready', var_id)
+
+    def collect_versions(self, watermark: int, advanced: bool=True) -> tuple:
+        return self.call('collect_versions', watermark, advanced)
+
+    def fail(self) -> list:
+        return self.call('fail')
+
+    def recover(self) -> bool:
+        return self.call('recover')
+
+    def checkpoint(self) -> None:
+        return self.call('checkpoint')
+
+    def dump(self) -> None:
+        return self.call('dump')
+
+    def seed(self, values, given: bytearray=None) -> None:
+        return self.call('seed', values, given)
+
+    def export(self, variable_ids: list=None, history: bool=False) -> tuple:
+        return self.call('export', variable_ids, history)
+
+    def last_commit_time(self) -> int:
+        return self.call('last_commit_time')
+
+    def close(self) -> None:
+        """
+        Close the site and stop its process
+        """
+        if not self.process.is_alive():
+            return
+        self.call('close')
+        self.conn.send(None)
+        self.process.join()
+        self.conn.close()
@@ -1,213 +1,1026 @@
-from os import write
+import os
+from array import array
 from dataManager import *
 from collections import deque
-from iohandler import Parser
+from heapq import heappush, heappop
+from iohandler import Operation, COMMAND_TYPE, decode
+from replicaDirectory import ReplicaDirectory
+from eventLog import LEVEL, EventSink, TextSink
+from metrics import Metrics
+from siteLog import SiteLog
+from siteProcess import SiteProcess, PIPELINE_DEPTH
+from columnar import int64
 
 # Transaction status
 class TRAN_STATUS(Enum):
     ABORTED = 'ABORTED'
     COMMITTED = 'COMMITTED'
+    COMMITTING = 'COMMITTING'   # ended, waiting for its group commit
 
-# Command types
-class COMMAND_TYPE(Enum):
-    BEGIN = 'begin'
-    BEGINRO = 'beginRO'
-    READ = 'R'
-    WRITE = 'W'
-    END = 'end'
-    FAIL = 'fail'
-    RECOVER = 'recover'
-    DUMP = 'dump'
+# How deadlocks are handled
+class DEADLOCK_POLICY(Enum):
+    DETECTION = 'DETECTION'     # abort the youngest transaction of a cycle in the waits-for graph
+    WAIT_DIE = 'WAIT_DIE'       # a transaction waiting for an older one is aborted
+    WOUND_WAIT = 'WOUND_WAIT'   # a transaction aborts the younger ones it waits for
+
+# Which replica a read tries first, among the replicas it can read
+class READ_ROUTING(Enum):
+    FIRST = 'FIRST'                 # the lowest site id
+    ROUND_ROBIN = 'ROUND_ROBIN'     # the next replica in turn
+    LEAST_QUEUED = 'LEAST_QUEUED'   # the shortest lock waiting queue for the variable, in turn among the ties
+    STICKY = 'STICKY'               # the site the transaction first read from, in turn for its first read
 
 class Transaction:
     def __init__(self, id: str, timestamp: int, readOnly: bool) -> None:
+        """
+        reads (dict): (variable_id, (site_id, value)) the values read, a repeated read is answered from it.
+                      Emptied when a site fails or recovers, the replica to read from may have changed
+        writes (dict): (variable_id, (value, site ids)) the last value written and the replicas it locked,
+                       the reads of the variable are answered from it
+        unsent (dict): (variable_id, value) written again while holding the locks, installed by the commit
+        refused (dict): (variable_id, set of site ids) the replicas that refused a read not served yet,
+                        only kept with TransactionManager.cancel_queued_reads
+        """
         self.id = id
         self.status = TRAN_STATUS.COMMITTED
         self.timestamp = timestamp
         self.readOnly = readOnly
+        self.reads = {}
+        self.writes = {}
+        self.unsent = {}
+        self.refused = {}
+
+# Commands locking whole sites
+BULK_COMMANDS = (COMMAND_TYPE.READRANGE, COMMAND_TYPE.WRITEMANY)
 
 class Command:
-    def __init__(self, type: COMMAND_TYPE, transaction_id: str, variable_id: str, val: int=0):
+    def __init__(self, type: COMMAND_TYPE, transaction_id: str, variable_id: str, val: int=0, seq: int=0):
+        """
+        val (int): value written, the last variable of a range read (COMMAND_TYPE.READRANGE),
+                   the (variable_id, value) of a multi-write (COMMAND_TYPE.WRITEMANY)
+        seq (int): arrival order of the command in the command queue
+        waiting_locks (list): (site_id, variable_id) of the locks the blocked command is registered on
+        blocked_at (int): time the command first blocked, only set while collecting metrics
+        """
         self.type = type
         self.transaction_id = transaction_id
         self.variable_id = variable_id
         self.val = val
+        self.seq = seq
+        self.waiting_locks = None
+        self.blocked_at = None
 
 class TransactionManager:
-    def __init__(self) -> None:
+    def __init__(self, num_sites: int=10, num_variables: int=20, placement=default_placement, log: EventSink=None,
+                 metrics: Metrics=None, deadlock_policy: DEADLOCK_POLICY=DEADLOCK_POLICY.DETECTION,
+                 data_dir: str=None, storage: str='memory', processes: bool=False,
+                 read_routing: READ_ROUTING=READ_ROUTING.FIRST, cancel_queued_reads: bool=False) -> None:
         """"
+        cancel_queued_reads (bool): once a replica serves a read, the requests it left queued on the other replicas
+                                    are dropped, and a read lock granted from a queue is released when its transaction
+                                    ends. Off, they stay as they always did and the output of the command files
+                                    is unchanged
+        read_routing (READ_ROUTING): which replica a read tries first, the others are tried after it in turn.
+                                     A replica that isn't ready, e.g. recovering, is never read
+        processes (bool): run every site in its own process (see SiteProcess), the commits, aborts,
+                          replicated writes and garbage collections reach all the sites at once
+        storage (str): 'memory' keeps every variable on the heap, 'mmap' keeps the committed versions in a
+                       memory-mapped table per site (site<id>.dat in data_dir, anonymous without it)
+                       and only the variables in use on the heap
+        data_dir (str): directory of the write-ahead logs and checkpoints of the sites, None to keep the data in memory.
+                        The sites start from what a previous run left there
+        deadlock_policy (DEADLOCK_POLICY): detect the deadlocks, or prevent them by the start time of the transactions
+        log (EventSink): where the events are reported, defaults to the standard output at LEVEL.INFO
+        metrics (Metrics): timers and lock contention counters, None to disable them (see enable_metrics)
+        num_sites (int): number of sites
+        num_variables (int): number of variables, x1..x<num_variables>
+        placement (function): placement(variable_index, num_sites) returns the ids of the sites holding the variable
         sites (list): List of data manager
+        directory (ReplicaDirectory): the sites holding each variable, and the status of the sites and replicas
         transactions: (defaultdict(transaction_id:str, Transaction))
-        command_queue (deque): queue to store Read and Write transactions
+        command_queue (dict): (seq, Command), Read and Write commands in arrival order
+        command_seq (int): seq of the next queued command
+        lock_events (set): (site_id, variable_id) of the locks changed since they were last checked
+        lock_waiters (defaultdict(set)): (site_id, variable_id) -> seqs of the commands blocked on that lock
+        transaction_commands (defaultdict(set)): transaction_id -> seqs of its queued commands
+        woken_commands (set): seqs of the commands to retry in the next pass
+        waits_for (defaultdict(dict)): waits-for graph, waits_for[T1][T2] is the number of locks on which T1 waits for T2
+        lock_edges (dict): (site_id, variable_id) -> set of waits-for edges caused by that lock
+        changed_locks (set): (site_id, variable_id) whose waits-for edges need to be refreshed
+        deadlock_candidates (set): transactions to start the cycle detection from
+        read_only_transactions (dict): (transaction_id, start time) of the active read-only transactions, oldest first
+        gc_on_commit (bool): collect the old versions after every commit
+        gc_interval (int): also collect the old versions every gc_interval ticks, 0 to disable
+        gc_watermark (int): watermark of the last version garbage collection
+        gc_reclaimed_versions (int): number of versions reclaimed so far
+        gc_reclaimed_bytes (int): estimated number of bytes reclaimed so far
+        commit_window (int): commits ended within this many ticks are applied together, 0 to commit at once
+        read_cache (bool): a transaction answers the reads of the variables it wrote or already read, and keeps a value
+                           written again while it holds the locks until it commits. Off, every read and write
+                           reaches the sites, which take or check their locks again as before
+        lock_timeout (int): a command still queued lock_timeout ticks after it was sent aborts its transaction,
+                            0 to wait until the lock is granted
+        max_queue (int): a read or a write arriving while max_queue commands are queued is rejected, 0 for no limit.
+                         A rejected command is dropped and its transaction goes on, the client may send it again
+        max_transaction_commands (int): a read or a write of a transaction that already has this many queued commands
+                                        is rejected, 0 for no limit
+        queued_ticks (deque): (time, seq) of the commands queued while lock_timeout is set, oldest first
+        read_turn (int): turn of the next read routed in turn
+        read_sites (dict): (transaction_id, site_id) the site the transaction reads from first, with READ_ROUTING.STICKY
+        pending_commits (list): (transaction_id, commit time, values written again) of the transactions
+                                waiting for their group commit
         timestamp (int): current time
-        debug (bool): flag to print debugging logs
+        debug (bool): flag to print debugging logs, i.e. set the level of the log to LEVEL.DEBUG
         """
-        self.sites = [None] * 10
+        self.sites = [None] * num_sites
+        self.directory = ReplicaDirectory()
         self.transactions = defaultdict(Transaction)
-        self.command_queue = deque()
+        self.command_queue = {}
+        self.command_seq = 0
+        self.lock_events = set()
+        self.lock_waiters = defaultdict(set)
+        self.transaction_commands = defaultdict(set)
+        self.woken_commands = set()
+        self.waits_for = defaultdict(dict)
+        self.lock_edges = {}
+        self.changed_locks = set()
+        self.deadlock_candidates = set()
+        self.read_only_transactions = {}
+        self.gc_on_commit = True
+        self.gc_interval = 0
+        self.gc_watermark = -1
+        self.gc_reclaimed_versions = 0
+        self.gc_reclaimed_bytes = 0
+        self.commit_window = 0
+        self.read_cache = False
+        self.lock_timeout = 0
+        self.max_queue = 0
+        self.max_transaction_commands = 0
+        self.queued_ticks = deque()
+        self.pending_commits = []
         self.timestamp = 0
-        self.debug = False
+        self.log = log if log is not None else TextSink(LEVEL.INFO)
+        self.metrics = None
+        self.deadlock_policy = deadlock_policy
+        self.read_routing = read_routing
+        self.cancel_queued_reads = cancel_queued_reads
+        self.read_turn = 0
+        self.read_sites = {}
 
-        # Initialize the data managers
-        for i in range(10):
-            self.sites[i] = DataManager(i+1)
+        # Dispatch table of operate()
+        self.__handlers = {
+            COMMAND_TYPE.BEGIN: self.__operate_begin,
+            COMMAND_TYPE.BEGINRO: self.__operate_beginRO,
+            COMMAND_TYPE.READ: self.__operate_read,
+            COMMAND_TYPE.WRITE: self.__operate_write,
+            COMMAND_TYPE.READRANGE: self.__operate_read_range,
+            COMMAND_TYPE.WRITEMANY: self.__operate_write_many,
+            COMMAND_TYPE.END: self.__operate_end,
+            COMMAND_TYPE.FAIL: self.__operate_fail,
+            COMMAND_TYPE.RECOVER: self.__operate_recover,
+            COMMAND_TYPE.DUMP: self.__operate_dump,
+        }
+
+        # Compute the replica placement, then initialize the data managers
+        mapped = storage == 'mmap'
+        self.num_variables = num_variables
+        self.placement = placement
+        site_indexes = [array('q') for _ in range(num_sites)]
+        site_replicated = [bytearray() for _ in range(num_sites)]
+        holders_of = []
+        for i in range(1, num_variables + 1):
+            holders = tuple(sorted(placement(i, num_sites)))
+            if not mapped:
+                holders_of.append(holders)
+            for site_id in holders:
+                site_indexes[site_id - 1].append(i)
+                site_replicated[site_id - 1].append(len(holders) > 1)
+        self.processes = processes
+        for i in range(num_sites):
+            table_path = os.path.join(data_dir, "site{}.dat".format(i+1)) if mapped and data_dir is not None else None
+            if processes:
+                self.sites[i] = SiteProcess(i+1, self.lock_events, site_indexes[i], site_replicated[i], self.directory,
+                                            self.log, data_dir=data_dir, mapped=mapped, table_path=table_path,
+                                            track_edges=deadlock_policy == DEADLOCK_POLICY.DETECTION,
+                                            track_queues=read_routing == READ_ROUTING.LEAST_QUEUED,
+                                            cancel_queued_reads=cancel_queued_reads)
+            else:
+                wal = SiteLog(data_dir, i+1) if data_dir is not None else None
+                variables = zip(site_indexes[i], map(bool, site_replicated[i]))
+                self.sites[i] = DataManager(i+1, self.lock_events, variables, self.directory, self.log, wal=wal,
+                                            mapped=mapped, table_path=table_path,
+                                            cancel_queued_reads=cancel_queued_reads)
+            site_indexes[i] = site_replicated[i] = None
+        if data_dir is not None:
+            # the clock goes on after the last version a previous run committed
+            last = max(self.__gather([(site, 'last_commit_time', ()) for site in self.sites]), default=0)
+            if last > 0:
+                self.timestamp = last + 1
 
-    def __udpate_command_queue(self) -> None:
+        # Variables with the same holders share one list of sites,
+        # the mapped sites don't list every variable in the directory
+        self.__site_lists = {}
+        for i, holders in enumerate(holders_of, 1):
+            self.directory.add_variable("x" + str(i), self.__sites_of_holders(holders))
+        if mapped:
+            self.directory.resolve = self.__replica_sites
+
+        if metrics is not None:
+            self.enable_metrics(metrics)
+
+    def __sites_of_holders(self, holders: tuple) -> list:
+        sites = self.__site_lists.get(holders)
+        if sites is None:
+            sites = self.__site_lists[holders] = [self.sites[site_id - 1] for site_id in holders]
+        return sites
+
+    def __replica_sites(self, variable_id: str) -> list:
+        """
+        Sites holding a variable computed from the placement
         """
-        Iterate the command queue, execute those commands that can run
+        index = variable_id[1:]
+        if not variable_id.startswith('x') or not index.isdigit() or index != str(int(index)):
+            return ()
+        if not 1 <= int(index) <= self.num_variables:
+            return ()
+        return self.__sites_of_holders(tuple(sorted(self.placement(int(index), len(self.sites)))))
+
+    def enable_metrics(self, metrics: Metrics=None) -> Metrics:
+        """[summary]
+        Start collecting metrics on this transaction manager and its sites.
+        The timed phases are wrapped on this instance only, so without metrics the plain methods run
+        and the counters cost one `is None` check
+
+        Args:
+            metrics (Metrics): where to collect them, a new one by default
+
+        Returns:
+            Metrics: the metrics being collected
         """
-        for cmd in list(self.command_queue):
-            cmd : Command
+        if self.metrics is not None:
+            return self.metrics
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.__udpate_command_queue = self.metrics.timed('command_queue', self.__udpate_command_queue)
+        self.__deadlock_detection = self.metrics.timed('deadlock_detection', self.__deadlock_detection)
+        self.read = self.metrics.timed('read', self.read)
+        self.write = self.metrics.timed('write', self.write)
+        self.collect_garbage = self.metrics.timed('garbage_collection', self.collect_garbage)
+        self.metrics.reads_by_site.update({site.id: 0 for site in self.sites})
+        for site in self.sites:
+            site : DataManager
+            site.metrics = self.metrics
+            site.commit = self.metrics.timed('site_commit', site.commit)
+            site.commit_group = self.metrics.timed('site_commit', site.commit_group)
+        if self.processes:
+            # the calls reaching several site processes at once are timed together
+            self.__gather = self.metrics.timed('site_calls', self.__gather)
+        return self.metrics
+
+    @property
+    def debug(self) -> bool:
+        return self.log.enabled(LEVEL.DEBUG)
+
+    @debug.setter
+    def debug(self, on: bool) -> None:
+        self.log.level = LEVEL.DEBUG if on else LEVEL.INFO
+
+    def __gather(self, calls: list) -> list:
+        """[summary]
+        Run (site, method, args) calls and return their results in order.
+        Site processes get their requests before any reply is read, so they run them in parallel
+
+        Returns:
+            list: the result of every call
+        """
+        if not self.processes:
+            return [getattr(site, method)(*args) for site, method, args in calls]
+        results = []
+        for start in range(0, len(calls), PIPELINE_DEPTH):
+            batch = calls[start:start + PIPELINE_DEPTH]
+            for site, method, args in batch:
+                site.send(method, *args)
+            results.extend(site.receive() for site, _, _ in batch)
+        return results
+
+    def __visited_sites(self, transaction_ids) -> list:
+        """
+        Sites a commit or an abort of the transactions has to reach. Every site in process,
+        only the site processes the transactions sent requests to or with lock waiting queues to update,
+        the others have nothing to do
+        """
+        if not self.processes:
+            return self.sites
+        return [site for site in self.sites
+                if site.pending_wakeups or any(tid in site.visitors for tid in transaction_ids)]
+
+    def __enqueue_command(self, type: COMMAND_TYPE, transaction_id: str, variable_id: str, val: int=0) -> None:
+        """
+        Append a Read or Write command to the command queue, it is tried in the next pass
+        """
+        cmd = Command(type, transaction_id, variable_id, val, self.command_seq)
+        self.command_seq += 1
+        self.command_queue[cmd.seq] = cmd
+        self.transaction_commands[transaction_id].add(cmd.seq)
+        self.woken_commands.add(cmd.seq)
+        if self.lock_timeout:
+            self.queued_ticks.append((self.timestamp, cmd.seq))
+
+    def __admit(self, op: Operation) -> bool:
+        """
+        Whether a read or a write fits in the command queue, a rejected one is reported and dropped
+        """
+        if self.max_queue and len(self.command_queue) >= self.max_queue:
+            reason = "the command queue is full"
+        elif (self.max_transaction_commands and
+              len(self.transaction_commands.get(op.transaction_id, ())) >= self.max_transaction_commands):
+            reason = "the transaction has {} queued commands".format(self.max_transaction_commands)
+        else:
+            return True
+        self.log.event('reject', transaction=op.transaction_id, command=op.type.value, variable=op.variable_id,
+                       reason=reason)
+        if self.metrics is not None:
+            self.metrics.rejected_commands += 1
+        return False
+
+    def __dequeue_command(self, cmd: Command) -> None:
+        """
+        Remove a command from the command queue and from the locks it is waiting for
+        """
+        self.command_queue.pop(cmd.seq, None)
+        seqs = self.transaction_commands.get(cmd.transaction_id)
+        if seqs is not None:
+            seqs.discard(cmd.seq)
+            if not seqs:
+                del self.transaction_commands[cmd.transaction_id]
+        if cmd.waiting_locks:
+            for key in cmd.waiting_locks:
+                waiters = self.lock_waiters[key]
+                waiters.discard(cmd.seq)
+                if not waiters:
+                    del self.lock_waiters[key]
+        cmd.waiting_locks = None
+
+    def __drop_commands(self, transaction_id: str) -> None:
+        """
+        Remove all the queued commands of a finished transaction
+        """
+        for seq in list(self.transaction_commands.get(transaction_id, ())):
+            self.__dequeue_command(self.command_queue[seq])
+
+    def __wait_for_locks(self, cmd: Command) -> None:
+        """
+        Register a blocked command on the locks of every site holding its variable,
+        so it's retried only when one of them changes
+        """
+        if cmd.waiting_locks is not None:
+            return
+        if cmd.type in BULK_COMMANDS:
+            # a range read or a multi-write waits on the site locks, and for the replicas it reads to be ready
+            cmd.waiting_locks = [(site.id, SITE_KEY) for site in self.sites]
+        else:
+            cmd.waiting_locks = [(site.id, cmd.variable_id) for site in self.directory.sites_of(cmd.variable_id)]
+        for key in cmd.waiting_locks:
+            self.lock_waiters[key].add(cmd.seq)
+        if self.metrics is not None:
+            cmd.blocked_at = self.timestamp
+            self.metrics.record_block(cmd.variable_id)
+
+    def __wake_up_commands(self, ready: list, scheduled: set, last_seq: int) -> None:
+        """
+        Schedule the commands waiting on the changed locks.
+        Commands behind last_seq in the queue were already tried in this pass and are retried in the next one
+        """
+        for key in self.lock_events:
+            for seq in self.lock_waiters.get(key, ()):
+                if seq <= last_seq:
+                    self.woken_commands.add(seq)
+                elif seq not in scheduled:
+                    scheduled.add(seq)
+                    heappush(ready, seq)
+        self.changed_locks |= self.lock_events
+        self.lock_events.clear()
+
+    def __udpate_command_queue(self) -> bool:
+        """
+        Execute the commands that can run, in arrival order.
+        Only the new commands and those waiting on a changed lock are tried
+
+        Returns:
+            bool: True if a transaction was aborted to prevent a deadlock
+        """
+        ready = sorted(self.woken_commands)
+        scheduled = set(ready)
+        self.woken_commands = set()
+        self.__wake_up_commands(ready, scheduled, -1)
+        prevent = self.deadlock_policy != DEADLOCK_POLICY.DETECTION
+        aborted = False
+
+        while ready:
+            seq = heappop(ready)
+            cmd : Command = self.command_queue.get(seq)
+            if cmd is None:
+                continue
             if cmd.transaction_id not in self.transactions:
-                self.command_queue.remove(cmd)
-                return
+                self.__dequeue_command(cmd)
+                continue
 
             flag = False
             if cmd.type == COMMAND_TYPE.READ:
                 flag = self.read(cmd.transaction_id, cmd.variable_id)
             elif cmd.type == COMMAND_TYPE.WRITE:
                 flag = self.write(cmd.transaction_id, cmd.variable_id, cmd.val)
+            elif cmd.type == COMMAND_TYPE.READRANGE:
+                flag = self.read_range(cmd.transaction_id, cmd.variable_id, cmd.val)
+            elif cmd.type == COMMAND_TYPE.WRITEMANY:
+                flag = self.write_many(cmd.transaction_id, cmd.val)
             if flag:
+                if cmd.blocked_at is not None and self.metrics is not None:
+                    self.metrics.record_wait(cmd.variable_id, self.timestamp - cmd.blocked_at)
                 # remove executed commands
-                self.command_queue.remove(cmd)
-        return
+                self.__dequeue_command(cmd)
+            elif prevent and self.__prevent_deadlock(cmd):
+                aborted = True
+                if cmd.transaction_id in self.transactions:
+                    self.__wait_for_locks(cmd)
+            else:
+                self.__wait_for_locks(cmd)
+            self.__wake_up_commands(ready, scheduled, seq)
+        return aborted
 
-    def operate(self, args: list) -> None:
+    def operate(self, op) -> None:
         """
         Called by the main function to run a command
+
+        op (Operation): a decoded command, a list of tokens is decoded first
         """
-        if len(args) == 0: # check an empty line
+        if type(op) is list:
+            op = decode(op)
+        if op is None: # check an empty line or an invalid input
             return
 
-        cmd = args.pop(0) # get the command
-
-        if cmd == COMMAND_TYPE.BEGIN.value:
-            self.begin(args[0]) # transaction_id
-        elif cmd == COMMAND_TYPE.BEGINRO.value:
-            self.beginRO(args[0]) # transaction_id
-        elif cmd == COMMAND_TYPE.READ.value:
-            # add the read command to the command queue
-            self.command_queue.append(Command(COMMAND_TYPE.READ, args[0], args[1])) # (R, transaction_id, variable_id)
-        elif cmd == COMMAND_TYPE.WRITE.value:
-            # add the write command to the command queue
-            self.command_queue.append(Command(COMMAND_TYPE.WRITE, args[0], args[1], args[2])) # (W, transaction_id, variable_id, value)
-        elif cmd == COMMAND_TYPE.END.value:
-            self.end(args[0])
-        elif cmd == COMMAND_TYPE.FAIL.value:
-            self.fail(int(args[0])-1) # Because we store indexes in self.sites
-        elif cmd == COMMAND_TYPE.RECOVER.value:
-            self.recover(int(args[0])-1)
-        elif cmd == COMMAND_TYPE.DUMP.value:
-            self.dump()
-        else:
-            # Simply ignore invalid inputs
-            return
+        self.log.tick = self.timestamp
+        if self.pending_commits and self.__observes_commits(op):
+            # the commands the commits unblock run first, as they would have after a plain commit
+            self.flush_commits()
+            self.__run_commands()
+        self.__handlers[op.type](op)
+        if self.pending_commits and self.timestamp - self.pending_commits[0][1] + 1 >= self.commit_window:
+            self.flush_commits()
             
         self.timestamp += 1
-        
-        self.__udpate_command_queue()
-        if self.__deadlock_detection():
+        if self.gc_interval and self.timestamp % self.gc_interval == 0:
+            self.collect_garbage()
+        self.__run_commands()
+
+    def __run_commands(self) -> None:
+        """
+        Run the queued commands that can run, and resolve the deadlocks
+        """
+        if self.deadlock_policy == DEADLOCK_POLICY.DETECTION:
+            self.__udpate_command_queue()
+            if self.__deadlock_detection():
+                self.__udpate_command_queue()
+        else:
+            if self.__udpate_command_queue():
+                # the locks released by the aborts are handed over right away, as after a deadlock detection
+                self.__udpate_command_queue()
+            self.changed_locks.clear()   # only the detection keeps a waits-for graph
+        if self.lock_timeout and self.queued_ticks and self.__expire_commands():
+            # the locks released by the aborts are handed over right away
+            self.__run_commands()
+
+    def settle(self) -> None:
+        """
+        Resolve the deadlocks still left after the last command: a pass aborts one transaction per detection,
+        the next command finds the other cycles. A client waiting for its commands, e.g. AsyncFrontend,
+        may send no next command
+        """
+        while self.deadlock_candidates and self.__deadlock_detection():
             self.__udpate_command_queue()
 
+    def __expire_commands(self) -> bool:
+        """[summary]
+        Abort the transactions of the commands still queued lock_timeout ticks after they were sent
+
+        Returns:
+            bool: True if a transaction was aborted
+        """
+        queued = self.queued_ticks
+        expired = self.timestamp - self.lock_timeout
+        aborted = False
+        while queued and queued[0][0] < expired:
+            tick, seq = queued.popleft()
+            cmd : Command = self.command_queue.get(seq)
+            if cmd is None or cmd.transaction_id not in self.transactions:
+                continue
+            self.log.event('timeout', transaction=cmd.transaction_id, command=cmd.type.value,
+                           variable=cmd.variable_id, ticks=self.timestamp - 1 - tick)
+            self.deadlock_candidates.discard(cmd.transaction_id)
+            if self.metrics is not None:
+                self.metrics.timeout_aborts += 1
+            self.__abort(cmd.transaction_id)
+            aborted = True
+        return aborted
+
+    def close(self) -> None:
+        """
+        Write out and close the write-ahead logs and the mapped tables of the sites
+        """
+        for site in self.sites:
+            site : DataManager
+            site.close()
+
+    def drain(self) -> None:
+        """
+        Called at the end of the input, apply the pending commits and run the commands they unblock
+        """
+        if self.pending_commits:
+            self.flush_commits()
+            self.__run_commands()
+
+    def __observes_commits(self, op: Operation) -> bool:
+        """
+        The pending commits are applied before an operation that could see them,
+        so delaying them never changes what is read: a snapshot, a dump, a site failing or recovering,
+        or a new transaction reusing the id of a pending one.
+        So is a command the locks of a pending commit could block, a plain commit would have released them
+        and the commands would run in the same order
+        """
+        if op.type == COMMAND_TYPE.BEGIN:
+            ts : Transaction = self.transactions.get(op.transaction_id)
+            return ts is not None and ts.status == TRAN_STATUS.COMMITTING
+        if op.type == COMMAND_TYPE.READ or op.type == COMMAND_TYPE.WRITE:
+            for transaction_id, _, _ in self.pending_commits:
+                if op.variable_id in self.transactions[transaction_id].writes:
+                    return True
+            # the read locks aren't kept by the transactions, the replicas tell who may write
+            return op.type == COMMAND_TYPE.WRITE and not all(site.can_write(op.transaction_id, op.variable_id)
+                                                             for site in self.directory.live_replicas(op.variable_id))
+        return op.type in (COMMAND_TYPE.BEGINRO, COMMAND_TYPE.FAIL, COMMAND_TYPE.RECOVER, COMMAND_TYPE.DUMP) or \
+               op.type in BULK_COMMANDS
+
+    def __operate_begin(self, op: Operation) -> None:
+        self.begin(op.transaction_id)
+
+    def __operate_beginRO(self, op: Operation) -> None:
+        self.beginRO(op.transaction_id)
+
+    def __operate_read(self, op: Operation) -> None:
+        # add the read command to the command queue
+        if self.__admit(op):
+            self.__enqueue_command(COMMAND_TYPE.READ, op.transaction_id, op.variable_id)
+
+    def __operate_write(self, op: Operation) -> None:
+        # add the write command to the command queue
+        if self.__admit(op):
+            self.__enqueue_command(COMMAND_TYPE.WRITE, op.transaction_id, op.variable_id, op.value)
+
+    def __operate_read_range(self, op: Operation) -> None:
+        if self.__admit(op):
+            self.__enqueue_command(COMMAND_TYPE.READRANGE, op.transaction_id, op.variable_id, op.last_variable_id)
+
+    def __operate_write_many(self, op: Operation) -> None:
+        if self.__admit(op):
+            self.__enqueue_command(COMMAND_TYPE.WRITEMANY, op.transaction_id, op.variable_id, op.writes)
+
+    def __operate_end(self, op: Operation) -> None:
+        self.end(op.transaction_id)
+
+    def __operate_fail(self, op: Operation) -> None:
+        self.fail(op.site_id - 1) # Because we store indexes in self.sites
+
+    def __operate_recover(self, op: Operation) -> None:
+        self.recover(op.site_id - 1)
+
+    def __operate_dump(self, op: Operation) -> None:
+        self.dump()
+
     def begin(self, transaction_id: str) -> None:
         """
         Begin a transaction
         """
         self.transactions[transaction_id] = Transaction(transaction_id, self.timestamp, readOnly=False)
-        if self.debug: print("{:7} --- Transaction: {} begins".format("Begin", transaction_id))
+        if self.log.level <= LEVEL.DEBUG: self.log.event('begin', transaction=transaction_id)
     
     def beginRO(self, transaction_id: str) -> None:
         """
         Begin a read-only transaction
         """
         self.transactions[transaction_id] = Transaction(transaction_id, self.timestamp, readOnly=True)
-        if self.debug: print("{:7} --- Read-Only Transaction: {} begins".format("BeginRO", transaction_id))
+        # an id still active moves to the end, the oldest snapshot stays first
+        self.read_only_transactions.pop(transaction_id, None)
+        self.read_only_transactions[transaction_id] = self.timestamp
+        if self.log.level <= LEVEL.DEBUG: self.log.event('begin_ro', transaction=transaction_id)
 
     def read(self, transaction_id: str, variable_id: str) -> bool:
         """
         Read the transaction from any working sites
         """
-        # Iterate all the sites and read from the sites
-        for site in self.sites:
-            site : DataManager
-            if site.on_flag == False:
-                continue
-            
-            # read only transaction, read by snapshot
-            ts : Transaction = self.transactions[transaction_id]
-            if ts.readOnly == True:
+        ts : Transaction = self.transactions[transaction_id]
+        if self.read_cache and ts.status != TRAN_STATUS.ABORTED and self.__read_cached(ts, variable_id):
+            return True
+
+        # read only transaction, read by snapshot from a working replica
+        if ts.readOnly == True:
+            sites = self.directory.live_replicas(variable_id)
+            if self.read_routing != READ_ROUTING.FIRST:
+                # the ready replicas in routing order, then the others in site order
+                readable = self.__route_read(transaction_id, variable_id, list(self.directory.readable_replicas(variable_id)))
+                sites = readable + [site for site in sites if site not in readable]
+            for site in sites:
+                site : DataManager
                 ret, val = site.snapshot(ts.timestamp, variable_id)
                 if ret == True:
-                    if self.debug: print("{:7} --- Read-only transaction: {},  read from site {} -- {}: {}".format("Read", transaction_id, site.id, variable_id, val))
+                    ts.reads[variable_id] = (site.id, val)
+                    if self.metrics is not None:
+                        self.metrics.record_read(site.id)
+                    if self.log.level <= LEVEL.DEBUG: self.log.event('read_ro', transaction=transaction_id, site=site.id, variable=variable_id, value=val)
                     return True
+            return False
 
-            # Normal transactions
-            else:
-                ret, val = site.read(variable_id, transaction_id)
-                if ret == True:
-                    if self.debug: print("{:7} --- Transaction: {}, read from site {} -- {}: {}".format("Read", transaction_id, site.id, variable_id, val))
-                    return True
+        # Normal transactions, read from a ready replica
+        sites = self.directory.readable_replicas(variable_id)
+        if self.read_routing != READ_ROUTING.FIRST:
+            sites = self.__route_read(transaction_id, variable_id, list(sites))
+        for site in sites:
+            site : DataManager
+            ret, val = site.read(variable_id, transaction_id)
+            if ret == True:
+                ts.reads[variable_id] = (site.id, val)
+                if self.metrics is not None:
+                    self.metrics.record_read(site.id)
+                if self.cancel_queued_reads and ts.refused:
+                    self.__cancel_refused_reads(ts, variable_id, site.id)
+                if self.log.level <= LEVEL.DEBUG: self.log.event('read', transaction=transaction_id, site=site.id, variable=variable_id, value=val)
+                return True
+            if self.cancel_queued_reads:
+                ts.refused.setdefault(variable_id, set()).add(site.id)
         return False
 
+    def __cancel_refused_reads(self, ts: Transaction, variable_id: str, site_id: int) -> None:
+        """
+        Drop the read lock requests a read left queued on the replicas that refused it,
+        they would be granted later and block the writers until the transaction ends
+        """
+        refused = ts.refused.pop(variable_id, None)
+        if refused:
+            refused.discard(site_id)
+            self.__gather([(self.sites[i - 1], 'cancel_read', (variable_id, ts.id)) for i in sorted(refused)])
+
+    def __read_cached(self, ts: Transaction, variable_id: str) -> bool:
+        """
+        Answer a read from what the transaction wrote or already read, without reaching the sites.
+        Its locks keep the value from changing until it ends
+        """
+        written = ts.writes.get(variable_id)
+        if written is not None:
+            val, site_ids = written
+            site_id = site_ids[0]
+        elif variable_id in ts.reads:
+            site_id, val = ts.reads[variable_id]
+        else:
+            return False
+        if self.metrics is not None:
+            self.metrics.cached_reads += 1
+        if self.log.level <= LEVEL.DEBUG:
+            self.log.event('read_ro' if ts.readOnly else 'read', transaction=ts.id, site=site_id, variable=variable_id, value=val)
+        return True
+
+    def __route_read(self, transaction_id: str, variable_id: str, sites: list) -> list:
+        """[summary]
+        Order in which a read tries the replicas of a variable, by the read routing policy
+
+        Args:
+            sites (list): the replicas that can be read, in site order
+
+        Returns:
+            list: the same replicas, the one to read from first
+        """
+        if len(sites) < 2:
+            return sites
+        start = self.read_turn % len(sites)
+        self.read_turn += 1
+        sites = sites[start:] + sites[:start]
+        if self.read_routing == READ_ROUTING.LEAST_QUEUED:
+            sites.sort(key=lambda site: site.queue_length(variable_id))
+        elif self.read_routing == READ_ROUTING.STICKY:
+            site_id = self.read_sites.setdefault(transaction_id, sites[0].id)
+            for i, site in enumerate(sites):
+                if site.id == site_id:
+                    sites.insert(0, sites.pop(i))
+                    break
+        return sites
+
     def write(self, transaction_id: str, variable_id: str, val: int) -> bool:
         """
         Write the transaction to all working sites
         """
+        ts : Transaction = self.transactions[transaction_id]
+        if self.read_cache and ts.status != TRAN_STATUS.ABORTED and self.__write_buffered(ts, variable_id, val):
+            return True
+        if self.processes:
+            return self.__write_replicas(ts, variable_id, val)
         write_sites = []
-        all_can_write = True
-        for site in self.sites:
+        for site in self.directory.live_replicas(variable_id):
             site : DataManager
-            if site.on_flag == True:
-                if site.if_can_write(transaction_id, variable_id) == True:
-                    ret = site.local_write(variable_id, val, transaction_id)
-                    if ret: write_sites.append(site.id)
-                else:
-                    return False
+            if site.if_can_write(transaction_id, variable_id) == True:
+                ret = site.local_write(variable_id, val, transaction_id)
+                if ret: write_sites.append(site.id)
+            else:
+                return False
 
-        if self.debug: print("{:7} --- Transaction: {}, writes {}: {} in sites: {}".format("Write", transaction_id, variable_id, val, write_sites))
+        self.__written(ts, variable_id, val, write_sites)
+        if self.log.level <= LEVEL.DEBUG: self.log.event('write', transaction=transaction_id, variable=variable_id, value=val, sites=write_sites)
         return True    
 
+    def __write_buffered(self, ts: Transaction, variable_id: str, val: int) -> bool:
+        """
+        A transaction writing a variable again while it holds the write locks of all its working replicas
+        keeps the value until it commits, the sites aren't reached
+        """
+        written = ts.writes.get(variable_id)
+        if written is None:
+            return False
+        site_ids = written[1]
+        if [site.id for site in self.directory.live_replicas(variable_id)] != site_ids:
+            # a site failed or recovered since, the write locks the replicas working now
+            return False
+        ts.writes[variable_id] = (val, site_ids)
+        ts.unsent[variable_id] = val
+        if self.metrics is not None:
+            self.metrics.buffered_writes += 1
+        if self.log.level <= LEVEL.DEBUG: self.log.event('write', transaction=ts.id, variable=variable_id, value=val, sites=site_ids)
+        return True
+
+    def __written(self, ts: Transaction, variable_id: str, val: int, site_ids: list) -> None:
+        """
+        Record a value written to the replicas, its later reads and writes are answered by the transaction
+        """
+        ts.unsent.pop(variable_id, None)
+        if site_ids:
+            ts.writes[variable_id] = (val, site_ids)
+
+    def __write_replicas(self, ts: Transaction, variable_id: str, val: int) -> bool:
+        """
+        write() on site processes. Whether each replica would grant the lock is known from its last replies,
+        the write goes at once to the replicas the sequential loop would reach: all of them, or up to the first one refusing
+        """
+        transaction_id = ts.id
+        sites = list(self.directory.live_replicas(variable_id))
+        if len(sites) > 1:
+            grants = [site.can_write(transaction_id, variable_id) for site in sites]
+            if False in grants:
+                sites = sites[:grants.index(False) + 1]
+        results = self.__gather([(site, 'try_write', (transaction_id, variable_id, val)) for site in sites])
+
+        write_sites = []
+        for site, (granted, written) in zip(sites, results):
+            if not granted:
+                return False
+            if written: write_sites.append(site.id)
+        self.__written(ts, variable_id, val, write_sites)
+        if self.log.level <= LEVEL.DEBUG: self.log.event('write', transaction=transaction_id, variable=variable_id, value=val, sites=write_sites)
+        return True
+
+    def __variable_range(self, first_id: str, last_id: str) -> list:
+        """
+        Ids of the variables from first_id to last_id by index, x3..x5 is x3, x4, x5. Only the existing ones are given
+        """
+        first, last = first_id[1:], last_id[1:]
+        if not (first_id.startswith('x') and last_id.startswith('x') and first.isdigit() and last.isdigit()):
+            return []
+        return ["x" + str(i) for i in range(max(int(first), 1), min(int(last), self.num_variables) + 1)]
+
+    def read_range(self, transaction_id: str, first_id: str, last_id: str) -> bool:
+        """[summary]
+        Read the variables from first_id to last_id. A transaction takes one shared lock (S) on every site it reads from,
+        instead of a lock per variable: each variable is read from a ready replica on a site already read from,
+        otherwise from its first ready replica. A read-only transaction reads them from its snapshot
+
+        Returns:
+            bool: True if every variable was read, False if the command has to wait
+        """
+        ts : Transaction = self.transactions[transaction_id]
+        variable_ids = self.__variable_range(first_id, last_id)
+        if ts.readOnly:
+            # a snapshot can be read from any working replica, the range waits until each variable has one
+            for variable_id in variable_ids:
+                if next(iter(self.directory.live_replicas(variable_id)), None) is None:
+                    return False
+            return all(self.read(transaction_id, variable_id) for variable_id in variable_ids)
+
+        site_reads = {}     # site -> ids of the variables read from it
+        for variable_id in variable_ids:
+            sites = list(self.directory.readable_replicas(variable_id))
+            if not sites:
+                return False
+            site = next((site for site in sites if site in site_reads), sites[0])
+            site_reads.setdefault(site, []).append(variable_id)
+        values = {}
+        for site in sorted(site_reads, key=lambda site: site.id):
+            site : DataManager
+            granted, read = site.read_range(transaction_id, site_reads[site])
+            if not granted:
+                return False
+            for variable_id, val in zip(site_reads[site], read):
+                values[variable_id] = (site.id, val)
+
+        for variable_id in variable_ids:
+            written = ts.writes.get(variable_id) if self.read_cache else None
+            if written is None:
+                site_id, val = ts.reads[variable_id] = values[variable_id]
+            else:
+                site_id, val = written[1][0], written[0]
+            if self.metrics is not None:
+                self.metrics.record_read(site_id)
+            if self.log.level <= LEVEL.DEBUG: self.log.event('read', transaction=transaction_id, site=site_id, variable=variable_id, value=val)
+        return True
+
+    def write_many(self, transaction_id: str, writes: tuple) -> bool:
+        """[summary]
+        Write several variables on their working replicas. The transaction takes one exclusive lock (X)
+        on every site holding one of them, instead of a lock per variable
+
+        Args:
+            writes (tuple): (variable_id, value) in the order they are written
+
+        Returns:
+            bool: True if every variable was written, False if the command has to wait
+        """
+        ts : Transaction = self.transactions[transaction_id]
+        site_writes = {}    # site -> (variable_id, value) written on it
+        variable_sites = []  # (variable_id, value, ids of the sites written)
+        for variable_id, val in writes:
+            write_sites = []
+            for site in self.directory.live_replicas(variable_id):
+                site_writes.setdefault(site, []).append((variable_id, val))
+                write_sites.append(site.id)
+            variable_sites.append((variable_id, val, write_sites))
+        for site in sorted(site_writes, key=lambda site: site.id):
+            site : DataManager
+            if not site.write_many(transaction_id, site_writes[site]):
+                return False
+
+        for variable_id, val, write_sites in variable_sites:
+            self.__written(ts, variable_id, val, write_sites)
+            if self.log.level <= LEVEL.DEBUG: self.log.event('write', transaction=transaction_id, variable=variable_id, value=val, sites=write_sites)
+        return True
+
+    def gc_low_watermark(self) -> int:
+        """
+        Start time of the oldest active read-only transaction, or the current time if there is none.
+        No snapshot will read a version older than the latest one committed at or before it
+        """
+        for start in self.read_only_transactions.values():
+            return start
+        return self.timestamp
+
+    def collect_garbage(self) -> tuple:
+        """
+        Prune the versions no active or future read-only transaction can see on every site.
+        Only the variables with new versions are checked unless the watermark moved
+
+        Returns:
+            int: number of versions reclaimed by this pass
+            int: estimated number of bytes reclaimed by this pass
+        """
+        watermark = self.gc_low_watermark()
+        advanced = watermark != self.gc_watermark
+        self.gc_watermark = watermark
+
+        versions = reclaimed = 0
+        # a site with no new version and no version retained has nothing to collect
+        calls = [(site, 'collect_versions', (watermark, advanced)) for site in self.sites
+                 if site.versioned or (advanced and site.retained)]
+        for count, size in self.__gather(calls):
+            versions += count
+            reclaimed += size
+        self.gc_reclaimed_versions += versions
+        self.gc_reclaimed_bytes += reclaimed
+        return versions, reclaimed
+
     def dump(self) -> None:
         """
         Dump all data managers
         """
-        print("\nDUMP\n")
-        for site in self.sites:
-            site : DataManager
-            site.dump()
+        self.log.event('dump_begin')
+        self.__gather([(site, 'dump', ()) for site in self.sites])
+
+    def seed(self, columns: dict) -> None:
+        """[summary]
+        Load the initial value of the variables, instead of 10 * i for x<i>, on a database no transaction ran on.
+        Every site gets the values in one request
+
+        Args:
+            columns (dict): columns of the same length (see columnar.int64), e.g. read by columnar.load:
+                            'variable' the index i of x<i>, 'value' its initial value,
+                            'site' (optional) the id of the only site to set it on, otherwise every site holding it
+        """
+        if self.timestamp or self.transactions:
+            raise RuntimeError("only a database no transaction ran on can be seeded")
+        variables, values = int64(columns['variable']), int64(columns['value'])
+        if len(variables) != len(values):
+            raise ValueError("the variable and value columns have different lengths")
+        if 'site' not in columns:
+            args = self.__seed_values(variables, values)
+            self.__gather([(site, 'seed', args) for site in self.sites])
+            return
+
+        site_ids = int64(columns['site'])
+        if len(site_ids) != len(variables):
+            raise ValueError("the site and variable columns have different lengths")
+        rows = defaultdict(lambda: (array('q'), array('q')))
+        for site_id, i, val in zip(site_ids, variables, values):
+            if not 1 <= site_id <= len(self.sites):
+                raise ValueError("unknown site {}".format(site_id))
+            rows[site_id][0].append(i)
+            rows[site_id][1].append(val)
+        self.__gather([(self.sites[site_id - 1], 'seed', self.__seed_values(*rows[site_id])) for site_id in sorted(rows)])
+
+    def __seed_values(self, variables: array, values: array) -> tuple:
+        """
+        Arguments of DataManager.seed setting x<variables[k]> to values[k],
+        without a loop when every variable is given in order
+        """
+        n = self.num_variables
+        if len(variables) == n and variables == array('q', range(1, n + 1)):
+            return array('q', [0]) + values, None
+        dense = array('q', bytes(8 * (n + 1)))
+        given = bytearray(n + 1)
+        for i, val in zip(variables, values):
+            if not 1 <= i <= n:
+                raise ValueError("unknown variable x{}".format(i))
+            dense[i] = val
+            given[i] = 1
+        return dense, given
+
+    def export(self, variable_ids: list=None, history: bool=False) -> dict:
+        """[summary]
+        The committed versions of the variables on every site as columns of int64,
+        columnar.save writes them to a .npz file and columnar.to_numpy makes NumPy arrays of them
+
+        Args:
+            variable_ids (list): the variables to export, e.g. ['x2', 'x4'], None for all of them
+            history (bool): every version kept for the read-only transactions, otherwise only the last committed one
+
+        Returns:
+            dict: 'site', 'variable' (the index i of x<i>), 'timestamp' (commit time) and 'value' of every version,
+                  by site, then in the order of the variables on the site, then oldest first
+        """
+        columns = {name: array('q') for name in ('site', 'variable', 'timestamp', 'value')}
+        results = self.__gather([(site, 'export', (variable_ids, history)) for site in self.sites])
+        for site, (indexes, timestamps, values) in zip(self.sites, results):
+            columns['site'].extend(array('q', [site.id]) * len(indexes))
+            columns['variable'].extend(indexes)
+            columns['timestamp'].extend(timestamps)
+            columns['value'].extend(values)
+        return columns
 
     def end(self, transaction_id: str) -> None:
         """"
         Aborts the transaction if TRAN_STATUS.ABORTED when ends
         Commit the transaction otherwise
         """
-        if transaction_id not in self.transactions:
-            if self.debug: print("Error: Invalid transaction_id: {} to end".format(transaction_id))
+        ts : Transaction = self.transactions.get(transaction_id)
+        if ts is None or ts.status == TRAN_STATUS.COMMITTING:
+            self.log.event('invalid_end', transaction=transaction_id)
             return
-        ts : Transaction = self.transactions[transaction_id]
-        if ts.status == TRAN_STATUS.ABORTED:
+        if self.commit_window and self.pending_commits and self.transaction_commands.get(transaction_id):
+            # its commands may wait for the locks of the pending commits, which a plain commit would have
+            # released already: they run before the transaction ends, or its writes would be lost
+            self.flush_commits()
+            self.__run_commands()
+            self.end(transaction_id)
+        elif ts.status == TRAN_STATUS.ABORTED:
+            if self.metrics is not None:
+                self.metrics.failure_aborts += 1
             self.__abort(transaction_id)
-        elif ts.status == TRAN_STATUS.COMMITTED:
+        elif self.commit_window and not self.transaction_commands.get(transaction_id):
+            # its locks are held until the group is committed
+            ts.status = TRAN_STATUS.COMMITTING
+            self.pending_commits.append((transaction_id, self.timestamp, ts.unsent or None))
+        else:
+            # with a commit window, its commands still wait for running transactions:
+            # it commits at once, its requests left on the sites must not be granted while it is pending
             self.__commit(transaction_id)
 
     def fail(self, site_id: int) -> None:
-        if site_id not in set(range(10)):
-            if self.debug: print("Error: Invalid site id: {} to fail".format(site_id + 1)) # site_id is index
+        if not 0 <= site_id < len(self.sites):
+            self.log.event('invalid_fail', site=site_id + 1) # site_id is index
             return
         
         site : DataManager = self.sites[site_id]
-        site.fail()
-
-        for tid in site.visiting_variables.keys():
+        for tid in site.fail():
             if self.transactions.get(tid):
                 t : Transaction = self.transactions[tid]
                 t.status = TRAN_STATUS.ABORTED
+        self.__forget_reads()
 
-        if self.debug: print("Site: {} failed".format(site_id + 1)) # site_id is index
+        self.log.event('site_fail', site=site_id + 1) # site_id is index
     
     def recover(self, site_id: int) -> None:
-        if site_id not in set(range(10)):
-            if self.debug: print("Error: Invalid site id: {} to recover".format(site_id + 1)) # site_id is index
+        if not 0 <= site_id < len(self.sites):
+            self.log.event('invalid_recover', site=site_id + 1) # site_id is index
             return
 
         site : DataManager = self.sites[site_id]
@@ -216,112 +1029,225 @@ class TransactionManager:
             return
 
         ret = site.recover()
-        if self.debug and ret: print("Successfully recovered site %s." % (site_id + 1)) # site_id is index
+        if ret and site.mapped:
+            # a mapped site only reports the variables in use, wake up the commands waiting on the others too
+            for key in self.lock_waiters:
+                if key[0] == site.id:
+                    self.lock_events.add(key)
+        if ret:
+            self.__forget_reads()
+            self.log.event('site_recover', site=site_id + 1) # site_id is index
+
+    def __forget_reads(self) -> None:
+        """
+        The sites working changed, the next read of every variable goes to the replica the routing picks now
+        """
+        for ts in self.transactions.values():
+            ts.reads.clear()
 
     def __abort(self, transaction_id: str) -> None:
         """
         Called by self.end()
         Abort the transaction to all the data managers
         """
-        for site in self.sites:
-            site : DataManager
-            site.abort(transaction_id)
+        self.__gather([(site, 'abort', (transaction_id,)) for site in self.__visited_sites((transaction_id,))])
 
         ts : Transaction = self.transactions[transaction_id]
         ts.status = TRAN_STATUS.ABORTED
         self.transactions.pop(transaction_id)
-        if self.debug: print("Aborted transaction :{}".format(transaction_id))
+        self.read_only_transactions.pop(transaction_id, None)
+        self.read_sites.pop(transaction_id, None)
+        self.__drop_commands(transaction_id)
+        self.log.event('abort', transaction=transaction_id)
         
     def __commit(self, transaction_id: str) -> None:
         """
         Called by self.end()
         Commits the transaction to all the data managers
         """
-        for site in self.sites:
-            site : DataManager
-            site.commit(transaction_id, self.timestamp)
+        unsent = self.transactions[transaction_id].unsent or None
+        self.__gather([(site, 'commit', (transaction_id, self.timestamp, unsent))
+                       for site in self.__visited_sites((transaction_id,))])
         self.transactions.pop(transaction_id)
-        if self.debug: print("Commited transaction: {}".format(transaction_id))
+        self.read_only_transactions.pop(transaction_id, None)
+        self.read_sites.pop(transaction_id, None)
+        self.__drop_commands(transaction_id)
+        if self.gc_on_commit:
+            self.collect_garbage()
+        self.log.event('commit', transaction=transaction_id)
         
-    def __deadlock_detection(self) -> bool:
-        graph = defaultdict(set)    # Using adjacency list to represent the waits-for graph
-                                    # graph[T1] = set(T2), means that T1 -> T2
+    def __prevent_deadlock(self, cmd: Command) -> bool:
+        """
+        Wait-die or wound-wait on a blocked command, decided from the transactions it waits for on its variable,
+        so no waits-for graph is built. Older transactions only wait for younger ones with wait-die,
+        and the other way around with wound-wait, so no cycle can form
 
-        def lock_check(lock, q_lk, v):
-            # (waiting_lock_type, waiting_transaction)
-            if lock == LOCK.READ:
-                if q_lk[0] == LOCK.READ or (len(v.read_lock_list) == 1 and q_lk[1] in v.read_lock_list):
-                    return False
+        Returns:
+            bool: True if a transaction was aborted
+        """
+        requester : Transaction = self.transactions[cmd.transaction_id]
+        blockers = set()
+        if cmd.type in BULK_COMMANDS:
+            calls = [(site, 'blockers', (SITE_KEY, cmd.transaction_id)) for site in self.sites]
+        else:
+            calls = [(site, 'blockers', (cmd.variable_id, cmd.transaction_id))
+                     for site in self.directory.live_replicas(cmd.variable_id)]
+        for holders in self.__gather(calls):
+            blockers |= holders
+
+        if self.deadlock_policy == DEADLOCK_POLICY.WAIT_DIE:
+            older = [holder for holder in map(self.transactions.get, blockers)
+                     if holder is not None and holder.timestamp < requester.timestamp]
+            if older:
+                # the oldest one is named, the blockers come in no particular order
+                self.log.event('die', transaction=requester.id, holder=min(older, key=lambda t: t.timestamp).id)
+                self.__prevention_abort(requester.id)
                 return True
-            return v.lock_by_trans_id != q_lk[1]
-        
-        def q_check(lk1,lk2):
-            if lk1[0] == LOCK.READ and lk2[0] == LOCK.READ:
-                 return False
-            return not lk1[1] == lk2[1]
-
-        # Generate the wait-for graph for the Data Manager 
-        def generate_graph(site : DataManager) -> None:
-            # Iterate all of the variables on the Data Manager
-            for var in site.variables.values():
-                var : Variable
-                if not var.lock_waiting_queue or var.lock == LOCK.NONE:
+            return False
+
+        wounded = []
+        for tid in blockers:
+            holder : Transaction = self.transactions.get(tid)
+            if holder is not None and holder.timestamp > requester.timestamp and holder.status != TRAN_STATUS.COMMITTING:
+                wounded.append(holder)
+        for holder in sorted(wounded, key=lambda t: t.timestamp):
+            self.log.event('wound', transaction=holder.id, requester=requester.id)
+            self.__prevention_abort(holder.id)
+        return bool(wounded)
+
+    def __prevention_abort(self, transaction_id: str) -> None:
+        if self.metrics is not None:
+            self.metrics.deadlock_aborts += 1
+        self.__abort(transaction_id)
+
+    def flush_commits(self) -> None:
+        """
+        Apply the pending commits together with one pass over every site,
+        each transaction keeps the time it ended as its commit time
+        """
+        group = self.pending_commits
+        if not group:
+            return
+        self.pending_commits = []
+        self.__gather([(site, 'commit_group', (group,))
+                       for site in self.__visited_sites([transaction_id for transaction_id, _, _ in group])])
+        for transaction_id, _, _ in group:
+            self.transactions.pop(transaction_id)
+            self.read_only_transactions.pop(transaction_id, None)
+            self.read_sites.pop(transaction_id, None)
+        if self.gc_on_commit:
+            self.collect_garbage()
+        for transaction_id, _, _ in group:
+            self.log.event('commit', transaction=transaction_id)
+
+    def __update_waits_for_graph(self) -> None:
+        """
+        Refresh the waits-for edges of the changed locks,
+        the waiting side of every new edge becomes a candidate for the cycle detection
+        """
+        self.changed_locks |= self.lock_events
+        for key in self.changed_locks:
+            site_id, var_id = key
+            site : DataManager = self.sites[site_id - 1]
+            old_edges = self.lock_edges.pop(key, set())
+            new_edges = site.waits_for_edges(var_id)
+            if new_edges:
+                self.lock_edges[key] = new_edges
+
+            for waiter, holder in old_edges - new_edges:
+                succ = self.waits_for[waiter]
+                succ[holder] -= 1
+                if succ[holder] == 0:
+                    del succ[holder]
+                    if not succ:
+                        del self.waits_for[waiter]
+            for waiter, holder in new_edges - old_edges:
+                succ = self.waits_for[waiter]
+                succ[holder] = succ.get(holder, 0) + 1
+                self.deadlock_candidates.add(waiter)
+        self.changed_locks.clear()
+
+    def __cycle_nodes(self, roots: set) -> set:
+        """
+        Find the transactions lying on a cycle reachable from the roots,
+        i.e. the members of the strongly connected components with more than one transaction.
+        Iterative Tarjan's algorithm, so long wait chains don't hit the recursion limit
+        """
+        index, low = {}, {}
+        stack, on_stack = [], set()
+        result = set()
+        counter = 0
+        for root in roots:
+            if root in index:
+                continue
+            index[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(list(self.waits_for.get(root, ()))))]
+            while work:
+                node, neighbors = work[-1]
+                pushed = False
+                for neighbor in neighbors:
+                    if neighbor not in index:
+                        index[neighbor] = low[neighbor] = counter
+                        counter += 1
+                        stack.append(neighbor)
+                        on_stack.add(neighbor)
+                        work.append((neighbor, iter(list(self.waits_for.get(neighbor, ())))))
+                        pushed = True
+                        break
+                    elif neighbor in on_stack:
+                        low[node] = min(low[node], index[neighbor])
+                if pushed:
                     continue
 
-                curr_lock = var.lock
-                # Iterate through the variable's lock_waiting_queue
-                for lk in list(var.lock_waiting_queue):
-                    if lock_check(curr_lock,lk,var):
-                        if curr_lock == LOCK.READ:
-                            for tid in var.read_lock_list:
-                                if tid != lk[1]:
-                                    graph[lk[1]].add(tid)
-                                    # print(lk[11],tid)
-                        else:
-                            if var.lock_by_trans_id == lk[1]:
-                                continue
-                            graph[lk[1]].add(var.lock_by_trans_id)
-                            # print(lk[1],var.lock_by_trans_id)
-
-                # T’ is ahead of T on the wait queue for x and T’ seeks a conflicting lock on x.
-                for j in range(len(var.lock_waiting_queue)):
-                    for i in range(j):
-                        if q_check(var.lock_waiting_queue[i],var.lock_waiting_queue[j]):
-                            graph[var.lock_waiting_queue[j][1]].add(var.lock_waiting_queue[i][1])
-
-        # Using dfs to detect if there's any cycle in the transaction graph
-        def cycle(n, root, visited : set, g : defaultdict(set)) -> bool:
-            visited.add(n)
-            for neighbor in g[n]:
-                if neighbor == root:
-                    return True
-                if neighbor not in visited:
-                    if cycle(neighbor,root,visited,g):
-                        return True
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    if len(component) > 1:
+                        result.update(component)
+        return result
+
+    def __deadlock_detection(self) -> bool:
+        """
+        Abort the youngest transaction lying on a cycle of the waits-for graph.
+        The graph is maintained incrementally and only the transactions with new edges,
+        or left on a cycle by the last detection, are checked
+        """
+        self.__update_waits_for_graph()
+        if not self.deadlock_candidates:
             return False
-        
-        # Step 1: Generate the waits-for graph for all working Data manager
-        for site in self.sites:
-            site : DataManager
-            if site.on_flag == False:
-                continue
-            generate_graph(site)
-        
-        # Step 2: Deadlock detection using dfs
+
+        # Nodes still on a cycle after the abort are checked again next time
+        self.deadlock_candidates = self.__cycle_nodes(self.deadlock_candidates)
+
+        # finding the youngest transaction to abort
         aborted_transaction_id = None
         aborted_transaction_timestamp = float('-inf')
-        for node in list(graph.keys()):
-            if cycle(node,node, visited=set(), g=graph):
-                aborted_transaction : Transaction = self.transactions[node]
-  
-                # finding the youngest transaction to abort
-                if aborted_transaction.timestamp > aborted_transaction_timestamp:
-                    aborted_transaction_id = node
-                    aborted_transaction_timestamp = aborted_transaction.timestamp
-
-        # Step 3: Generating outputs
+        for node in self.deadlock_candidates:
+            aborted_transaction : Transaction = self.transactions.get(node)
+            if aborted_transaction is None or aborted_transaction.status == TRAN_STATUS.COMMITTING:
+                continue
+            if aborted_transaction.timestamp > aborted_transaction_timestamp:
+                aborted_transaction_id = node
+                aborted_transaction_timestamp = aborted_transaction.timestamp
+
+        # Generating outputs
         if aborted_transaction_id != None:
-            print("Deadlock! Transaction {} aborted".format(aborted_transaction_id))
+            self.log.event('deadlock', transaction=aborted_transaction_id)
+            self.deadlock_candidates.discard(aborted_transaction_id)
+            if self.metrics is not None:
+                self.metrics.deadlock_aborts += 1
             self.__abort(aborted_transaction_id)
             return True
-        return False
\ No newline at end of file
+        return False
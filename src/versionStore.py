@@ -0,0 +1,94 @@
+import sys
+from bisect import bisect_right
+
+POINTER_SIZE = 8    # bytes of a list slot
+
+class VersionStore:
+    __slots__ = ('timestamps', 'values')
+
+    def __init__(self, val: int, timestamp: int=0) -> None:
+        """[summary]
+        Committed versions of a variable, kept as parallel arrays sorted by commit time
+
+        timestamps (list): commit time of each version, increasing
+        values (list): value of each version
+        """
+        self.timestamps = [timestamp]
+        self.values = [val]
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def latest(self) -> int:
+        """
+        The value of the last committed version
+        """
+        return self.values[-1]
+
+    def latest_timestamp(self) -> int:
+        return self.timestamps[-1]
+
+    def at(self, timestamp: int, default: int=0) -> int:
+        """[summary]
+        The value of the latest version committed at or before the timestamp
+
+        Args:
+            timestamp (int): e.g. the start time of a read-only transaction
+            default (int): returned if no version is that old
+
+        Returns:
+            int: the value
+        """
+        i = bisect_right(self.timestamps, timestamp)
+        if i == 0:
+            return default
+        return self.values[i - 1]
+
+    def append(self, timestamp: int, val: int) -> None:
+        """
+        Add a version committed at timestamp, which is not older than the last version.
+        A version committed at the same time replaces the last one
+        """
+        if self.timestamps[-1] == timestamp:
+            self.values[-1] = val
+            return
+        self.timestamps.append(timestamp)
+        self.values.append(val)
+
+    def extend(self, timestamps: list, values: list) -> None:
+        """
+        Bulk append of versions sorted by commit time, all newer than the last version
+        """
+        if timestamps and timestamps[0] == self.timestamps[-1]:
+            self.values[-1] = values[0]
+            timestamps, values = timestamps[1:], values[1:]
+        self.timestamps.extend(timestamps)
+        self.values.extend(values)
+
+    def items(self):
+        """
+        (timestamp, value) of every version, oldest first
+        """
+        return zip(self.timestamps, self.values)
+
+    def prune(self, watermark: int) -> tuple:
+        """[summary]
+        Drop the versions no snapshot at or after the watermark can see,
+        keeping the latest version committed at or before it
+
+        Args:
+            watermark (int): start time of the oldest snapshot that may still read the variable
+
+        Returns:
+            int: number of versions dropped
+            int: estimated number of bytes reclaimed
+        """
+        i = bisect_right(self.timestamps, watermark) - 1
+        if i <= 0:
+            return 0, 0
+        reclaimed = 2 * POINTER_SIZE * i
+        for j in range(i):
+            reclaimed += sys.getsizeof(self.timestamps[j]) + sys.getsizeof(self.values[j])
+        del self.timestamps[:i]
+        del self.values[:i]
+        return i, reclaimed